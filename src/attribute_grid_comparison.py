@@ -24,14 +24,24 @@ License:
 -----------------------------------------------------------------------------"""
 import os
 import sys
-import platform
 import itertools
 
-import arcpy
-from arcpy import env
-from arcpy import da
+try:
+    import arcpy
+    from arcpy import env
+    from arcpy import da
+except ImportError:
+    # Without ArcGIS Only the io_backend Based Kernels Can Run
+    arcpy = env = da = None
 import numpy as np
 import pandas as pd
+from spatial_index import build_fc_index
+from ranking import classify, parse_breaks, COMPLETENESS_BREAKS
+from metadata_cache import describe, list_fields, field_names
+from snapshot_cache import snapshot_chunks
+from table_writer import frame_to_array
+from io_backend import get_backend, calc_chunk_size
+from profiling import start_profile, finish_profile, profile_path, stage
 #--------------------------------------------------------------------------
 class FunctionError(Exception):
     """ raised when a function fails to run """
@@ -67,24 +77,6 @@ def grouper_it(n, iterable):
             return
         yield itertools.chain((first_el,), chunk_it)
 #--------------------------------------------------------------------------
-def calc_chunk_size():
-    """determines the chunk size based on 32 vs 64-bit python"""
-    try:
-        if platform.architecture()[0].lower() == "32bit":
-            return 50000
-        else:
-            return 500000
-    except:
-        line, filename, synerror = trace()
-        raise FunctionError(
-                {
-                    "function": "calc_chunk_size",
-                    "line": line,
-                    "filename": __file__,
-                    "synerror": synerror,
-                    "arc" : str(arcpy.GetMessages(2))
-                }
-        )
 def replace_null_values(fc,
                         fields="*",
                         oid_field=None,
@@ -96,10 +88,9 @@ def replace_null_values(fc,
     if fields is None or \
        isinstance(fields, list) == False or \
        fields == "*":
-        fields = [field.name for field in arcpy.ListFields(fc) \
-                  if field.type not in ('Geometry', 'Blob', 'Raster')]
+        fields = field_names(fc, exclude_types=('Geometry', 'Blob', 'Raster'))
     if oid_field is None:
-        oid_field = arcpy.Describe(fc).OIDFieldName
+        oid_field = describe(fc).OIDFieldName
     chunk_size = calc_chunk_size()
     if oid_field not in fields:
         fields.append(oid_field)
@@ -118,12 +109,13 @@ def replace_null_values(fc,
             del array
     return fc
 #--------------------------------------------------------------------------
-def calculate_nulls(fc, fields):
+def calculate_nulls(fc, fields, breaks=COMPLETENESS_BREAKS):
     """
     summarizes the number of NULL/None values in a given set of rows
+    and ranks the percent complete against the breakpoints
     """
     try:
-        oid = arcpy.Describe(fc).OIDFieldName
+        oid = describe(fc).OIDFieldName
         if oid not in fields:
             fields.append(oid)
         chunk_size = calc_chunk_size()
@@ -132,12 +124,7 @@ def calculate_nulls(fc, fields):
                 df = pd.DataFrame.from_records(group, columns=cursor.fields)
                 df['NULL_COUNT'] = len(df.columns) - df.count(axis=1)
                 df['PERCENT_COMP'] = 100 - (100 * (df['NULL_COUNT'] / (len(fields) -1)))
-                df['RANKING'] = -1
-                df.loc[(df['PERCENT_COMP'] >= 0.0) & (df['PERCENT_COMP'] <= 20), 'RANKING'] = 1
-                df.loc[(df['PERCENT_COMP'] > 20) & (df['PERCENT_COMP'] <= 40), 'RANKING'] = 2
-                df.loc[(df['PERCENT_COMP'] > 40) & (df['PERCENT_COMP'] <= 60), 'RANKING'] = 3
-                df.loc[(df['PERCENT_COMP'] > 60) & (df['PERCENT_COMP'] <= 80), 'RANKING'] = 4
-                df.loc[(df['PERCENT_COMP'] > 80), 'RANKING'] = 5
+                df['RANKING'] = classify(df['PERCENT_COMP'].values, breaks)
                 columns=[oid, "NULL_COUNT", "PERCENT_COMP", "RANKING"]
                 copy_df = df[columns].copy()
                 arcpy.da.ExtendTable(fc,
@@ -158,6 +145,117 @@ def calculate_nulls(fc, fields):
                 }
                 )
 #--------------------------------------------------------------------------
+def _statistics_array(index, frames, suffix):
+    """
+    sums NULL_COUNT, PERCENT_COMP and RANKING of DataFrames with a SHAPE
+    column over the grid polygons their features intersect
+    """
+    fields = ['NULL_COUNT', 'PERCENT_COMP', 'RANKING']
+    count = np.zeros(len(index))
+    sums = dict((field, np.zeros(len(index))) for field in fields)
+    for df in frames:
+        feature, poly = index.intersecting_pairs(df['SHAPE'].values)
+        count += np.bincount(poly, minlength=len(index))
+        for field in fields:
+            values = df[field].values.astype(np.float64)[feature]
+            sums[field] += np.bincount(poly, weights=values,
+                                       minlength=len(index))
+        del df, feature, poly
+    hit = count > 0
+    array = np.zeros(int(hit.sum()),
+                     np.dtype([('FID_grid', '<i4'),
+                               ('NULL_COUNT_%s' % suffix, '<f8'),
+                               ('PERCENT_COMP_%s' % suffix, '<f8'),
+                               ('RANKING_%s' % suffix, '<f8')]))
+    array['FID_grid'] = index.ids[hit]
+    array['NULL_COUNT_%s' % suffix] = sums['NULL_COUNT'][hit]
+    array['PERCENT_COMP_%s' % suffix] = sums['PERCENT_COMP'][hit] / count[hit]
+    array['RANKING_%s' % suffix] = sums['RANKING'][hit] / count[hit]
+    return array
+#--------------------------------------------------------------------------
+def _cursor_frames(fc, fields, spatial_reference, chunk_size):
+    """yields DataFrames of the fields and SHAPE (WKB) of fc"""
+    for df in get_backend(fc).read_chunks(fc, fields + ['SHAPE@WKB'],
+                                          chunk_size=chunk_size,
+                                          spatial_reference=spatial_reference):
+        yield df
+#--------------------------------------------------------------------------
+def _null_frames(chunks, fields, breaks):
+    """adds the calculate_nulls columns to DataFrame chunks"""
+    for df in chunks:
+        df['NULL_COUNT'] = df[fields].isnull().sum(axis=1)
+        df['PERCENT_COMP'] = 100 - (100 * (df['NULL_COUNT'] / len(fields)))
+        df['RANKING'] = classify(df['PERCENT_COMP'].values, breaks)
+        yield df
+#--------------------------------------------------------------------------
+def grid_statistics(index, fc, suffix, spatial_reference=None):
+    """
+    summarizes the null counts of the features intersecting each grid
+    polygon using an in memory spatial index (same output as Intersect
+    followed by Statistics)
+    Inputs:
+     index - spatial_index.PolygonIndex of the grid
+     fc - feature class with NULL_COUNT, PERCENT_COMP and RANKING
+     suffix - OLD or NEW, appended to the output field names
+     spatial_reference - spatial reference of the grid
+    Output:
+     numpy array with FID_grid, NULL_COUNT_<suffix> (sum),
+     PERCENT_COMP_<suffix> (mean) and RANKING_<suffix> (mean)
+    """
+    try:
+        fields = ['NULL_COUNT', 'PERCENT_COMP', 'RANKING']
+        return _statistics_array(index,
+                                 _cursor_frames(fc, fields, spatial_reference,
+                                                calc_chunk_size()),
+                                 suffix)
+    except:
+        line, filename, synerror = trace()
+        raise FunctionError(
+                {
+                "function": "grid_statistics",
+                "line": line,
+                "filename": filename,
+                "synerror": synerror,
+                "arc" : str(arcpy.GetMessages(2))
+                }
+                )
+#--------------------------------------------------------------------------
+def snapshot_grid_statistics(index, fc, fields, suffix, cache_dir,
+                             spatial_reference=None, breaks=COMPLETENESS_BREAKS):
+    """
+    grid_statistics of a feature class read from the snapshot cache. The
+    null counts are calculated while reading, as calculate_nulls does, so
+    the feature class is neither copied nor extended.
+    Inputs:
+     index - spatial_index.PolygonIndex of the grid
+     fc - feature class
+     fields - compared fields
+     suffix - OLD or NEW, appended to the output field names
+     cache_dir - snapshot cache folder
+     spatial_reference - spatial reference of the grid
+     breaks - percent complete breakpoints
+    Output:
+     see grid_statistics
+    """
+    try:
+        chunks = snapshot_chunks(fc, list(fields) + ['SHAPE@WKB'],
+                                 cache_dir=cache_dir,
+                                 spatial_reference=spatial_reference)
+        return _statistics_array(index,
+                                 _null_frames(chunks, list(fields), breaks),
+                                 suffix)
+    except:
+        line, filename, synerror = trace()
+        raise FunctionError(
+                {
+                "function": "snapshot_grid_statistics",
+                "line": line,
+                "filename": filename,
+                "synerror": synerror,
+                "arc" : str(arcpy.GetMessages(2))
+                }
+                )
+#--------------------------------------------------------------------------
 def main(*argv):
     """ main driver of program """
     try:
@@ -166,10 +264,16 @@ def main(*argv):
         polygon_grid = argv[2]
         fields = str(argv[3]).split(';')#argv[3]
         out_gdb = argv[4]
+        # Optional Overlay Engine (argv[5] Is the Output Parameter)
+        engine = argv[6] if len(argv) > 6 and argv[6] else "tree"
+        # Optional Ranking Breakpoints, e.g. 20;40;60;80
+        breaks = parse_breaks(argv[7] if len(argv) > 7 else None, COMPLETENESS_BREAKS)
+        # Optional Snapshot Cache Folder for the Old Feature Class (Tree Engine)
+        cache_dir = argv[8] if len(argv) > 8 and argv[8] else None
+        use_snapshot = cache_dir is not None and engine.lower() == "tree"
         #   Local Variables
         #
         scratchGDB = env.scratchGDB
-        scratchFolder = env.scratchFolder
         copy_grid = os.path.join(out_gdb, "grid")
         copy_old_fc = os.path.join(scratchGDB, os.path.basename(old_fc) + "_old")
         copy_new_fc = os.path.join(scratchGDB, os.path.basename(new_fc) + "_new")
@@ -177,12 +281,11 @@ def main(*argv):
         intNew = os.path.join(scratchGDB, "intnew")
         sumOld = os.path.join(scratchGDB, "sum_old")
         sumNew = os.path.join(scratchGDB, "sum_new")
-        temp_csv = os.path.join(scratchFolder, "temp_csv.csv")
         #  Logic
         #
         #  Validate that fields exist in both tables
-        old_fc_flds = {field.name for field in arcpy.ListFields(old_fc) if field.name in fields}
-        new_fc_flds = {field.name for field in arcpy.ListFields(new_fc) if field.name in fields}
+        old_fc_flds = {field.name for field in list_fields(old_fc) if field.name in fields}
+        new_fc_flds = {field.name for field in list_fields(new_fc) if field.name in fields}
         if len(new_fc_flds) != len(old_fc_flds):
             missing = list(old_fc_flds-new_fc_flds) + list(new_fc_flds-old_fc_flds)
 
@@ -190,45 +293,70 @@ def main(*argv):
             fields = [fields.remove(v) for v in missing if v in fields]
         if len(fields) == 0:
             raise Exception("All fields provided do not exist in each dataset.  Nothing to compare.")
+        value_fields = list(fields)
+        start_profile("attribute_grid_comparison",
+                      profile_path(out_gdb, "attribute_grid_comparison"))
         #copy the data
-        copy_grid = arcpy.CopyFeatures_management(polygon_grid, copy_grid)[0]
-        copy_old_fc = arcpy.FeatureClassToFeatureClass_conversion(old_fc,
-                                                                  out_path=os.path.dirname(copy_old_fc),
-                                                                  out_name=os.path.basename(copy_old_fc))[0]
-        copy_new_fc = arcpy.FeatureClassToFeatureClass_conversion(new_fc,
-                                                                  out_path=os.path.dirname(copy_new_fc),
-                                                                  out_name=os.path.basename(copy_new_fc))[0]
+        with stage("copy"):
+            copy_grid = arcpy.CopyFeatures_management(polygon_grid, copy_grid)[0]
+            if not use_snapshot:
+                copy_old_fc = arcpy.FeatureClassToFeatureClass_conversion(old_fc,
+                                                                          out_path=os.path.dirname(copy_old_fc),
+                                                                          out_name=os.path.basename(copy_old_fc))[0]
+            copy_new_fc = arcpy.FeatureClassToFeatureClass_conversion(new_fc,
+                                                                      out_path=os.path.dirname(copy_new_fc),
+                                                                      out_name=os.path.basename(copy_new_fc))[0]
 
         # get the null counts
-        oldResult = calculate_nulls(copy_old_fc, fields)
-        newResult = calculate_nulls(copy_new_fc, fields)
-        #  Intersect Polygon with old/new
-        intOld = arcpy.Intersect_analysis(in_features=[copy_grid, copy_old_fc],
-                                          out_feature_class=intOld,
-                                          join_attributes="ALL",
-                                          cluster_tolerance="-1 Unknown",
-                                          output_type="INPUT")[0]
-        intNew = arcpy.Intersect_analysis(in_features=[copy_grid, copy_new_fc],
-                                          out_feature_class=intNew,
-                                          join_attributes="ALL",
-                                          cluster_tolerance="-1 Unknown",
-                                          output_type="INPUT")[0]
-        #  Aggregavte and Average out ranking by grid OID
+        with stage("nulls"):
+            if not use_snapshot:
+                oldResult = calculate_nulls(copy_old_fc, fields, breaks)
+            newResult = calculate_nulls(copy_new_fc, fields, breaks)
         case_field = "FID_%s" % os.path.basename(copy_grid)
-        sumOld = arcpy.Statistics_analysis(in_table=intOld,
-                                  out_table=sumOld,
-                                  statistics_fields="NULL_COUNT SUM;PERCENT_COMP MEAN;RANKING MEAN",
-                                  case_field=case_field)[0]
-        sumNew = arcpy.Statistics_analysis(in_table=intNew,
-                                  out_table=sumNew,
-                                  statistics_fields="NULL_COUNT SUM;PERCENT_COMP MEAN;RANKING MEAN",
-                                  case_field=case_field)[0]
-        array_old = da.TableToNumPyArray(sumOld, [case_field, 'SUM_NULL_COUNT', 'MEAN_PERCENT_COMP', 'MEAN_RANKING'])
-        dtype_old = [('FID_grid', '<i4'), ('NULL_COUNT_OLD', '<f8'), ('PERCENT_COMP_OLD', '<f8'), ('RANKING_OLD', '<f8')]
-        array_old.dtype = dtype_old
-        array_new = da.TableToNumPyArray(sumNew, [case_field, 'SUM_NULL_COUNT', 'MEAN_PERCENT_COMP', 'MEAN_RANKING'])
-        dtype_new = [('FID_grid', '<i4'), ('NULL_COUNT_NEW', '<f8'), ('PERCENT_COMP_NEW', '<f8'), ('RANKING_NEW', '<f8')]
-        array_new.dtype = dtype_new
+        if engine.lower() == "tree":
+            #  Assign Features to Grid Polygons with a Spatial Index
+            sr = arcpy.Describe(copy_grid).spatialReference
+            with stage("index") as span:
+                index = build_fc_index(copy_grid)
+                span.rows = len(index)
+            with stage("statistics"):
+                if use_snapshot:
+                    array_old = snapshot_grid_statistics(index, old_fc, value_fields,
+                                                         'OLD', cache_dir, sr, breaks)
+                else:
+                    array_old = grid_statistics(index, copy_old_fc, 'OLD', sr)
+                array_new = grid_statistics(index, copy_new_fc, 'NEW', sr)
+            dtype_old = array_old.dtype.descr
+            dtype_new = array_new.dtype.descr
+        else:
+            #  Intersect Polygon with old/new
+            with stage("intersect"):
+                intOld = arcpy.Intersect_analysis(in_features=[copy_grid, copy_old_fc],
+                                                  out_feature_class=intOld,
+                                                  join_attributes="ALL",
+                                                  cluster_tolerance="-1 Unknown",
+                                                  output_type="INPUT")[0]
+                intNew = arcpy.Intersect_analysis(in_features=[copy_grid, copy_new_fc],
+                                                  out_feature_class=intNew,
+                                                  join_attributes="ALL",
+                                                  cluster_tolerance="-1 Unknown",
+                                                  output_type="INPUT")[0]
+            #  Aggregavte and Average out ranking by grid OID
+            with stage("statistics"):
+                sumOld = arcpy.Statistics_analysis(in_table=intOld,
+                                          out_table=sumOld,
+                                          statistics_fields="NULL_COUNT SUM;PERCENT_COMP MEAN;RANKING MEAN",
+                                          case_field=case_field)[0]
+                sumNew = arcpy.Statistics_analysis(in_table=intNew,
+                                          out_table=sumNew,
+                                          statistics_fields="NULL_COUNT SUM;PERCENT_COMP MEAN;RANKING MEAN",
+                                          case_field=case_field)[0]
+            array_old = da.TableToNumPyArray(sumOld, [case_field, 'SUM_NULL_COUNT', 'MEAN_PERCENT_COMP', 'MEAN_RANKING'])
+            dtype_old = [('FID_grid', '<i4'), ('NULL_COUNT_OLD', '<f8'), ('PERCENT_COMP_OLD', '<f8'), ('RANKING_OLD', '<f8')]
+            array_old.dtype = dtype_old
+            array_new = da.TableToNumPyArray(sumNew, [case_field, 'SUM_NULL_COUNT', 'MEAN_PERCENT_COMP', 'MEAN_RANKING'])
+            dtype_new = [('FID_grid', '<i4'), ('NULL_COUNT_NEW', '<f8'), ('PERCENT_COMP_NEW', '<f8'), ('RANKING_NEW', '<f8')]
+            array_new.dtype = dtype_new
         # Join stats table back to grid
         df_old = pd.DataFrame(data=array_old, columns=array_old.dtype.fields.keys())
         df_new = pd.DataFrame(data=array_new, columns=array_new.dtype.fields.keys())
@@ -238,18 +366,15 @@ def main(*argv):
         join_df.loc[(join_df['RANKING_OLD'].isnull()), 'RANKING_OLD'] = 0
         join_df.loc[(join_df['RANKING_NEW'].isnull()), 'RANKING_NEW'] = 0
         join_df['DIFF_RANKING'] = join_df['RANKING_NEW'] - join_df['RANKING_OLD']
-        if os.path.isfile(temp_csv):
-            os.remove(temp_csv)
-        join_df.to_csv(temp_csv, columns=[case_field, 'RANKING_OLD',
-                                          'RANKING_NEW','DIFF_RANKING'])
-        array = da.TableToNumPyArray(temp_csv, [case_field, 'RANKING_OLD',
-                                                'RANKING_NEW','DIFF_RANKING'])
+        array = frame_to_array(join_df, [case_field, 'RANKING_OLD',
+                                         'RANKING_NEW','DIFF_RANKING'])
         oid = arcpy.Describe(copy_grid).OIDFieldName
-        da.ExtendTable(copy_grid,
-                       oid,
-                       array,
-                       case_field,
-                       False)
+        with stage("ExtendTable", len(array)):
+            da.ExtendTable(copy_grid,
+                           oid,
+                           array,
+                           case_field,
+                           False)
         with arcpy.da.UpdateCursor(copy_grid,
                                    ['DIFF_RANKING','RANKING_OLD','RANKING_NEW'],
                                    where_clause="DIFF_RANKING IS NULL or RANKING_OLD is NULL or RANKING_NEW is NULL") as urows:
@@ -264,8 +389,6 @@ def main(*argv):
                 urows.updateRow(urow)
                 del urow
             del urows
-        if os.path.isfile(temp_csv):
-            os.remove(temp_csv)
         #  Output
         #
         arcpy.SetParameterAsText(5, copy_grid)
@@ -287,6 +410,8 @@ def main(*argv):
         arcpy.AddError("error on line: %s" % line)
         arcpy.AddError("error in file name: %s" % filename)
         arcpy.AddError("with error message: %s" % synerror)
+    finally:
+        finish_profile()
 #--------------------------------------------------------------------------
 if __name__ == "__main__":
     env.overwriteOutput = True
@@ -23,15 +23,29 @@ import sys
 import shutil
 import pandas as pd
 import numpy as np
-import arcpy
-import xlrd
-import xlwt
-from arcpy import env
-from arcpy import da
-if sys.version_info.major == 3:
-    from arcpy import mp as mapping
-else:
-    from arcpy import mapping
+try:
+    import xlrd
+    import xlwt
+except ImportError:
+    # Only Needed to Read the Query Workbook and Write the Report
+    xlrd = xlwt = None
+try:
+    import arcpy
+    from arcpy import env
+    from arcpy import da
+    if sys.version_info.major == 3:
+        from arcpy import mp as mapping
+    else:
+        from arcpy import mapping
+except ImportError:
+    # Without ArcGIS Only the io_backend Based Kernels Can Run
+    arcpy = env = da = mapping = None
+from measure import measure_geometries, measure_reference
+from where_clause import WhereClause
+from metadata_cache import describe, list_fields, field_names, spatial_reference
+from io_backend import get_backend, calc_chunk_size
+from process_pool import set_executable
+from profiling import start_profile, finish_profile, profile_path, stage
 
 def assemble_query(xlsx,
                    sheet_name="FGCM Metrics",
@@ -95,7 +109,9 @@ def summary_values(fc,
                    sr=None,
                    sql=None,
                    area_units="SQUAREKILOMETERS",
-                   length_units="KILOMETERS"):
+                   length_units="KILOMETERS",
+                   chunk_size=None,
+                   method="GEODESIC"):
     """
     Inputs:
      fc: table
@@ -103,33 +119,215 @@ def summary_values(fc,
      sql: where clause
      area_units: area units
      length_units: length units
+     chunk_size: number of geometries measured at once
+     method: PLANAR or GEODESIC (the default of getArea/getLength)
     output:
       returns list of Area, Perimter, Length
     """
     #Area, Perimeter/Length
     calculations = [0,0]
-    desc = arcpy.Describe(fc)
+    desc = describe(fc)
     if hasattr(desc, 'shapeType') and \
        desc.shapeType in ('Polygon', 'Polyline'):
-        with da.SearchCursor(fc,
-                             field_names=['SHAPE@'],
-                             where_clause=sql,
-                             spatial_reference=sr) as rows:
-            for row in rows:
-                geom = row[0]
-                if isinstance(geom, arcpy.Polygon):
-                    calculations[0] += round(geom.getArea(units=area_units), 5)
-                    calculations[1] += round(geom.getLength(units=length_units), 5)
-                    #calculations[2] += 1
-                elif isinstance(geom, arcpy.Polyline):
-                    calculations[1] += round(geom.getLength(units=length_units), 5)
-                    #calculations[2] += 1
-                del geom
-                del row
-            del rows
+        if chunk_size is None:
+            chunk_size = calc_chunk_size()
+        sr, params = measure_reference(sr or desc.spatialReference, method)
+        for df in get_backend(fc).read_chunks(fc, ['SHAPE@WKB'],
+                                              chunk_size=chunk_size,
+                                              where_clause=sql,
+                                              spatial_reference=sr):
+            area, length = measure_geometries(df['SHAPE'].values,
+                                              area_units=area_units,
+                                              length_units=length_units,
+                                              **params)
+            calculations[0] += float(np.round(area, 5).sum())
+            calculations[1] += float(np.round(length, 5).sum())
+            del df
         return calculations
     return calculations
 #--------------------------------------------------------------------------
+def query_statistics(fc,
+                     queries,
+                     sr=None,
+                     area_units="SQUAREKILOMETERS",
+                     length_units="KILOMETERS",
+                     chunk_size=None,
+                     method="GEODESIC"):
+    """
+    evaluates many where clauses against a single scan of a table
+    Inputs:
+     fc: table
+     queries: list of where clauses
+     sr: spatial reference object
+     area_units: area units
+     length_units: length units
+     chunk_size: number of rows read at once
+     method: PLANAR or GEODESIC (the default of getArea/getLength)
+    output:
+      returns a list of [Count, Area, Perimeter/Length] per query
+    """
+    desc = describe(fc)
+    measured = hasattr(desc, 'shapeType') and \
+               desc.shapeType in ('Polygon', 'Polyline')
+    names = dict((field.name.upper(), field.name)
+                 for field in list_fields(fc))
+    types = dict((field.name.upper(), field.type)
+                 for field in list_fields(fc))
+    clauses = []
+    read_fields = []
+    for sql in queries:
+        try:
+            clause = WhereClause(sql).bind(types)
+            for name in clause.fields:
+                if name not in read_fields:
+                    read_fields.append(name)
+        except ValueError:
+            # Unsupported SQL, Select the Matching Object IDs Instead
+            clause = [chunk['OID@'].values for chunk in
+                      get_backend(fc).read_chunks(fc, ['OID@'], where_clause=sql)]
+            clause = np.concatenate(clause).astype(np.int64) if len(clause) > 0 \
+                     else np.zeros(0, dtype=np.int64)
+        clauses.append(clause)
+    results = [[0, 0, 0] for _ in clauses]
+    if len(clauses) == 0:
+        return results
+    if chunk_size is None:
+        chunk_size = calc_chunk_size()
+    fields = ['OID@'] + [names[name] for name in read_fields]
+    if measured:
+        sr, params = measure_reference(sr or desc.spatialReference, method)
+        fields.append('SHAPE@WKB')
+    for df in get_backend(fc).read_chunks(fc, fields, chunk_size=chunk_size,
+                                          spatial_reference=sr):
+        n = len(df)
+        columns = dict((name, df[fields[i + 1]].values)
+                       for i, name in enumerate(read_fields))
+        if measured:
+            area, length = measure_geometries(df['SHAPE'].values,
+                                              area_units=area_units,
+                                              length_units=length_units,
+                                              **params)
+            area = np.round(area, 5)
+            length = np.round(length, 5)
+        for result, clause in zip(results, clauses):
+            if isinstance(clause, WhereClause):
+                mask = clause.mask(columns, n)
+            else:
+                mask = np.isin(df['OID@'].values, clause)
+            result[0] += int(mask.sum())
+            if measured:
+                result[1] += float(area[mask].sum())
+                result[2] += float(length[mask].sum())
+        del df
+    return results
+#--------------------------------------------------------------------------
+def compare_feature_class(task):
+    """
+    compares the spreadsheet subtypes of one feature class
+    Inputs:
+     task - tuple of (feature class name, spreadsheet queries of the
+            feature class, new FGDB, old FGDB, exists in the new FGDB,
+            exists in the old FGDB)
+    Output:
+      returns a list of basic information rows
+    """
+    fc, subtypes, new_gdb, old_gdb, in_new, in_old = task
+    rows = []
+    if in_new and not in_old:
+        rows.append([fc, "", "", "", "", "", "", "", "", "",
+                     "NO OLDER DATASET TO COMPARE", "", ""])
+    elif not in_new and in_old:
+        rows.append([fc, "", "", "", "", "", "", "", "", "",
+                     "NO NEWER DATASET TO COMPARE", "", ""])
+    elif not in_new and not in_old:
+        rows.append([fc, "", "", "", "", "", "", "", "", "",
+                     "DATASET TO COMPARE ARE MISSING", "", ""])
+    else:
+        new_fc = os.path.join(new_gdb, fc)
+        old_fc = os.path.join(old_gdb, fc)
+        new_fields = field_names(new_fc)
+        old_fields = field_names(old_fc)
+        sr_new = spatial_reference(new_fc).factoryCode
+        sr_old = spatial_reference(old_fc).factoryCode
+        sqls = [subs['query'] for subs in subtypes]
+        old_stats = query_statistics(fc=old_fc, queries=sqls)
+        new_stats = query_statistics(fc=new_fc, queries=sqls)
+        for subs, old_stat, new_stat in zip(subtypes, old_stats, new_stats):
+            ISSUES = []
+            query_info = subs
+            f_code = query_info['F_CODE']
+            subtype = query_info['SUBTYPE']
+            FCSubtype_Description = query_info['FCSubtype_Description']
+            old_cnt = old_stat[0]
+            new_cnt = new_stat[0]
+            calc_old = old_stat[1:]
+            calc_new = new_stat[1:]
+
+            if int(old_cnt) > int(new_cnt):
+                ISSUES.append("RECORDS DELETED")
+            elif int(old_cnt) < int(new_cnt):
+                ISSUES.append("RECORDS ADDED")
+            if sr_new != sr_old:
+                ISSUES.append("DIFFERENT SPAITAL REFERENCE")
+            if len(set(new_fields) - set(old_fields)) > 0:
+                ISSUES.append("FIELDS ADDED")
+            if len(list(set(new_fields) - set(old_fields))) > 0:
+                ISSUES.append("FIELDS REMOVED")
+            diff_area = round((calc_new[0] - calc_old[0]), 4)
+            diff_per = round((calc_new[1] - calc_old[1]), 4)
+            if diff_area > 0:
+                ISSUES.append("AREA ADDED")
+            elif diff_area < 0:
+                ISSUES.append("AREA REMOVED")
+            if diff_per > 0:
+                ISSUES.append("LENGTH ADDED")
+            elif diff_per < 0:
+                ISSUES.append("LENGTH REMOVED")
+            rows.append(
+                [fc,
+                 str(old_cnt),
+                 str(new_cnt),
+                 subtype,
+                 f_code,
+                 FCSubtype_Description,
+                 ",".join(list(set(old_fields) - set(new_fields))),
+                 ",".join(list(set(new_fields) - set(old_fields))),
+                 str(sr_old),
+                 str(sr_new),
+                 ",".join(ISSUES),
+                 diff_per,
+                 diff_area,
+                 ]
+            )
+    return rows
+#--------------------------------------------------------------------------
+def compare_feature_classes(tasks, workers=None, mode="THREAD"):
+    """
+    compares feature classes, optionally in a pool of workers
+    Inputs:
+     tasks - list of compare_feature_class tasks
+     workers - number of threads or processes, None or 1 runs serially
+     mode - THREAD or PROCESS pool
+    Output:
+      returns the basic information rows of every task, in task order
+    """
+    if workers is None or workers <= 1 or len(tasks) <= 1:
+        results = [compare_feature_class(task) for task in tasks]
+    else:
+        if str(mode).upper() == "PROCESS":
+            import multiprocessing
+            set_executable()
+            pool = multiprocessing.Pool(processes=min(workers, len(tasks)))
+        else:
+            from multiprocessing.pool import ThreadPool
+            pool = ThreadPool(processes=min(workers, len(tasks)))
+        try:
+            results = pool.map(compare_feature_class, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    return [row for rows in results for row in rows]
+#--------------------------------------------------------------------------
 def main(*argv):
     """ main driver of program """
     try:
@@ -138,6 +336,10 @@ def main(*argv):
         lookup_spreadsheet = argv[2]#
         sheet_name = argv[3]
         output_format = str(argv[4]).upper() # EXCEL, CSV, FGDB
+        # Optional Number of Feature Classes Compared at Once (argv[5] Is the Output)
+        workers = int(argv[6]) if len(argv) > 6 and argv[6] else None
+        # Optional Worker Type, THREAD or PROCESS
+        pool_mode = str(argv[7]).upper() if len(argv) > 7 and argv[7] else "THREAD"
         #   Local Variable
         #
         scratchFolder = env.scratchFolder
@@ -157,8 +359,11 @@ def main(*argv):
                                    'LENGTH_CHANGE', 'AREA_CHANGE']
         #   Logic
         #
-        queries = assemble_query(xlsx=lookup_spreadsheet,
-                                 sheet_name=sheet_name)
+        start_profile("basic_table_tracking",
+                      profile_path(output_gdb, "basic_table_tracking"))
+        with stage("queries"):
+            queries = assemble_query(xlsx=lookup_spreadsheet,
+                                     sheet_name=sheet_name)
         if os.path.isdir(output_gdb):
             shutil.rmtree(output_gdb, ignore_errors=True)
         output_gdb = arcpy.CreateFileGDB_management(out_folder_path=os.path.dirname(output_gdb),
@@ -189,159 +394,40 @@ def main(*argv):
         env.workspace = old_gdb
         old_fcs = [fc for fc in arcpy.ListFeatureClasses()]
         env.workspace = None
-        for fc in queries.keys():
-            if fc in new_fcs and \
-               fc not in old_fcs:
-                basic_information.append(
-                                        [fc,
-                                         "",
-                                         "",
-                                         "",
-                                         "",
-                                         "",
-                                         "",
-                                         "",
-                                         "",
-                                         "",
-                                         "NO OLDER DATASET TO COMPARE",
-                                         "",
-                                         "",
-                                         ]
-                                    )
-            elif fc not in new_fcs and \
-                 fc in old_fcs:
-                basic_information.append(
-                    [fc,
-                     "",
-                     "",
-                     "",
-                     "",
-                     "",
-                     "",
-                     "",
-                     "",
-                     "",
-                     "NO NEWER DATASET TO COMPARE",
-                     "",
-                     "",
-                     ]
-                )
-            elif fc not in new_fcs and \
-                 fc not in old_fcs:
-                basic_information.append(
-                                    [fc,
-                                     "",
-                                     "",
-                                     "",
-                                     "",
-                                     "",
-                                     "",
-                                     "",
-                                     "",
-                                     "",
-                                     "DATASET TO COMPARE ARE MISSING",
-                                     "",
-                                     "",
-                                     ]
-                )
-            else:
-                new_fc = os.path.join(new_gdb, fc)
-                old_fc = os.path.join(old_gdb, fc)
-                for subs in queries[fc]:
-                    ISSUES = []
-                    query_info = subs
-                    f_code = query_info['F_CODE']
-                    subtype = query_info['SUBTYPE']
-                    FCSubtype_Description = query_info['FCSubtype_Description']
-                    sql = subs['query']
-                    new_fields = [field.name for field in arcpy.ListFields(new_fc) \
-                                  if field.type not in ('OID', 'Geometry')]
-                    old_fields = [field.name for field in arcpy.ListFields(old_fc) \
-                                  if field.type not in ('OID', 'Geometry')]
-
-                    sr_new = arcpy.Describe(new_fc).spatialReference.factoryCode
-                    sr_old = arcpy.Describe(old_fc).spatialReference.factoryCode
-                    if len(sql) > 0:
-                        oldlyr = arcpy.MakeFeatureLayer_management(old_fc, "old", where_clause=sql)[0]
-                        newlyr = arcpy.MakeFeatureLayer_management(new_fc, "new", where_clause=sql)[0]
-                        old_cnt = arcpy.GetCount_management(oldlyr)[0]
-                        new_cnt = arcpy.GetCount_management(newlyr)[0]
-                    else:
-                        old_cnt = arcpy.GetCount_management(old_fc)[0]
-                        new_cnt = arcpy.GetCount_management(new_fc)[0]
-                    if int(old_cnt) > 0:
-                        calc_old = summary_values(fc=old_fc, sql=sql)
-                    else:
-                        calc_old = [0,0]
-                    if int(new_cnt) > 0:
-                        calc_new = summary_values(fc=new_fc, sql=sql)
-                    else:
-                        calc_new = [0,0]
+        tasks = [(fc, queries[fc], new_gdb, old_gdb,
+                  fc in new_fcs, fc in old_fcs) for fc in queries.keys()]
+        with stage("compare", len(tasks)):
+            basic_information = compare_feature_classes(tasks,
+                                                        workers=workers,
+                                                        mode=pool_mode)
 
-                    if int(old_cnt) > int(new_cnt):
-                        ISSUES.append("RECORDS DELETED")
-                    elif int(old_cnt) < int(new_cnt):
-                        ISSUES.append("RECORDS ADDED")
-                    if sr_new != sr_old:
-                        ISSUES.append("DIFFERENT SPAITAL REFERENCE")
-                    if len(set(new_fields) - set(old_fields)) > 0:
-                        ISSUES.append("FIELDS ADDED")
-                    if len(list(set(new_fields) - set(old_fields))) > 0:
-                        ISSUES.append("FIELDS REMOVED")
-                    diff_area = round((calc_new[0] - calc_old[0]), 4)
-                    diff_per = round((calc_new[1] - calc_old[1]), 4)
-                    if diff_area > 0:
-                        ISSUES.append("AREA ADDED")
-                    elif diff_area < 0:
-                        ISSUES.append("AREA REMOVED")
-                    if diff_per > 0:
-                        ISSUES.append("LENGTH ADDED")
-                    elif diff_per < 0:
-                        ISSUES.append("LENGTH REMOVED")
-                    basic_information.append(
-                        [fc,
-                         str(old_cnt),
-                         str(new_cnt),
-                         subtype,
-                         f_code,
-                         FCSubtype_Description,
-                         ",".join(list(set(old_fields) - set(new_fields))),
-                         ",".join(list(set(new_fields) - set(old_fields))),
-                         str(sr_old),
-                         str(sr_new),
-                         ",".join(ISSUES),
-                         diff_per,
-                         diff_area,
-                         ]
-                    )
-            del fc
-
-        if output_format.upper() == "FGDB":
-            icur = da.InsertCursor(tbl, basic_infomation_fields)
-            for row in basic_information:
-                icur.insertRow(row)
-                del row
-            del icur
-            arcpy.SetParameterAsText(5, tbl)
-        elif output_format.upper() == "CSV":
-            if os.path.isfile(csv_file):
-                os.remove(csv_file)
-            df = pd.DataFrame(data=basic_information, columns=basic_infomation_fields)
-            df.to_csv(path_or_buf=csv_file,
-                     columns=basic_infomation_fields, index_label="OID")
-            arcpy.SetParameterAsText(5, csv_file)
-        else:
-            if os.path.isfile(xlsx_file):
-                os.remove(xlsx_file)
-            wb = xlwt.Workbook()
-            sheet = wb.add_sheet("Analysis_Results")
-            for j, col in basic_infomation_fields:
-                sheet.write(0, j, col)
-            for i, row in enumerate(basic_information):
-                for j, col in enumerate(row):
-                    sheet.write(i+1, j, col)
-            wb.save(xlsx_file)
-            arcpy.SetParameterAsText(5, xlsx_file)
+        with stage("export", len(basic_information)):
+            if output_format.upper() == "FGDB":
+                icur = da.InsertCursor(tbl, basic_infomation_fields)
+                for row in basic_information:
+                    icur.insertRow(row)
+                    del row
+                del icur
+                arcpy.SetParameterAsText(5, tbl)
+            elif output_format.upper() == "CSV":
+                if os.path.isfile(csv_file):
+                    os.remove(csv_file)
+                df = pd.DataFrame(data=basic_information, columns=basic_infomation_fields)
+                df.to_csv(path_or_buf=csv_file,
+                         columns=basic_infomation_fields, index_label="OID")
+                arcpy.SetParameterAsText(5, csv_file)
+            else:
+                if os.path.isfile(xlsx_file):
+                    os.remove(xlsx_file)
+                wb = xlwt.Workbook()
+                sheet = wb.add_sheet("Analysis_Results")
+                for j, col in basic_infomation_fields:
+                    sheet.write(0, j, col)
+                for i, row in enumerate(basic_information):
+                    for j, col in enumerate(row):
+                        sheet.write(i+1, j, col)
+                wb.save(xlsx_file)
+                arcpy.SetParameterAsText(5, xlsx_file)
     except arcpy.ExecuteError:
         line, filename, synerror = trace()
         arcpy.AddError("error on line: %s" % line)
@@ -360,6 +446,8 @@ def main(*argv):
         arcpy.AddError("error on line: %s" % line)
         arcpy.AddError("error in file name: %s" % filename)
         arcpy.AddError("with error message: %s" % synerror)
+    finally:
+        finish_profile()
 #--------------------------------------------------------------------------
 if __name__ == "__main__":
     env.overwriteOutput = True
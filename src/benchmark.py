@@ -0,0 +1,384 @@
+"""-----------------------------------------------------------------------------
+Name: benchmark.py
+Purpose: Measures the comparison tools on synthetic snapshot pairs.
+Description: Generates an old and a new GeoPackage snapshot of the same
+        feature class with a controlled number of rows, fields, geometry
+        type and add/delete/modify rates, plus a regular grid. Each tool's
+        engine is run against them through the GeoPackage backend in its
+        own process, so the peak memory of one does not hide another's.
+        Wall time, peak RSS, rows per second and the profiled stages (see
+        profiling.py) are appended to a JSON history. A run is reported as
+        a regression when a tool is slower than the median of the earlier
+        runs with the same parameters by more than the tolerance.
+Usage: python benchmark.py [work folder] [rows] [POINT|POLYLINE|POLYGON]
+        [fields] [grid cells per side] [history file] [tools]
+Requirements: Python 2.7.x/Python3.x
+Copyright: Esri
+License:
+-----------------------------------------------------------------------------"""
+from __future__ import print_function
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import datetime
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+
+from io_backend import get_backend
+from profiling import peak_rss, start_profile, finish_profile
+
+EXTENT = 100000.0
+CODES = ['AL013', 'AL015', 'AP030', 'AQ040', 'BH140', 'BH145', 'EA010',
+         'EC015', 'GB005', 'ZD040', 'AL020', 'AK120']
+WEB_MERCATOR = ('PROJCS["WGS_1984_Web_Mercator_Auxiliary_Sphere",'
+                'GEOGCS["GCS_WGS_1984",DATUM["D_WGS_1984",'
+                'SPHEROID["WGS_1984",6378137.0,298.257223563]],'
+                'PRIMEM["Greenwich",0.0],UNIT["Degree",0.0174532925199433]],'
+                'PROJECTION["Mercator_Auxiliary_Sphere"],UNIT["Meter",1.0]]')
+SRS_ID = 3857
+TOOLS = ['uid_attribute_checking', 'uid_spatial_comparison',
+         'attribute_grid_comparison', 'spatial_grid_comparison',
+         'basic_table_tracking', 'sanitize']
+DEFAULTS = {
+    'rows': 100000,
+    'geom_type': 'POINT',
+    'fields': 20,
+    'grid': 50,
+    'add_rate': 0.05,
+    'delete_rate': 0.05,
+    'modify_rate': 0.1,
+    'seed': 0
+}
+TOLERANCE = 0.25
+#--------------------------------------------------------------------------
+def _wkb(geom_type, x, y, size):
+    """WKB of points, 3 vertex lines or square polygons at x, y"""
+    n = len(x)
+    if geom_type == 'POINT':
+        array = np.zeros(n, dtype=[('order', 'u1'), ('type', '<u4'),
+                                   ('xy', '<f8', (2,))])
+        array['type'] = 1
+        array['xy'] = np.column_stack([x, y])
+    elif geom_type == 'POLYLINE':
+        array = np.zeros(n, dtype=[('order', 'u1'), ('type', '<u4'),
+                                   ('count', '<u4'), ('xy', '<f8', (3, 2))])
+        array['type'] = 2
+        array['count'] = 3
+        array['xy'][:, :, 0] = x[:, None] + np.array([0, size, 2 * size])
+        array['xy'][:, :, 1] = y[:, None] + np.array([0, size, 0])
+    else:
+        array = np.zeros(n, dtype=[('order', 'u1'), ('type', '<u4'),
+                                   ('rings', '<u4'), ('count', '<u4'),
+                                   ('xy', '<f8', (5, 2))])
+        array['type'] = 3
+        array['rings'] = 1
+        array['count'] = 5
+        array['xy'][:, :, 0] = x[:, None] + np.array([0, 0, size, size, 0])
+        array['xy'][:, :, 1] = y[:, None] + np.array([0, size, size, 0, 0])
+    array['order'] = 1
+    buf = array.tobytes()
+    width = array.dtype.itemsize
+    return [buf[i * width:(i + 1) * width] for i in range(n)]
+#--------------------------------------------------------------------------
+def _field_values(rng, i, n):
+    """values of synthetic field i: text codes, integers or doubles"""
+    kind = i % 3
+    if kind == 0:
+        values = np.array(CODES, dtype=object)[rng.randint(0, len(CODES), n)]
+    elif kind == 1:
+        values = rng.randint(0, 100, n).astype(object)
+    else:
+        values = np.round(rng.uniform(0, 1000, n), 3).astype(object)
+    values[rng.uniform(size=n) < 0.05] = None
+    return values
+#--------------------------------------------------------------------------
+def field_definitions(fields):
+    """(name, GeoPackage type) of the synthetic attribute fields"""
+    types = ['TEXT(5)', 'INTEGER', 'DOUBLE']
+    return [('F%d' % i, types[i % 3]) for i in range(fields)]
+#--------------------------------------------------------------------------
+def _write_features(db, name, df, fields, geom_type):
+    backend = get_backend(db)
+    backend._initialize(db)
+    backend.delete(os.path.join(db, name))
+    geometry = {'POINT': 'POINT', 'POLYLINE': 'LINESTRING', 'POLYGON': 'POLYGON'}[geom_type]
+    with backend._session(db) as conn:
+        backend._create_table(conn, name, [('UID', 'INTEGER')] + field_definitions(fields) +
+                              [('EDITED', 'DATETIME')],
+                              (geometry, SRS_ID, WEB_MERCATOR))
+    backend.insert_frame(os.path.join(db, name), df)
+    return os.path.join(db, name)
+#--------------------------------------------------------------------------
+def synthetic_pair(folder, rows=100000, geom_type='POINT', fields=20,
+                   add_rate=0.05, delete_rate=0.05, modify_rate=0.1, seed=0):
+    """
+    writes old.gpkg and new.gpkg snapshots of a feature class named
+    features into folder
+    Inputs:
+     rows - rows of the old snapshot
+     geom_type - POINT, POLYLINE or POLYGON
+     fields - attribute fields besides UID and EDITED
+     add_rate, delete_rate - share of rows added to and deleted from the
+                             new snapshot
+     modify_rate - share of the kept rows with one changed attribute, a
+                   third of them also have a moved geometry
+    Output:
+     tuple of (old feature class, new feature class)
+    """
+    rng = np.random.RandomState(seed)
+    geom_type = geom_type.upper()
+    size = EXTENT / max(100.0, np.sqrt(rows))
+    names = [name for name, _ in field_definitions(fields)]
+    edited = datetime.datetime(2017, 4, 1)
+
+    def frame(ids):
+        n = len(ids)
+        df = pd.DataFrame({'UID': ids}, columns=['UID'] + names + ['EDITED', 'SHAPE'])
+        for i, name in enumerate(names):
+            df[name] = _field_values(rng, i, n)
+        df['EDITED'] = [edited] * n
+        x = rng.uniform(0, EXTENT - 2 * size, n)
+        y = rng.uniform(0, EXTENT - 2 * size, n)
+        df['_X'], df['_Y'] = x, y
+        return df
+
+    old = frame(np.arange(rows))
+    keep = rng.uniform(size=rows) >= delete_rate
+    new = old[keep].reset_index(drop=True)
+    modified = np.flatnonzero(rng.uniform(size=len(new)) < modify_rate)
+    for position in modified:
+        name = names[rng.randint(0, len(names))] if names else None
+        if name is not None:
+            new.at[position, name] = _field_values(rng, names.index(name), 1)[0]
+    moved = modified[:len(modified) // 3]
+    new.loc[moved, '_X'] = new.loc[moved, '_X'] + size / 10.0
+    new.loc[modified, 'EDITED'] = datetime.datetime(2018, 4, 1)
+    adds = frame(np.arange(rows, rows + int(rows * add_rate)))
+    new = pd.concat([new, adds], ignore_index=True)
+    paths = []
+    for label, df in [('old', old), ('new', new)]:
+        df['SHAPE'] = _wkb(geom_type, df['_X'].values, df['_Y'].values, size)
+        paths.append(_write_features(os.path.join(folder, '%s.gpkg' % label), 'features',
+                                     df.drop(['_X', '_Y'], axis=1), fields, geom_type))
+    return tuple(paths)
+#--------------------------------------------------------------------------
+def synthetic_grid(folder, cells=50):
+    """writes a regular grid of cells x cells squares over the extent"""
+    db = os.path.join(folder, 'grid.gpkg')
+    backend = get_backend(db)
+    backend._initialize(db)
+    backend.delete(os.path.join(db, 'grid'))
+    with backend._session(db) as conn:
+        backend._create_table(conn, 'grid', [], ('POLYGON', SRS_ID, WEB_MERCATOR))
+    size = EXTENT / cells
+    x, y = np.meshgrid(np.arange(cells) * size, np.arange(cells) * size)
+    df = pd.DataFrame({'SHAPE': _wkb('POLYGON', x.ravel(), y.ravel(), size)})
+    backend.insert_frame(os.path.join(db, 'grid'), df)
+    return os.path.join(db, 'grid')
+#--------------------------------------------------------------------------
+def _run_tool(tool, folder, old_fc, new_fc, grid_fc, params):
+    """runs the engine of one tool, returns the number of rows it read"""
+    backend = get_backend(new_fc)
+    old_rows = backend.count_rows(old_fc)
+    new_rows = backend.count_rows(new_fc)
+    out_db = os.path.join(folder, '%s.gpkg' % tool)
+    names = [name for name, _ in field_definitions(params['fields'])]
+    if tool == 'uid_attribute_checking':
+        import uid_attribute_checking
+        uid_attribute_checking.stream_comparison(old_fc, new_fc, 'UID', out_db,
+                                                 os.path.join(out_db, 'change_table'))
+        return old_rows + new_rows
+    if tool == 'uid_spatial_comparison':
+        import uid_spatial_comparison
+        uid_spatial_comparison.fingerprint_comparison(old_fc, new_fc, 'UID', out_db)
+        return old_rows + new_rows
+    if tool == 'spatial_grid_comparison':
+        import spatial_grid_comparison
+        grid = spatial_grid_comparison.read_regular_grid(grid_fc)
+        array, method = spatial_grid_comparison.binned_statistics(
+            grid, grid_fc, ['features'], os.path.dirname(old_fc),
+            os.path.dirname(new_fc), params['geom_type'])
+        spatial_grid_comparison.calculate_frequency_ranking(array, method)
+        return old_rows + new_rows
+    if tool == 'attribute_grid_comparison':
+        import attribute_grid_comparison
+        from spatial_index import build_fc_index
+        from metadata_cache import spatial_reference
+        sr = spatial_reference(grid_fc)
+        index = build_fc_index(grid_fc, sr)
+        cache_dir = os.path.join(folder, 'snapshots')
+        for suffix, fc in [('OLD', old_fc), ('NEW', new_fc)]:
+            attribute_grid_comparison.snapshot_grid_statistics(index, fc, names,
+                                                               suffix, cache_dir, sr)
+        return old_rows + new_rows
+    if tool == 'basic_table_tracking':
+        import basic_table_tracking
+        queries = ["F0 = '%s'" % code for code in CODES]
+        if len(names) > 2:
+            queries += ["F1 > 50 AND F0 IN ('AL013', 'AL015')",
+                        "F2 BETWEEN 100 AND 200 OR F2 IS NULL"]
+        # GeoPackages Cannot Be Projected to Their GCS Without ArcGIS
+        basic_table_tracking.query_statistics(new_fc, queries, method="PLANAR")
+        return new_rows
+    if tool == 'sanitize':
+        import sanitize
+        copy_db = os.path.join(folder, 'sanitize.gpkg')
+        if os.path.exists(copy_db):
+            os.remove(copy_db)
+        rule = sanitize.SanitizeRule([name for name in names if name.startswith('F')],
+                                     find_value=None, replace_value=0)
+        sanitize.copy_sanitized(new_fc, copy_db, 'features', [rule])
+        return new_rows
+    raise ValueError("Unknown Tool: %s" % tool)
+#--------------------------------------------------------------------------
+def _run_case(args):
+    """runs one tool in a worker process and measures it"""
+    tool, folder, old_fc, new_fc, grid_fc, params = args
+    start_profile(tool)
+    start = time.time()
+    try:
+        rows = _run_tool(tool, folder, old_fc, new_fc, grid_fc, params)
+        status, message = 'ok', None
+    except Exception as e:
+        rows, status, message = 0, 'error', "%s: %s" % (type(e).__name__, e)
+    seconds = time.time() - start
+    stages = finish_profile(messages=False)['stages']
+    return {
+        'tool': tool,
+        'status': status,
+        'message': message,
+        'rows': rows,
+        'seconds': round(seconds, 4),
+        'rows_per_second': round(rows / seconds, 1) if seconds > 0 else None,
+        'peak_rss_mb': peak_rss(),
+        'stages': stages
+    }
+#--------------------------------------------------------------------------
+def load_history(path):
+    """earlier runs stored in the JSON history file"""
+    if not os.path.isfile(path):
+        return []
+    with open(path) as handle:
+        return json.load(handle)
+#--------------------------------------------------------------------------
+def find_regressions(history, run, tolerance=TOLERANCE):
+    """
+    compares a run with the earlier runs of the same parameters
+    Output:
+     list of dicts with tool, seconds and baseline (median seconds) for
+     every tool that is more than tolerance slower than its baseline
+    """
+    regressions = []
+    for result in run['results']:
+        if result['status'] != 'ok':
+            continue
+        previous = [earlier['seconds'] for past in history
+                    if past['params'] == run['params']
+                    for earlier in past['results']
+                    if earlier['tool'] == result['tool'] and earlier['status'] == 'ok']
+        if len(previous) == 0:
+            continue
+        baseline = float(np.median(previous))
+        if result['seconds'] > baseline * (1 + tolerance):
+            regressions.append({'tool': result['tool'],
+                                'seconds': result['seconds'],
+                                'baseline': round(baseline, 4)})
+    return regressions
+#--------------------------------------------------------------------------
+def run_benchmarks(folder, params=None, tools=None, history_path=None):
+    """
+    generates the synthetic data, runs every tool in its own process and
+    appends the run to the history
+    Inputs:
+     folder - work folder, the synthetic snapshots are reused while the
+              parameters stay the same
+     params - dict overriding DEFAULTS
+     tools - list of tool names, defaults to TOOLS
+     history_path - JSON history, defaults to benchmark_history.json in
+                    folder
+    Output:
+     tuple of (run dict, list of regressions)
+    """
+    run_params = dict(DEFAULTS)
+    run_params.update(params or {})
+    run_params['geom_type'] = run_params['geom_type'].upper()
+    tools = tools or TOOLS
+    if history_path is None:
+        history_path = os.path.join(folder, 'benchmark_history.json')
+    data = os.path.join(folder, 'data')
+    stamp = os.path.join(data, 'params.json')
+    old_fc = os.path.join(data, 'old.gpkg', 'features')
+    new_fc = os.path.join(data, 'new.gpkg', 'features')
+    grid_fc = os.path.join(data, 'grid.gpkg', 'grid')
+    if not os.path.isfile(stamp) or load_history(stamp) != run_params:
+        if os.path.isdir(data):
+            shutil.rmtree(data)
+        os.makedirs(data)
+        print("Generating %s %s Rows..." % (run_params['rows'], run_params['geom_type']))
+        synthetic_pair(data, run_params['rows'], run_params['geom_type'],
+                       run_params['fields'], run_params['add_rate'],
+                       run_params['delete_rate'], run_params['modify_rate'],
+                       run_params['seed'])
+        synthetic_grid(data, run_params['grid'])
+        with open(stamp, 'w') as handle:
+            json.dump(run_params, handle)
+
+    results = []
+    for tool in tools:
+        work = os.path.join(folder, 'runs', tool)
+        if os.path.isdir(work):
+            shutil.rmtree(work)
+        os.makedirs(work)
+        pool = multiprocessing.Pool(1)
+        try:
+            result = pool.apply(_run_case, ((tool, work, old_fc, new_fc, grid_fc,
+                                             run_params),))
+        finally:
+            pool.close()
+            pool.join()
+        print("%-26s %-6s %10.3fs %12s rows/s %10s MB %s" %
+              (tool, result['status'], result['seconds'], result['rows_per_second'],
+               None if result['peak_rss_mb'] is None else round(result['peak_rss_mb'], 1),
+               result['message'] or ""))
+        results.append(result)
+
+    run = {
+        'timestamp': datetime.datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'params': run_params,
+        'results': results
+    }
+    history = load_history(history_path)
+    regressions = find_regressions(history, run)
+    history.append(run)
+    with open(history_path, 'w') as handle:
+        json.dump(history, handle, indent=2)
+    for regression in regressions:
+        print("REGRESSION %(tool)s: %(seconds)ss, baseline %(baseline)ss" % regression)
+    return run, regressions
+#--------------------------------------------------------------------------
+def main(*argv):
+    """ main driver of program """
+    folder = argv[0] if len(argv) > 0 and argv[0] else os.path.join(os.getcwd(), 'benchmarks')
+    params = {}
+    if len(argv) > 1 and argv[1]:
+        params['rows'] = int(argv[1])
+    if len(argv) > 2 and argv[2]:
+        params['geom_type'] = argv[2]
+    if len(argv) > 3 and argv[3]:
+        params['fields'] = int(argv[3])
+    if len(argv) > 4 and argv[4]:
+        params['grid'] = int(argv[4])
+    history_path = argv[5] if len(argv) > 5 and argv[5] else None
+    tools = str(argv[6]).split(';') if len(argv) > 6 and argv[6] else None
+    _, regressions = run_benchmarks(folder, params, tools, history_path)
+    return 1 if regressions else 0
+#--------------------------------------------------------------------------
+if __name__ == "__main__":
+    sys.exit(main(*sys.argv[1:]))
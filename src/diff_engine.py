@@ -0,0 +1,205 @@
+"""-----------------------------------------------------------------------------
+Name: diff_engine.py
+Purpose: Finds the attribute differences between two snapshots of a dataset
+        that share a unique ID field.
+Description: Each row's compared fields are reduced to a 64-bit digest. Only
+        the unique IDs whose digests differ between the old and new snapshot
+        are compared field by field, so the full rows x fields comparison is
+        never materialized for unchanged features.
+Requirements: Python 2.7.x/Python3.x, ArcGIS 10.4+/Pro 1.2+
+Copyright: Esri
+License:
+-----------------------------------------------------------------------------"""
+import pandas as pd
+import numpy as np
+
+HASH_MULTIPLIER = np.uint64(1000003)
+NULL_DIGEST = np.uint64(0x9E3779B97F4A7C15)
+#--------------------------------------------------------------------------
+def row_digests(df, fields):
+    """
+    hashes the given fields of every row into a single uint64 digest.
+    Columns are hashed one at a time so only one column's worth of
+    hashes is held in memory at any point.
+    Inputs:
+     df - pandas DataFrame/SpatialDataFrame
+     fields - list of column names to hash, in a fixed order
+    Output:
+     numpy uint64 array with one digest per row of df
+    """
+    digests = np.zeros(len(df), dtype=np.uint64)
+    for field in fields:
+        col_hash = pd.util.hash_pandas_object(df[field], index=False).values
+        digests *= HASH_MULTIPLIER
+        digests ^= col_hash
+        del col_hash
+    return digests
+#--------------------------------------------------------------------------
+def stable_digests(df, fields):
+    """
+    row digests that do not depend on how a chunk was typed: integer
+    columns are hashed as floats and every NULL (None, NaN or NaT) hashes
+    the same, so digests saved by one run match those of the next
+    Output:
+     numpy uint64 array with one digest per row of df
+    """
+    digests = np.zeros(len(df), dtype=np.uint64)
+    for field in fields:
+        values = df[field]
+        if values.dtype.kind in 'iub':
+            values = values.astype(np.float64)
+        col_hash = pd.util.hash_pandas_object(values, index=False).values.copy()
+        col_hash[values.isnull().values] = NULL_DIGEST
+        digests *= HASH_MULTIPLIER
+        digests ^= col_hash
+        del col_hash, values
+    return digests
+#--------------------------------------------------------------------------
+def duplicate_ids(ids):
+    """
+    finds the unique IDs that occur more than once with a single hash
+    pass over the ID column
+    Output:
+     tuple of (boolean mask of the rows holding a duplicated ID, array of
+     the distinct duplicated IDs)
+    """
+    mask = pd.Series(np.asarray(ids)).duplicated(keep=False).values
+    return mask, pd.unique(np.asarray(ids)[mask])
+#--------------------------------------------------------------------------
+def drop_duplicate_ids(df, unique):
+    """
+    removes every row whose unique ID is duplicated from df in place,
+    without building a deduplicated copy of the frame first
+    Output:
+     array of the distinct duplicated IDs, empty when nothing was dropped
+    """
+    mask, dups = duplicate_ids(df[unique].values)
+    if len(dups) > 0:
+        if not df.index.is_unique:
+            df.reset_index(drop=True, inplace=True)
+        df.drop(index=df.index[mask], inplace=True)
+    return dups
+#--------------------------------------------------------------------------
+def duplicate_table(duplicates, unique):
+    """
+    side table of the dropped duplicates
+    Inputs:
+     duplicates - list of (dataset name, duplicated IDs) pairs
+     unique - name of the unique ID field
+    Output:
+     pandas DataFrame with the columns Dataset and unique
+    """
+    frames = [pd.DataFrame({'Dataset': [name] * len(ids), unique: ids},
+                           columns=['Dataset', unique])
+              for name, ids in duplicates if len(ids) > 0]
+    if len(frames) == 0:
+        return pd.DataFrame(columns=['Dataset', unique])
+    return pd.concat(frames, ignore_index=True)
+#--------------------------------------------------------------------------
+def shared_codes(old_values, new_values):
+    """
+    dictionary encodes the old and new values of a column against one
+    vocabulary so they can be compared as integers
+    Output:
+     tuple of (old codes, new codes) int32 arrays, NULL is coded -1
+    """
+    old_values = np.asarray(old_values, dtype=object)
+    codes, vocabulary = pd.factorize(np.concatenate([old_values,
+                                                     np.asarray(new_values, dtype=object)]))
+    if len(vocabulary) < np.iinfo(np.int32).max:
+        codes = codes.astype(np.int32)
+    return codes[:len(old_values)], codes[len(old_values):]
+#--------------------------------------------------------------------------
+def column_differences(old_values, new_values):
+    """
+    boolean mask of the rows where two aligned columns differ. Text and
+    other object columns are compared through shared_codes. NULL to NULL
+    is not a difference.
+    """
+    old_values = np.asarray(old_values)
+    new_values = np.asarray(new_values)
+    if old_values.dtype.kind in 'OSU' or new_values.dtype.kind in 'OSU':
+        old_codes, new_codes = shared_codes(old_values, new_values)
+        return old_codes != new_codes
+    both_null = pd.isnull(old_values) & pd.isnull(new_values)
+    return (old_values != new_values) & ~both_null
+#--------------------------------------------------------------------------
+def common_positions(old_df, new_df, unique):
+    """
+    finds the unique IDs shared by both frames
+    Output:
+     tuple of (sorted common IDs as a pandas Index,
+               row positions in old_df, row positions in new_df)
+    """
+    old_ids = pd.Index(old_df[unique].values)
+    new_ids = pd.Index(new_df[unique].values)
+    if not old_ids.is_unique or not new_ids.is_unique:
+        raise ValueError("Unique Field Contains Duplicate Values: %s" % unique)
+    common = old_ids.intersection(new_ids).sort_values()
+    return common, old_ids.get_indexer(common), new_ids.get_indexer(common)
+#--------------------------------------------------------------------------
+def compare_attributes(old_df, new_df, unique, fields):
+    """
+    builds the attribute change table for the features found in both
+    the old and new frames.
+    Inputs:
+     old_df - old SpatialDataFrame
+     new_df - new SpatialDataFrame
+     unique - name of the unique ID field
+     fields - list of fields to compare
+    Output:
+     pandas DataFrame indexed by the unique ID with the columns
+     col, from_val and to_val. from_val holds the new value and to_val
+     the old value. Pairs where both values are NULL are not reported.
+    """
+    fields = [field for field in fields if field != unique]
+    common, old_pos, new_pos = common_positions(old_df, new_df, unique)
+
+    # Only Rows With Differing Digests Need a Field by Field Comparison
+    old_digests = row_digests(old_df, fields)[old_pos]
+    new_digests = row_digests(new_df, fields)[new_pos]
+    suspect = old_digests != new_digests
+    del old_digests, new_digests
+
+    old_chg = old_df.iloc[old_pos[suspect], old_df.columns.get_indexer(fields)]
+    new_chg = new_df.iloc[new_pos[suspect], new_df.columns.get_indexer(fields)]
+
+    # Only the Positions of Differing Values Are Kept, Column by Column
+    rows = []
+    for field in fields:
+        rows.append(np.flatnonzero(column_differences(old_chg[field].values,
+                                                      new_chg[field].values)))
+    total = sum(len(positions) for positions in rows)
+    row_pos = np.empty(total, dtype=np.int64)
+    col_pos = np.empty(total, dtype=np.int64)
+    changed_from = np.empty(total, dtype=object)
+    changed_to = np.empty(total, dtype=object)
+    start = 0
+    for i, (field, positions) in enumerate(zip(fields, rows)):
+        stop = start + len(positions)
+        row_pos[start:stop] = positions
+        col_pos[start:stop] = i
+        changed_from[start:stop] = np.asarray(new_chg[field].values, dtype=object)[positions]
+        changed_to[start:stop] = np.asarray(old_chg[field].values, dtype=object)[positions]
+        start = stop
+    del rows
+
+    # Row Major Order, One Feature's Changes Together
+    order = np.lexsort((col_pos, row_pos))
+    index = pd.Index(common[suspect][row_pos[order]], name=unique)
+    df_changes = pd.DataFrame({'col': np.asarray(fields, dtype=object)[col_pos[order]],
+                               'from_val': changed_from[order],
+                               'to_val': changed_to[order]},
+                              index=index)
+    return df_changes[['col', 'from_val', 'to_val']]
+#--------------------------------------------------------------------------
+def changed_features(new_df, unique, df_changes):
+    """
+    selects the new rows that have at least one attribute change and
+    adds an 'Edit Count' column with the number of changed fields
+    """
+    counts = df_changes.groupby(level=0).size()
+    changed = new_df[new_df[unique].isin(counts.index)].copy()
+    changed.index = changed[unique]
+    changed['Edit Count'] = counts
+    return changed
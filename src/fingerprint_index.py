@@ -0,0 +1,161 @@
+"""-----------------------------------------------------------------------------
+Name: fingerprint_index.py
+Purpose: Persists a geometry fingerprint per unique ID for a snapshot so that
+        later comparisons against the same baseline only need fingerprints.
+Description: The index maps every unique ID of a feature class to a uint64
+        hash of its vertex coordinates snapped to the XY resolution. The
+        index of a baseline is built once and saved as a .npz file next to
+        the output geodatabase, unless the baseline has no file system
+        modification time to validate it with. Comparing two indexes yields the added and removed IDs
+        and the IDs whose geometry may have changed; only those need their
+        full geometries loaded.
+Requirements: Python 2.7.x/Python3.x, ArcGIS 10.4+/Pro 1.2+
+Copyright: Esri
+License:
+-----------------------------------------------------------------------------"""
+import os
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+from geometry_compare import geometry_fingerprints
+from metadata_cache import spatial_reference
+from snapshot_cache import snapshot_chunks
+
+INDEX_VERSION = 2
+DEFAULT_QUANTUM = 1e-9
+#--------------------------------------------------------------------------
+def index_path(out_db, fc):
+    """
+    path of the fingerprint index for fc, stored next to out_db. The
+    name carries a hash of the full path so snapshots of a dataset with
+    the same name keep separate indexes.
+    """
+    source = os.path.abspath(str(fc))
+    key = hashlib.md5(source.encode('utf-8')).hexdigest()[:12]
+    name = os.path.splitext(os.path.basename(source))[0]
+    return os.path.join(os.path.dirname(out_db),
+                        "%s_%s_fingerprints.npz" % (name, key))
+#--------------------------------------------------------------------------
+def dataset_quantum(fc):
+    """uses the XY resolution of the dataset as the snapping grid"""
+    try:
+        resolution = spatial_reference(fc).XYResolution
+        if resolution and resolution > 0:
+            return float(resolution)
+    except:
+        pass
+    return DEFAULT_QUANTUM
+#--------------------------------------------------------------------------
+def build_index(ids, geoms, quantum):
+    """
+    builds a fingerprint index from in-memory values
+    Output:
+     pandas Series of uint64 fingerprints indexed by the unique ID.
+     Features sharing an ID are combined into one order independent
+     fingerprint.
+    """
+    fingerprints = pd.Series(geometry_fingerprints(geoms, quantum),
+                             index=pd.Index(ids))
+    if not fingerprints.index.is_unique:
+        fingerprints = fingerprints.groupby(level=0).agg(
+            lambda grp: np.add.reduce(grp.values, dtype=np.uint64))
+    return fingerprints.sort_index()
+#--------------------------------------------------------------------------
+def build_fc_index(fc, unique, quantum, chunk_size=None, cache_dir=None):
+    """
+    builds a fingerprint index by streaming a feature class, so only one
+    chunk of geometries is held in memory at a time. The feature class is
+    read through the snapshot cache when cache_dir is set.
+    """
+    parts = []
+    for chunk in snapshot_chunks(fc, [unique, 'SHAPE@WKB'], unique, cache_dir,
+                                 chunk_size):
+        parts.append(build_index(chunk[unique].values,
+                                 chunk['SHAPE'].values,
+                                 quantum))
+        del chunk
+    if len(parts) == 0:
+        return pd.Series([], dtype=np.uint64)
+    fingerprints = pd.concat(parts)
+    if not fingerprints.index.is_unique:
+        # IDs Straddling Chunk Boundaries
+        fingerprints = fingerprints.groupby(level=0).agg(
+            lambda grp: np.add.reduce(grp.values, dtype=np.uint64))
+    return fingerprints
+#--------------------------------------------------------------------------
+def save_index(path, fingerprints, source, quantum, count, modified):
+    """
+    writes a fingerprint index and the metadata used to validate it,
+    modified is metadata_cache.modified_time of the source
+    """
+    ids = np.asarray(fingerprints.index)
+    if ids.dtype.kind not in 'iuf':
+        ids = ids.astype(np.str_)
+    np.savez(path,
+             ids=ids,
+             fingerprints=fingerprints.values.astype(np.uint64),
+             source=np.array(os.path.abspath(source)),
+             quantum=np.array(quantum),
+             count=np.array(count),
+             modified=np.array(np.nan if modified is None else modified),
+             version=np.array(INDEX_VERSION))
+    return path
+#--------------------------------------------------------------------------
+def _modified(value):
+    value = float(value)
+    return None if np.isnan(value) else value
+#--------------------------------------------------------------------------
+def load_index(path, source, quantum, count, modified):
+    """
+    reads a fingerprint index
+    Output:
+     pandas Series indexed by unique ID, or None if the file does not
+     exist or was built from a different source, quantum, row count or
+     modification time, so a snapshot overwritten in place is reindexed
+    """
+    if not os.path.isfile(path):
+        return None
+    data = np.load(path)
+    try:
+        if int(data['version']) != INDEX_VERSION or \
+           str(data['source']) != os.path.abspath(source) or \
+           float(data['quantum']) != float(quantum) or \
+           int(data['count']) != int(count) or \
+           _modified(data['modified']) != modified:
+            return None
+        return pd.Series(data['fingerprints'], index=pd.Index(data['ids']))
+    finally:
+        data.close()
+#--------------------------------------------------------------------------
+def compare_indexes(old_index, new_index):
+    """
+    compares two fingerprint indexes
+    Output:
+     tuple of numpy arrays (added IDs, removed IDs, suspect IDs) where
+     the suspect IDs exist in both and have different fingerprints
+    """
+    adds = new_index.index.difference(old_index.index)
+    dels = old_index.index.difference(new_index.index)
+    common = old_index.index.intersection(new_index.index)
+    differ = old_index.reindex(common).values != new_index.reindex(common).values
+    return np.asarray(adds), np.asarray(dels), np.asarray(common)[differ]
+#--------------------------------------------------------------------------
+def select_geometries(fc, unique, ids, chunk_size=None, cache_dir=None):
+    """
+    streams a feature class (or its cached snapshot) and keeps only the
+    geometries of the given IDs
+    Output:
+     pandas Series of WKB indexed by the unique ID
+    """
+    ids = pd.Index(ids)
+    parts = []
+    for chunk in snapshot_chunks(fc, [unique, 'SHAPE@WKB'], unique, cache_dir,
+                                 chunk_size):
+        keep = chunk[chunk[unique].isin(ids)]
+        parts.append(pd.Series(keep['SHAPE'].values, index=keep[unique].values))
+        del chunk, keep
+    if len(parts) == 0:
+        return pd.Series([], dtype=object)
+    return pd.concat(parts)
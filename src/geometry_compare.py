@@ -0,0 +1,344 @@
+"""-----------------------------------------------------------------------------
+Name: geometry_compare.py
+Purpose: Row by row geometry equality between two aligned sets of features.
+Description: Exact comparisons of WKB work directly on the raw bytes.
+        Otherwise the vertices are unpacked into a flat float64 (x, y) buffer
+        with an offsets array per feature and compared within an optional XY
+        tolerance. The per-row result is
+        computed with a handful of bulk array operations instead of one
+        Python comparison per feature.
+Requirements: Python 2.7.x/Python3.x, ArcGIS 10.4+/Pro 1.2+
+Copyright: Esri
+License:
+-----------------------------------------------------------------------------"""
+import struct
+
+import numpy as np
+
+# WKB Geometry Types
+WKB_POINT = 1
+WKB_LINESTRING = 2
+WKB_POLYGON = 3
+WKB_MULTIPOINT = 4
+WKB_MULTILINESTRING = 5
+WKB_MULTIPOLYGON = 6
+WKB_COLLECTION = 7
+#--------------------------------------------------------------------------
+class PackedGeometries(object):
+    """
+    flat buffer representation of a sequence of geometries
+    Attributes:
+     gtype - int array, geometry type per feature (0 for NULL)
+     part_sizes - int array, vertex count of every part/ring
+     part_offsets - int array (n + 1), slice of part_sizes per feature
+     coords - float64 array (V, 2) of x, y vertices
+     coord_offsets - int array (n + 1), slice of coords per feature
+    """
+    def __init__(self, gtype, part_sizes, part_offsets, coords, coord_offsets):
+        self.gtype = gtype
+        self.part_sizes = part_sizes
+        self.part_offsets = part_offsets
+        self.coords = coords
+        self.coord_offsets = coord_offsets
+    def __len__(self):
+        return len(self.gtype)
+#--------------------------------------------------------------------------
+def _is_wkb(value):
+    """checks if a value holds WKB bytes"""
+    return isinstance(value, (bytes, bytearray, memoryview))
+#--------------------------------------------------------------------------
+def _read_wkb(buf, pos, parts, coords):
+    """
+    reads one WKB geometry starting at pos, appending the vertex count
+    of each part to parts and the x, y arrays to coords
+    Output:
+     tuple of (geometry type, position after the geometry)
+    """
+    order = '<' if struct.unpack_from('B', buf, pos)[0] == 1 else '>'
+    gtype = struct.unpack_from(order + 'I', buf, pos + 1)[0]
+    pos += 5
+    # ISO (1000s) and EWKB (high bit) Z/M Flags Only Change the Stride
+    ndim = 2
+    if gtype & 0x80000000:
+        ndim += 1
+    if gtype & 0x40000000:
+        ndim += 1
+    gtype &= 0x0FFFFFFF
+    if gtype > 1000:
+        ndim += {1: 1, 2: 1, 3: 2}[gtype // 1000]
+        gtype %= 1000
+    dtype = np.dtype(order + 'f8')
+    if gtype == WKB_POINT:
+        xy = np.frombuffer(buf, dtype, ndim, pos).reshape(1, ndim)[:, :2]
+        parts.append(1)
+        coords.append(xy)
+        pos += 8 * ndim
+    elif gtype == WKB_LINESTRING or gtype == WKB_POLYGON:
+        nrings = 1
+        if gtype == WKB_POLYGON:
+            nrings = struct.unpack_from(order + 'I', buf, pos)[0]
+            pos += 4
+        for _ in range(nrings):
+            npts = struct.unpack_from(order + 'I', buf, pos)[0]
+            pos += 4
+            xy = np.frombuffer(buf, dtype, npts * ndim, pos).reshape(npts, ndim)[:, :2]
+            parts.append(npts)
+            coords.append(xy)
+            pos += 8 * ndim * npts
+    elif gtype in (WKB_MULTIPOINT, WKB_MULTILINESTRING,
+                   WKB_MULTIPOLYGON, WKB_COLLECTION):
+        ngeoms = struct.unpack_from(order + 'I', buf, pos)[0]
+        pos += 4
+        for _ in range(ngeoms):
+            pos = _read_wkb(buf, pos, parts, coords)[1]
+    else:
+        raise ValueError("Unsupported WKB Geometry Type: %s" % gtype)
+    return gtype, pos
+#--------------------------------------------------------------------------
+def _read_json(geom, parts, coords):
+    """
+    reads an Esri JSON geometry (arcgis.geometry.Geometry or dict),
+    see _read_wkb
+    """
+    if 'x' in geom:
+        if geom['x'] is None or geom['x'] == 'NaN':
+            return 0
+        parts.append(1)
+        coords.append(np.array([[geom['x'], geom['y']]], dtype=np.float64))
+        return WKB_POINT
+    for key, gtype in (('points', WKB_MULTIPOINT),
+                       ('paths', WKB_LINESTRING),
+                       ('rings', WKB_POLYGON)):
+        if key in geom:
+            members = [geom[key]] if key == 'points' else geom[key]
+            for member in members:
+                width = len(member[0]) if len(member) > 0 else 2
+                xy = np.asarray(member, dtype=np.float64).reshape(-1, width)[:, :2]
+                parts.append(len(xy))
+                coords.append(xy)
+            return gtype
+    raise ValueError("Unsupported Geometry: %s" % str(geom)[:100])
+#--------------------------------------------------------------------------
+def _is_null(value):
+    """True for NULL geometries, None or the NaN pandas puts in their place"""
+    return value is None or (isinstance(value, float) and np.isnan(value))
+#--------------------------------------------------------------------------
+def pack_geometries(values):
+    """
+    unpacks a sequence of geometries into flat vertex buffers
+    Inputs:
+     values - sequence of WKB bytes/bytearrays or Esri JSON geometries
+              (the SHAPE column of a SpatialDataFrame). None is NULL.
+    Output:
+     PackedGeometries
+    """
+    n = len(values)
+    gtype = np.zeros(n, dtype=np.int32)
+    part_counts = np.zeros(n, dtype=np.int64)
+    parts = []
+    coords = []
+    for i, value in enumerate(values):
+        start = len(parts)
+        if _is_null(value):
+            continue
+        if _is_wkb(value):
+            if len(value) > 0:
+                gtype[i] = _read_wkb(bytes(value), 0, parts, coords)[0]
+        else:
+            gtype[i] = _read_json(value, parts, coords)
+        part_counts[i] = len(parts) - start
+    part_sizes = np.array(parts, dtype=np.int64)
+    part_offsets = np.concatenate([[0], np.cumsum(part_counts)])
+    coord_offsets = np.concatenate([[0], np.cumsum(part_sizes)])[part_offsets]
+    if len(coords) > 0:
+        coords = np.concatenate(coords).astype(np.float64)
+    else:
+        coords = np.empty((0, 2), dtype=np.float64)
+    return PackedGeometries(gtype, part_sizes, part_offsets, coords, coord_offsets)
+#--------------------------------------------------------------------------
+def geometry_bounds(packed):
+    """
+    bounding box of each packed geometry
+    Output:
+     float64 array (n, 4) of xmin, ymin, xmax, ymax. NULL and empty
+     geometries get an inverted box that never intersects anything.
+    """
+    n = len(packed)
+    boxes = np.empty((n, 4), dtype=np.float64)
+    boxes[:, :2] = np.inf
+    boxes[:, 2:] = -np.inf
+    nverts = np.diff(packed.coord_offsets)
+    has_coords = nverts > 0
+    if has_coords.any():
+        starts = packed.coord_offsets[:-1][has_coords]
+        xy = packed.coords
+        boxes[has_coords, 0] = np.fmin.reduceat(xy[:, 0], starts)
+        boxes[has_coords, 1] = np.fmin.reduceat(xy[:, 1], starts)
+        boxes[has_coords, 2] = np.fmax.reduceat(xy[:, 0], starts)
+        boxes[has_coords, 3] = np.fmax.reduceat(xy[:, 1], starts)
+    return boxes
+#--------------------------------------------------------------------------
+def take_geometries(packed, idx):
+    """
+    selects geometries from PackedGeometries
+    Inputs:
+     packed - PackedGeometries
+     idx - int array of the geometries to keep, in output order
+    Output:
+     PackedGeometries
+    """
+    idx = np.asarray(idx, dtype=np.int64)
+    nparts = np.diff(packed.part_offsets)[idx]
+    nverts = np.diff(packed.coord_offsets)[idx]
+    part_idx = np.repeat(packed.part_offsets[:-1][idx] - (np.cumsum(nparts) - nparts),
+                         nparts) + np.arange(int(nparts.sum()))
+    coord_idx = np.repeat(packed.coord_offsets[:-1][idx] - (np.cumsum(nverts) - nverts),
+                          nverts) + np.arange(int(nverts.sum()))
+    return PackedGeometries(packed.gtype[idx],
+                            packed.part_sizes[part_idx],
+                            np.concatenate([[0], np.cumsum(nparts)]).astype(np.int64),
+                            packed.coords[coord_idx],
+                            np.concatenate([[0], np.cumsum(nverts)]).astype(np.int64))
+#--------------------------------------------------------------------------
+def packed_segments(packed):
+    """
+    turns the parts of packed geometries into straight segments
+    Output:
+     tuple of (feature index, x0, y0, x1, y1) arrays
+    """
+    nverts = len(packed.coords)
+    feature = np.repeat(np.arange(len(packed), dtype=np.int64),
+                        np.diff(packed.coord_offsets))
+    part_end = np.cumsum(packed.part_sizes) - 1
+    is_last = np.zeros(nverts, dtype=bool)
+    is_last[part_end[packed.part_sizes > 0]] = True
+    start = np.nonzero(~is_last)[0]
+    end = start + 1
+    xy = packed.coords
+    return feature[start], xy[start, 0], xy[start, 1], xy[end, 0], xy[end, 1]
+#--------------------------------------------------------------------------
+def _wkb_array(values):
+    """builds an object array of immutable WKB bytes, None or NaN is NULL"""
+    arr = np.empty(len(values), dtype=object)
+    arr[:] = [None if _is_null(value) else bytes(value) for value in values]
+    return arr
+#--------------------------------------------------------------------------
+def segment_equal(buf_a, off_a, buf_b, off_b, tolerance=None):
+    """
+    compares two segmented buffers row by row
+    Inputs:
+     buf_a, buf_b - arrays of elements (1-D) or vertices (2-D)
+     off_a, off_b - offsets arrays of length n + 1 giving the slice of
+                    the buffer that belongs to each row
+     tolerance - optional absolute tolerance applied to every element
+    Output:
+     boolean array, True where the rows hold equal segments
+    """
+    len_a = np.diff(off_a)
+    len_b = np.diff(off_b)
+    result = len_a == len_b
+    rows = np.nonzero(result & (len_a > 0))[0]
+    if len(rows) == 0:
+        return result
+    lens = len_a[rows]
+    total = int(lens.sum())
+    within = np.arange(total) - np.repeat(np.cumsum(lens) - lens, lens)
+    idx_a = np.repeat(off_a[rows], lens) + within
+    idx_b = np.repeat(off_b[rows], lens) + within
+    del within
+    val_a = buf_a[idx_a]
+    val_b = buf_b[idx_b]
+    del idx_a, idx_b
+    if tolerance:
+        ok = (np.abs(val_a - val_b) <= tolerance) | \
+             (np.isnan(val_a) & np.isnan(val_b))
+    elif val_a.dtype.kind == 'f':
+        ok = (val_a == val_b) | (np.isnan(val_a) & np.isnan(val_b))
+    else:
+        ok = val_a == val_b
+    if ok.ndim > 1:
+        ok = ok.all(axis=1)
+    result[np.unique(np.repeat(rows, lens)[~ok])] = False
+    return result
+#--------------------------------------------------------------------------
+def packed_equal(old_packed, new_packed, tolerance=None):
+    """
+    compares two PackedGeometries of the same length row by row
+    Output:
+     boolean array, True where the geometries are equal
+    """
+    same = old_packed.gtype == new_packed.gtype
+    same &= segment_equal(old_packed.part_sizes, old_packed.part_offsets,
+                          new_packed.part_sizes, new_packed.part_offsets)
+    same &= segment_equal(old_packed.coords, old_packed.coord_offsets,
+                          new_packed.coords, new_packed.coord_offsets,
+                          tolerance)
+    return same
+#--------------------------------------------------------------------------
+def geometry_equal(old_geoms, new_geoms, tolerance=None):
+    """
+    compares two aligned sequences of geometries row by row
+    Inputs:
+     old_geoms - sequence of WKB or Esri JSON geometries
+     new_geoms - sequence of the same length and kind
+     tolerance - optional XY tolerance in the units of the geometries.
+                 Vertices match when both |dx| and |dy| are within it.
+    Output:
+     boolean array, True where the geometries are equal
+    """
+    old_geoms = list(old_geoms)
+    new_geoms = list(new_geoms)
+    if len(old_geoms) != len(new_geoms):
+        raise ValueError("Geometry Sequences Must Be The Same Length")
+    sample = next((g for g in old_geoms + new_geoms if not _is_null(g)), None)
+    if not tolerance and _is_wkb(sample):
+        # Exact Match on WKB Is a Byte Comparison
+        return _wkb_array(old_geoms) == _wkb_array(new_geoms)
+    return packed_equal(pack_geometries(old_geoms),
+                        pack_geometries(new_geoms),
+                        tolerance)
+#--------------------------------------------------------------------------
+def _mix64(h):
+    """splitmix64 finalizer over a uint64 array"""
+    h = h ^ (h >> np.uint64(30))
+    h = h * np.uint64(0xbf58476d1ce4e5b9)
+    h = h ^ (h >> np.uint64(27))
+    h = h * np.uint64(0x94d049bb133111eb)
+    return h ^ (h >> np.uint64(31))
+#--------------------------------------------------------------------------
+def _segment_sums(values, offsets):
+    """wrapping uint64 sum of each segment, empty segments give 0"""
+    csum = np.concatenate([[np.uint64(0)], np.cumsum(values, dtype=np.uint64)])
+    return csum[offsets[1:]] - csum[offsets[:-1]]
+#--------------------------------------------------------------------------
+def geometry_fingerprints(values, quantum):
+    """
+    hashes each geometry's vertices, snapped to a grid of size quantum,
+    into a uint64 fingerprint. Equal fingerprints mean the geometries
+    have the same type, parts and snapped vertices in the same order.
+    Inputs:
+     values - sequence of WKB or Esri JSON geometries
+     quantum - grid size the coordinates are snapped to, usually the
+               XY resolution of the spatial reference
+    Output:
+     numpy uint64 array with one fingerprint per geometry
+    """
+    packed = pack_geometries(values)
+    # Vertex Hash Depends on the Snapped X, Y and Position Within the Feature
+    nverts = np.diff(packed.coord_offsets)
+    within = np.arange(len(packed.coords)) - \
+             np.repeat(packed.coord_offsets[:-1], nverts)
+    snapped = np.round(packed.coords / quantum)
+    snapped[np.isnan(snapped)] = 0
+    snapped = snapped.astype(np.int64).view(np.uint64)
+    vhash = _mix64(snapped[:, 0] ^ _mix64(snapped[:, 1] + within.astype(np.uint64)))
+    del snapped, within
+    nparts = np.diff(packed.part_offsets)
+    pwithin = np.arange(len(packed.part_sizes)) - \
+              np.repeat(packed.part_offsets[:-1], nparts)
+    phash = _mix64(packed.part_sizes.astype(np.uint64) ^
+                   _mix64(pwithin.astype(np.uint64) + np.uint64(0x9e3779b97f4a7c15)))
+    fingerprints = _mix64(packed.gtype.astype(np.uint64))
+    fingerprints = _mix64(fingerprints ^ _segment_sums(phash, packed.part_offsets))
+    fingerprints = _mix64(fingerprints ^ _segment_sums(vhash, packed.coord_offsets))
+    return fingerprints
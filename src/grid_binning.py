@@ -0,0 +1,518 @@
+"""-----------------------------------------------------------------------------
+Name: grid_binning.py
+Purpose: Bins points, lines and polygons into the cells of a regular polygon
+        grid without running Intersect or Statistics.
+Description: A grid made of equal, axis aligned rectangles is described by
+        its x and y edges and a lookup of the grid OID for every cell.
+        Points are binned with searchsorted/bincount, a point on a grid
+        line goes to every cell along it. Line and polygon boundaries are
+        split at the grid lines with NumPy so each piece lies in one cell,
+        or along a grid line and so in the cells on both sides, which
+        gives the clipped length per cell. Clipped polygon
+        areas and the grid edge lengths inside each polygon come from
+        boundary integrals (Green's theorem) summed per grid row and column,
+        so polygons never have to be clipped explicitly. The results match
+        Intersect + Statistics: FREQUENCY is the number of feature/cell
+        pairs, and LENGTH and AREA are the clipped sums per cell.
+Requirements: Python 2.7.x/Python3.x, ArcGIS 10.4+/Pro 1.2+
+Copyright: Esri
+License:
+-----------------------------------------------------------------------------"""
+import numpy as np
+
+from geometry_compare import pack_geometries, packed_segments, \
+     geometry_bounds, take_geometries
+
+AREA_EPSILON = 1e-12
+LINE_EPSILON = 1e-9
+#--------------------------------------------------------------------------
+class RegularGrid(object):
+    """
+    regular grid of axis aligned rectangular cells
+    Attributes:
+     x0, y0 - lower left corner of the grid
+     dx, dy - cell width and height
+     ncols, nrows - number of columns and rows
+     fids - int array (nrows, ncols) holding the grid OID of each cell,
+            -1 where the grid has no polygon
+     col0, row0 - offset of a window (tile) within the full grid. Cell
+                  coordinates are always measured from x0, y0 so every
+                  window splits features exactly like the full grid.
+    """
+    def __init__(self, x0, y0, dx, dy, ncols, nrows, fids, col0=0, row0=0):
+        self.x0 = float(x0)
+        self.y0 = float(y0)
+        self.dx = float(dx)
+        self.dy = float(dy)
+        self.ncols = int(ncols)
+        self.nrows = int(nrows)
+        self.fids = fids
+        self.col0 = int(col0)
+        self.row0 = int(row0)
+    #----------------------------------------------------------------------
+    @property
+    def ncells(self):
+        """number of cells, including the cells without a polygon"""
+        return self.ncols * self.nrows
+    #----------------------------------------------------------------------
+    @classmethod
+    def from_extents(cls, oids, xmin, ymin, xmax, ymax, rtol=1e-6):
+        """
+        builds a grid from the extents of the grid polygons
+        Output:
+         RegularGrid or None when the cells do not form a regular grid
+        """
+        oids = np.asarray(oids, dtype=np.int64)
+        xmin = np.asarray(xmin, dtype=np.float64)
+        ymin = np.asarray(ymin, dtype=np.float64)
+        xmax = np.asarray(xmax, dtype=np.float64)
+        ymax = np.asarray(ymax, dtype=np.float64)
+        if len(oids) == 0:
+            return None
+        dx = np.median(xmax - xmin)
+        dy = np.median(ymax - ymin)
+        if dx <= 0 or dy <= 0 or \
+           not np.allclose(xmax - xmin, dx, rtol=rtol, atol=0) or \
+           not np.allclose(ymax - ymin, dy, rtol=rtol, atol=0):
+            return None
+        x0 = xmin.min()
+        y0 = ymin.min()
+        cols_f = (xmin - x0) / dx
+        rows_f = (ymin - y0) / dy
+        cols = np.round(cols_f).astype(np.int64)
+        rows = np.round(rows_f).astype(np.int64)
+        if not np.allclose(cols_f, cols, rtol=0, atol=1e-6) or \
+           not np.allclose(rows_f, rows, rtol=0, atol=1e-6):
+            return None
+        ncols = int(cols.max()) + 1
+        nrows = int(rows.max()) + 1
+        fids = np.full((nrows, ncols), -1, dtype=np.int64)
+        if len(np.unique(rows * ncols + cols)) != len(oids):
+            return None
+        fids[rows, cols] = oids
+        return cls(x0, y0, dx, dy, ncols, nrows, fids)
+    #----------------------------------------------------------------------
+    def cells_of(self, x, y):
+        """
+        finds the cells holding each coordinate. As in Intersect a cell
+        includes its edges, so a coordinate on a grid line lies in the
+        cells on both sides of it and one on the outer edge still lies
+        in the grid.
+        Output:
+         tuple of (coordinate index, flat cell index (row * ncols + col))
+         arrays, one row per cell
+        """
+        x_edges = self.x0 + self.dx * np.arange(self.col0, self.col0 + self.ncols + 1)
+        y_edges = self.y0 + self.dy * np.arange(self.row0, self.row0 + self.nrows + 1)
+        cols = np.searchsorted(x_edges, x, side='right') - 1
+        rows = np.searchsorted(y_edges, y, side='right') - 1
+        # Coordinates on a Grid Line Also Lie in the Cell Left of/Below It
+        on_col = x == x_edges[np.clip(cols, 0, self.ncols)]
+        on_row = y == y_edges[np.clip(rows, 0, self.nrows)]
+        cols = [cols, cols - 1]
+        rows = [rows, rows - 1]
+        points, cells = [], []
+        for i, j, select in [(0, 0, None), (1, 0, on_col), (0, 1, on_row),
+                             (1, 1, on_col & on_row)]:
+            index = np.arange(len(cols[0]), dtype=np.int64)
+            col, row = cols[i], rows[j]
+            if select is not None:
+                index, col, row = index[select], col[select], row[select]
+            inside = (col >= 0) & (col < self.ncols) & \
+                     (row >= 0) & (row < self.nrows)
+            points.append(index[inside])
+            cells.append(row[inside] * self.ncols + col[inside])
+        return np.concatenate(points), np.concatenate(cells)
+    #----------------------------------------------------------------------
+    @property
+    def extent(self):
+        """(xmin, ymin, xmax, ymax) of the grid or window"""
+        return (self.x0 + self.dx * self.col0,
+                self.y0 + self.dy * self.row0,
+                self.x0 + self.dx * (self.col0 + self.ncols),
+                self.y0 + self.dy * (self.row0 + self.nrows))
+    #----------------------------------------------------------------------
+    def window(self, row_start, row_stop, col_start, col_stop):
+        """sub grid of the given rows and columns"""
+        return RegularGrid(self.x0, self.y0, self.dx, self.dy,
+                           col_stop - col_start, row_stop - row_start,
+                           self.fids[row_start:row_stop, col_start:col_stop],
+                           self.col0 + col_start, self.row0 + row_start)
+    #----------------------------------------------------------------------
+    def tiles(self, count):
+        """splits the grid into about count windows of similar shape"""
+        count = max(int(count), 1)
+        nrow_tiles = int(round(np.sqrt(count * self.nrows / float(self.ncols))))
+        nrow_tiles = min(max(nrow_tiles, 1), self.nrows)
+        ncol_tiles = min(max(int(np.ceil(count / float(nrow_tiles))), 1), self.ncols)
+        row_edges = np.linspace(0, self.nrows, nrow_tiles + 1).astype(np.int64)
+        col_edges = np.linspace(0, self.ncols, ncol_tiles + 1).astype(np.int64)
+        return [self.window(row_edges[i], row_edges[i + 1],
+                            col_edges[j], col_edges[j + 1])
+                for i in range(nrow_tiles) for j in range(ncol_tiles)]
+    #----------------------------------------------------------------------
+    def table(self, counts):
+        """
+        restricts per cell arrays to the cells that have a grid polygon
+        Inputs:
+         counts - dict of name: array of length ncells
+        Output:
+         tuple of (grid OIDs, dict of name: array) for those cells
+        """
+        flat = self.fids.ravel()
+        has_fid = flat >= 0
+        return flat[has_fid], dict((name, values[has_fid])
+                                   for name, values in counts.items())
+#--------------------------------------------------------------------------
+def _cell_sums(cells, weights, ncells):
+    """weighted bincount that is float64 even when there is nothing to sum"""
+    return np.bincount(cells, weights=weights,
+                       minlength=ncells).astype(np.float64)
+#--------------------------------------------------------------------------
+def _crossings(c0, c1, first, last):
+    """
+    finds the grid lines first..last (in cell units) crossed strictly
+    inside each segment
+    Output:
+     tuple of (segment index, t along the segment) arrays
+    """
+    lo_c = np.minimum(c0, c1)
+    hi_c = np.maximum(c0, c1)
+    lo = np.maximum(np.floor(lo_c).astype(np.int64) + 1, first)
+    hi = np.minimum(np.ceil(hi_c).astype(np.int64) - 1, last)
+    count = np.maximum(hi - lo + 1, 0)
+    seg = np.repeat(np.arange(len(c0), dtype=np.int64), count)
+    within = np.arange(len(seg)) - np.repeat(np.cumsum(count) - count, count)
+    lines = np.repeat(lo, count) + within
+    t = (lines - c0[seg]) / (c1[seg] - c0[seg])
+    return seg, t
+#--------------------------------------------------------------------------
+def split_segments(grid, feature, x0, y0, x1, y1):
+    """
+    splits segments at the grid lines so every piece lies in one cell
+    Output:
+     dict of piece arrays: feature, col, row (may be outside the grid),
+     cx/cy (midpoint in cell units), dx/dy (world deltas), length and
+     on_col_line/on_row_line flags for pieces running along a grid line
+     (their col/row is the index of that line)
+    """
+    cx0 = (x0 - grid.x0) / grid.dx
+    cx1 = (x1 - grid.x0) / grid.dx
+    cy0 = (y0 - grid.y0) / grid.dy
+    cy1 = (y1 - grid.y0) / grid.dy
+    nseg = len(x0)
+    seg_v, t_v = _crossings(cx0, cx1, grid.col0, grid.col0 + grid.ncols)
+    seg_h, t_h = _crossings(cy0, cy1, grid.row0, grid.row0 + grid.nrows)
+    seg = np.concatenate([np.arange(nseg), np.arange(nseg), seg_v, seg_h])
+    t = np.concatenate([np.zeros(nseg), np.ones(nseg), t_v, t_h])
+    del seg_v, t_v, seg_h, t_h
+    order = np.lexsort((t, seg))
+    seg = seg[order]
+    t = t[order]
+    keep = (seg[:-1] == seg[1:]) & (t[1:] > t[:-1])
+    seg_p = seg[:-1][keep]
+    ta = t[:-1][keep]
+    tb = t[1:][keep]
+    del seg, t, order, keep
+    wx = x1[seg_p] - x0[seg_p]
+    wy = y1[seg_p] - y0[seg_p]
+    tm = (ta + tb) / 2.0
+    cx = cx0[seg_p] + tm * (cx1[seg_p] - cx0[seg_p])
+    cy = cy0[seg_p] + tm * (cy1[seg_p] - cy0[seg_p])
+    pdx = (tb - ta) * wx
+    pdy = (tb - ta) * wy
+    col = np.floor(cx).astype(np.int64)
+    row = np.floor(cy).astype(np.int64)
+    # Pieces Running Along a Grid Line Belong to the Line, Not a Cell
+    on_col_line = (np.abs(pdx) <= LINE_EPSILON * grid.dx) & \
+                  (np.abs(cx - np.round(cx)) <= LINE_EPSILON)
+    on_row_line = (np.abs(pdy) <= LINE_EPSILON * grid.dy) & \
+                  (np.abs(cy - np.round(cy)) <= LINE_EPSILON)
+    col[on_col_line] = np.round(cx[on_col_line]).astype(np.int64)
+    row[on_row_line] = np.round(cy[on_row_line]).astype(np.int64)
+    if grid.col0 or grid.row0:
+        # Window Cell Units
+        col -= grid.col0
+        row -= grid.row0
+        cx -= grid.col0
+        cy -= grid.row0
+    return {
+        'feature': feature[seg_p],
+        'col': col,
+        'row': row,
+        'cx': cx,
+        'cy': cy,
+        'dx': pdx,
+        'dy': pdy,
+        'length': np.hypot(pdx, pdy),
+        'on_col_line': on_col_line,
+        'on_row_line': on_row_line
+    }
+#--------------------------------------------------------------------------
+def _in_grid(grid, pieces):
+    """mask of the pieces that fall inside a grid cell with a polygon"""
+    inside = (pieces['col'] >= 0) & (pieces['col'] < grid.ncols) & \
+             (pieces['row'] >= 0) & (pieces['row'] < grid.nrows)
+    cells = np.where(inside, pieces['row'] * grid.ncols + pieces['col'], 0)
+    return inside & (grid.fids.ravel()[cells] >= 0), cells
+#--------------------------------------------------------------------------
+def _band_integrals(feature, band, pos, frac, delta, on_line, nbands, npos,
+                    width):
+    """
+    integrates polygon boundaries band by band (rows for areas, columns
+    for the transposed pass). Within a band the boundary pieces are
+    accumulated from the far side, so the part of a polygon covering a
+    cell is found without clipping.
+    Inputs:
+     feature, band, pos - piece feature index, band index and position
+                          (cell index along the band)
+     frac - piece midpoint offset inside its cell, 0..1
+     delta - signed world extent of the piece across the band
+     on_line - True for pieces lying on the grid line at their position
+     nbands, npos - grid size across/along the bands
+     width - world size of a cell along the band
+    Output:
+     tuple of (feature, band, position, area, edge_after, edge_before)
+     arrays where area is the signed area inside the cell. edge_after and
+     edge_before are the signed lengths of the grid line at the start of
+     the position that have the polygon interior right after and right
+     before the line. Positions -1 and npos lie outside of the grid and
+     have no area.
+    """
+    keep = (band >= 0) & (band < nbands)
+    feature = feature[keep]
+    band = band[keep]
+    # Everything Before/Beyond the Grid Collapses Into Positions -1/npos
+    pos = np.clip(pos[keep], -1, npos)
+    on_line = on_line[keep] & (pos >= 0) & (pos < npos)
+    frac = np.where((pos >= 0) & (pos < npos) & ~on_line, frac[keep], 0.0)
+    delta = delta[keep]
+    if len(feature) == 0:
+        empty = np.zeros(0)
+        return empty.astype(np.int64), empty.astype(np.int64), \
+               empty.astype(np.int64), empty, empty, empty
+    key = feature * nbands + band
+    groups, inverse = np.unique(key, return_inverse=True)
+    inverse = inverse.ravel()
+    ngroups = len(groups)
+    pos_min = np.full(ngroups, npos, dtype=np.int64)
+    pos_max = np.full(ngroups, -1, dtype=np.int64)
+    np.minimum.at(pos_min, inverse, pos)
+    np.maximum.at(pos_max, inverse, pos)
+    span = pos_max - pos_min + 1
+    starts = np.cumsum(span) - span
+    total = int(span.sum())
+    dense = starts[inverse] + (pos - pos_min[inverse])
+    full = _cell_sums(dense, delta, total)
+    own = _cell_sums(dense, frac * width * delta, total)
+    online = _cell_sums(dense[on_line], delta[on_line], total)
+    # Sum of the Pieces Beyond Each Position Within Its Group
+    group_of = np.repeat(np.arange(ngroups), span)
+    csum = np.cumsum(full)
+    ends = (starts + span - 1)[group_of]
+    beyond = csum[ends] - csum
+    positions = np.repeat(pos_min, span) + \
+                (np.arange(total) - np.repeat(starts, span))
+    area = own + width * beyond
+    edge_before = full + beyond
+    edge_after = edge_before - online
+    return (groups // nbands)[group_of], (groups % nbands)[group_of], \
+           positions, area, edge_after, edge_before
+#--------------------------------------------------------------------------
+def bin_points(grid, x, y):
+    """
+    counts the points in each cell, a point on a grid line counts in
+    every cell along it
+    Output:
+     dict with FREQUENCY, one value per cell
+    """
+    _, cells = grid.cells_of(np.asarray(x, dtype=np.float64),
+                             np.asarray(y, dtype=np.float64))
+    cells = cells[grid.fids.ravel()[cells] >= 0]
+    return {'FREQUENCY': np.bincount(cells, minlength=grid.ncells)}
+#--------------------------------------------------------------------------
+def bin_lines(grid, packed):
+    """
+    clips polylines to the grid, a piece running along a grid line is
+    part of the cells on both sides
+    Inputs:
+     packed - geometry_compare.PackedGeometries
+    Output:
+     dict with FREQUENCY (features per cell) and LENGTH (clipped length
+     per cell in coordinate units)
+    """
+    pieces = split_segments(grid, *packed_segments(packed))
+    # A Piece Along a Grid Line Lies in the Cells on Both Sides of It
+    along = np.nonzero(pieces['on_col_line'] | pieces['on_row_line'])[0]
+    select = np.concatenate([np.arange(len(pieces['feature'])), along])
+    cells = {'col': np.concatenate([pieces['col'], pieces['col'][along] -
+                                    pieces['on_col_line'][along]]),
+             'row': np.concatenate([pieces['row'], pieces['row'][along] -
+                                    pieces['on_row_line'][along]])}
+    inside, cells = _in_grid(grid, cells)
+    select = select[inside]
+    cells = cells[inside]
+    length = _cell_sums(cells, pieces['length'][select], grid.ncells)
+    # Intersect Outputs No Feature for a Cell Only Touched at a Point
+    touch = pieces['length'][select] > 0
+    pairs = np.unique(pieces['feature'][select][touch] * grid.ncells + cells[touch])
+    frequency = np.bincount(pairs % grid.ncells, minlength=grid.ncells)
+    return {'FREQUENCY': frequency, 'LENGTH': length}
+#--------------------------------------------------------------------------
+def bin_polygons(grid, packed):
+    """
+    clips polygons to the grid
+    Inputs:
+     packed - geometry_compare.PackedGeometries
+    Output:
+     dict with FREQUENCY (features overlapping each cell), LENGTH
+     (perimeter of the clipped polygons) and AREA (clipped area) per cell
+     in coordinate units
+    """
+    pieces = split_segments(grid, *packed_segments(packed))
+    ncols, nrows = grid.ncols, grid.nrows
+    valid = grid.fids.ravel() >= 0
+
+    # Polygon Boundary Inside Each Cell
+    inside, cells = _in_grid(grid, pieces)
+    inside &= ~(pieces['on_col_line'] | pieces['on_row_line'])
+    length = _cell_sums(cells[inside], pieces['length'][inside], grid.ncells)
+
+    # Area and Vertical Grid Lines Inside the Polygons, Row by Row
+    _, row, col, area, after, before = _band_integrals(pieces['feature'],
+                                                       pieces['row'],
+                                                       pieces['col'],
+                                                       pieces['cx'] - pieces['col'],
+                                                       pieces['dy'],
+                                                       pieces['on_col_line'],
+                                                       nrows, ncols, grid.dx)
+    in_grid = (col >= 0) & (col < ncols)
+    cell_area = np.abs(area[in_grid])
+    cell_idx = row[in_grid] * ncols + col[in_grid]
+    area_sum = _cell_sums(cell_idx, cell_area, grid.ncells)
+    overlap = cell_area > AREA_EPSILON * grid.dx * grid.dy
+    frequency = np.bincount(cell_idx[overlap], minlength=grid.ncells)
+    # A Vertical Line Is the Left Edge of One Cell and Right Edge of Another
+    length += _cell_sums(cell_idx, np.abs(after[in_grid]), grid.ncells)
+    left = col > 0
+    length += _cell_sums(row[left] * ncols + col[left] - 1,
+                         np.abs(before[left]), grid.ncells)
+    del row, col, area, after, before, in_grid
+
+    # Horizontal Grid Lines Inside the Polygons, Column by Column
+    _, col, row, _, after, before = _band_integrals(pieces['feature'],
+                                                    pieces['col'],
+                                                    pieces['row'],
+                                                    pieces['cy'] - pieces['row'],
+                                                    pieces['dx'],
+                                                    pieces['on_row_line'],
+                                                    ncols, nrows, grid.dy)
+    above = (row >= 0) & (row < nrows)
+    length += _cell_sums(row[above] * ncols + col[above],
+                         np.abs(after[above]), grid.ncells)
+    below = row > 0
+    length += _cell_sums((row[below] - 1) * ncols + col[below],
+                         np.abs(before[below]), grid.ncells)
+    length[~valid] = 0
+    area_sum[~valid] = 0
+    frequency[~valid] = 0
+    return {'FREQUENCY': frequency, 'LENGTH': length, 'AREA': area_sum}
+#--------------------------------------------------------------------------
+def bin_packed(grid, packed, geom_type):
+    """
+    bins PackedGeometries into the grid cells
+    Output:
+     dict of per cell arrays, see bin_points/bin_lines/bin_polygons
+    """
+    if geom_type.lower() == "point":
+        return bin_points(grid, packed.coords[:, 0], packed.coords[:, 1])
+    elif geom_type.lower() == "polyline":
+        return bin_lines(grid, packed)
+    elif geom_type.lower() == "polygon":
+        return bin_polygons(grid, packed)
+    raise ValueError("Unsupported Geometry Type: %s" % geom_type)
+#--------------------------------------------------------------------------
+def bin_geometries(grid, values, geom_type):
+    """
+    bins a chunk of WKB or Esri JSON geometries
+    Inputs:
+     grid - RegularGrid
+     values - sequence of geometries
+     geom_type - POINT, POLYLINE or POLYGON
+    Output:
+     dict of per cell arrays, see bin_points/bin_lines/bin_polygons
+    """
+    return bin_packed(grid, pack_geometries(values), geom_type)
+#--------------------------------------------------------------------------
+def add_counts(totals, counts):
+    """adds the per cell arrays of one chunk to the running totals"""
+    for name, values in counts.items():
+        if name in totals:
+            totals[name] = totals[name] + values
+        else:
+            totals[name] = values
+    return totals
+#--------------------------------------------------------------------------
+def _bin_window(args):
+    """process pool entry point, bins the features of one tile"""
+    window, packed, geom_type = args
+    return bin_packed(window, packed, geom_type)
+#--------------------------------------------------------------------------
+def _add_window(grid, totals, window, counts):
+    """adds the per cell arrays of a tile into the full grid totals"""
+    rows = slice(window.row0 - grid.row0, window.row0 - grid.row0 + window.nrows)
+    cols = slice(window.col0 - grid.col0, window.col0 - grid.col0 + window.ncols)
+    for name, values in counts.items():
+        if name not in totals:
+            totals[name] = np.zeros(grid.ncells, dtype=values.dtype)
+        totals[name].reshape(grid.nrows, grid.ncols)[rows, cols] += \
+            values.reshape(window.nrows, window.ncols)
+    return totals
+#--------------------------------------------------------------------------
+def bin_tiles(grid, chunks, geom_type, processes=None, ntiles=None):
+    """
+    bins chunks of geometries tile by tile in a process pool
+    Inputs:
+     grid - RegularGrid
+     chunks - iterable of geometry sequences (WKB or Esri JSON)
+     geom_type - POINT, POLYLINE or POLYGON
+     processes - number of worker processes, defaults to the CPU count
+     ntiles - number of tiles, defaults to four per process
+    Output:
+     dict of per cell arrays for the full grid, see bin_geometries.
+     Every cell belongs to exactly one tile and a feature is only sent
+     to the tiles its bounding box touches, so features straddling tile
+     edges are counted once per cell, exactly as in bin_geometries.
+    """
+    import multiprocessing
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    windows = grid.tiles(ntiles or processes * 4)
+    extents = np.array([window.extent for window in windows])
+    totals = {}
+    pending = []
+    pool = multiprocessing.Pool(processes=processes)
+    try:
+        for values in chunks:
+            packed = pack_geometries(values)
+            bounds = geometry_bounds(packed)
+            for window, extent in zip(windows, extents):
+                selected = np.nonzero((bounds[:, 0] <= extent[2]) & (bounds[:, 2] >= extent[0]) &
+                                      (bounds[:, 1] <= extent[3]) & (bounds[:, 3] >= extent[1]))[0]
+                if len(selected) == 0:
+                    continue
+                args = (window, take_geometries(packed, selected), geom_type)
+                pending.append((window, pool.apply_async(_bin_window, (args,))))
+                # Bound the Work Queued Ahead of the Workers
+                while len(pending) > 2 * processes:
+                    window_done, result = pending.pop(0)
+                    _add_window(grid, totals, window_done, result.get())
+            del packed, bounds
+        for window_done, result in pending:
+            _add_window(grid, totals, window_done, result.get())
+    finally:
+        pool.close()
+        pool.join()
+    if 'FREQUENCY' not in totals:
+        totals['FREQUENCY'] = np.zeros(grid.ncells, dtype=np.int64)
+    return totals
@@ -0,0 +1,131 @@
+"""-----------------------------------------------------------------------------
+Name: incremental_state.py
+Purpose: Persists the state of an attribute comparison so the next run only
+        needs the rows edited since.
+Description: The state holds a digest of the compared fields of every unique
+        ID plus a watermark, the largest value of an edit date or ObjectID
+        field seen by the run. It is saved as a .npz file next to the output
+        geodatabase. The next run selects the rows at or above the
+        watermark and only diffs those whose digest changed. The state
+        also records the baseline it was compared against, a rolled or
+        edited baseline invalidates it since untouched rows would need to
+        be compared again.
+Requirements: Python 2.7.x/Python3.x, ArcGIS 10.4+/Pro 1.2+
+Copyright: Esri
+License:
+-----------------------------------------------------------------------------"""
+import os
+import hashlib
+import datetime
+
+import numpy as np
+import pandas as pd
+
+STATE_VERSION = 2
+IN_CLAUSE_SIZE = 1000
+#--------------------------------------------------------------------------
+def state_path(out_db, fc):
+    """
+    path of the incremental state of fc, stored next to out_db. The
+    name carries a hash of the full path so datasets with the same name
+    keep separate states.
+    """
+    source = os.path.abspath(str(fc))
+    key = hashlib.md5(source.encode('utf-8')).hexdigest()[:12]
+    name = os.path.splitext(os.path.basename(source))[0]
+    return os.path.join(os.path.dirname(out_db), "%s_%s_state.npz" % (name, key))
+#--------------------------------------------------------------------------
+def _ids_array(ids):
+    ids = np.asarray(ids)
+    if ids.dtype.kind not in 'iuf':
+        ids = ids.astype(np.str_)
+    return ids
+#--------------------------------------------------------------------------
+def save_state(path, digests, watermark, source, fields, watermark_field,
+               baseline, baseline_modified):
+    """
+    writes the state of a run
+    Inputs:
+     path - .npz file
+     digests - pandas Series of uint64 row digests indexed by unique ID
+     watermark - largest watermark value seen (number or datetime)
+     source - compared feature class
+     fields - compared fields, in digest order
+     watermark_field - field the watermark was read from
+     baseline - feature class source was compared against
+     baseline_modified - metadata_cache.modified_time of baseline
+    """
+    if isinstance(watermark, (datetime.datetime, pd.Timestamp)):
+        watermark = np.datetime64(pd.Timestamp(watermark).to_datetime64(), 'us')
+    np.savez(path,
+             ids=_ids_array(digests.index),
+             digests=digests.values.astype(np.uint64),
+             watermark=np.array(watermark),
+             source=np.array(os.path.abspath(source)),
+             fields=np.array(list(fields), dtype=np.str_),
+             watermark_field=np.array(watermark_field),
+             baseline=np.array(os.path.abspath(str(baseline))),
+             baseline_modified=np.array(np.nan if baseline_modified is None
+                                        else baseline_modified),
+             version=np.array(STATE_VERSION))
+    return path
+#--------------------------------------------------------------------------
+def load_state(path, source, fields, watermark_field, baseline, baseline_modified):
+    """
+    reads the state of the previous run
+    Output:
+     tuple of (digests Series indexed by unique ID, watermark), or None
+     if the file does not exist or was saved for a different source,
+     field list or watermark field, or against a different or modified
+     baseline. A baseline without a modification time never matches.
+    """
+    if not os.path.isfile(path) or baseline_modified is None:
+        return None
+    data = np.load(path)
+    try:
+        if int(data['version']) != STATE_VERSION or \
+           str(data['source']) != os.path.abspath(source) or \
+           list(data['fields']) != list(fields) or \
+           str(data['watermark_field']) != watermark_field or \
+           str(data['baseline']) != os.path.abspath(str(baseline)) or \
+           float(data['baseline_modified']) != baseline_modified:
+            return None
+        watermark = data['watermark'][()]
+        if isinstance(watermark, np.datetime64):
+            watermark = pd.Timestamp(watermark).to_pydatetime()
+        digests = pd.Series(data['digests'], index=pd.Index(data['ids']))
+        return digests, watermark
+    finally:
+        data.close()
+#--------------------------------------------------------------------------
+def watermark_clause(field, watermark):
+    """where clause selecting the rows at or above the watermark"""
+    if isinstance(watermark, datetime.datetime):
+        return "%s >= date '%s'" % (field, watermark.strftime("%Y-%m-%d %H:%M:%S"))
+    return "%s >= %r" % (field, watermark)
+#--------------------------------------------------------------------------
+def in_clauses(field, ids, size=IN_CLAUSE_SIZE):
+    """where clauses selecting the given IDs, at most size IDs each"""
+    ids = list(ids)
+    for start in range(0, len(ids), size):
+        values = []
+        for value in ids[start:start + size]:
+            if isinstance(value, (int, float, np.integer, np.floating)):
+                values.append(repr(value.item() if hasattr(value, 'item') else value))
+            else:
+                values.append("'%s'" % str(value).replace("'", "''"))
+        yield "%s IN (%s)" % (field, ",".join(values))
+#--------------------------------------------------------------------------
+def max_watermark(values, current=None):
+    """largest non NULL value of values and current"""
+    values = pd.Series(values).dropna()
+    if len(values) == 0:
+        return current
+    value = values.max()
+    if isinstance(value, pd.Timestamp):
+        value = value.to_pydatetime()
+    elif hasattr(value, 'item'):
+        value = value.item()
+    if current is None or value > current:
+        return value
+    return current
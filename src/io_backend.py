@@ -0,0 +1,756 @@
+"""-----------------------------------------------------------------------------
+Name: io_backend.py
+Purpose: Reads and writes datasets through arcpy or, without ArcGIS, through
+        GeoPackage files.
+Description: The comparison engines only need to list datasets, describe
+        them, read their rows in chunks and write tables and features.
+        get_backend picks the implementation from the path: anything in a
+        .gpkg file (data.gpkg/roads or data.gpkg/main.roads) goes through
+        GeoPackageBackend, which only needs the sqlite3 module, and every
+        other path goes through ArcpyBackend. Geometries are exchanged as
+        WKB in a column named SHAPE, and field and describe objects carry
+        the arcpy attribute names the tools already use.
+Requirements: Python 2.7.x/Python3.x, ArcGIS 10.4+/Pro 1.2+ for ArcpyBackend
+Copyright: Esri
+License:
+-----------------------------------------------------------------------------"""
+import os
+import re
+import struct
+import contextlib
+import sqlite3
+import datetime
+import platform
+import itertools
+
+import numpy as np
+import pandas as pd
+
+FIELD_TYPES = {
+    'String': 'TEXT',
+    'Integer': 'LONG',
+    'SmallInteger': 'SHORT',
+    'Double': 'DOUBLE',
+    'Single': 'FLOAT',
+    'Date': 'DATE',
+    'GUID': 'GUID',
+    'GlobalID': 'GUID'
+}
+#--------------------------------------------------------------------------
+def calc_chunk_size():
+    """determines the chunk size based on 32 vs 64-bit python"""
+    if platform.architecture()[0].lower() == "32bit":
+        return 50000
+    else:
+        return 500000
+#--------------------------------------------------------------------------
+def _column_name(field):
+    return 'SHAPE' if field.upper().startswith('SHAPE@') else field
+#--------------------------------------------------------------------------
+def _sorted_fields(fields, unique):
+    if unique is not None and unique not in fields:
+        return [unique] + list(fields)
+    return list(fields)
+#--------------------------------------------------------------------------
+def _frame_rows(df, rename=None):
+    """rows of a DataFrame as tuples of Python values, NULL as None"""
+    rename = rename or {}
+    names = [rename.get(col, col) for col in df.columns]
+    values = df.astype(object).where(pd.notnull(df), None)
+    return names, values.itertuples(index=False)
+#--------------------------------------------------------------------------
+class Field(object):
+    """field description with the attributes of an arcpy Field"""
+    def __init__(self, name, type, length=0, editable=True, nullable=True):
+        self.name = name
+        self.type = type
+        self.length = length
+        self.editable = editable
+        self.isNullable = nullable
+    #----------------------------------------------------------------------
+    def __repr__(self):
+        return "Field(%r, %r)" % (self.name, self.type)
+#--------------------------------------------------------------------------
+class SpatialReference(object):
+    """spatial reference with the attributes of an arcpy SpatialReference"""
+    def __init__(self, factory_code=0, name="Unknown", definition=""):
+        self.factoryCode = factory_code
+        self.name = name
+        self.definition = definition or ""
+        upper = self.definition.upper()
+        self.type = 'Geographic' if upper.startswith('GEOGCS') or \
+                    upper.startswith('GEOGCRS') else 'Projected'
+        self.metersPerUnit = None
+        self.semiMajorAxis = None
+        self.flattening = None
+        spheroid = re.search(r'SPHEROID\[\s*"[^"]*"\s*,\s*([\d.eE+-]+)\s*,\s*([\d.eE+-]+)',
+                             self.definition, re.IGNORECASE)
+        if spheroid:
+            self.semiMajorAxis = float(spheroid.group(1))
+            inverse = float(spheroid.group(2))
+            self.flattening = 1.0 / inverse if inverse else 0.0
+        if self.type == 'Projected':
+            units = re.findall(r'UNIT\[\s*"[^"]*"\s*,\s*([\d.eE+-]+)', self.definition,
+                               re.IGNORECASE)
+            self.metersPerUnit = float(units[-1]) if units else 1.0
+    #----------------------------------------------------------------------
+    def exportToString(self):
+        return self.definition
+#--------------------------------------------------------------------------
+class Description(object):
+    """dataset description with the attributes of an arcpy Describe object"""
+    def __init__(self, path, name, data_type, fields, oid_field=None,
+                 shape_field=None, shape_type=None, spatial_reference=None):
+        self.catalogPath = path
+        self.name = name
+        self.baseName = name
+        self.dataType = data_type
+        self.fields = fields
+        self.OIDFieldName = self.oidFieldName = oid_field
+        self.hasOID = oid_field is not None
+        self.shapeFieldName = shape_field
+        self.shapeType = shape_type
+        self.spatialReference = spatial_reference
+#--------------------------------------------------------------------------
+class ArcpyBackend(object):
+    """reads and writes geodatabases and services through arcpy"""
+    name = 'arcpy'
+    #----------------------------------------------------------------------
+    def exists(self, path):
+        import arcpy
+        return arcpy.Exists(path)
+    #----------------------------------------------------------------------
+    def delete(self, path):
+        import arcpy
+        if arcpy.Exists(path):
+            arcpy.Delete_management(path)
+    #----------------------------------------------------------------------
+    def list_datasets(self, workspace):
+        """paths of the feature classes and tables in a workspace"""
+        import arcpy
+        paths = []
+        for dirpath, dirnames, filenames in arcpy.da.Walk(workspace,
+                                                          datatype=['FeatureClass', 'Table']):
+            paths.extend(os.path.join(dirpath, filename) for filename in filenames)
+        return paths
+    #----------------------------------------------------------------------
+    def describe(self, path):
+        import arcpy
+        return arcpy.Describe(path)
+    #----------------------------------------------------------------------
+    def count_rows(self, path):
+        import arcpy
+        return int(arcpy.GetCount_management(path)[0])
+    #----------------------------------------------------------------------
+    def list_fields(self, path):
+        import arcpy
+        return list(arcpy.ListFields(path))
+    #----------------------------------------------------------------------
+    def read_chunks(self, path, fields, unique=None, chunk_size=None,
+                    where_clause=None, spatial_reference=None):
+        """
+        reads a dataset in chunks, sorted by unique when it is given. The
+        workspace must support ORDER BY (file or enterprise geodatabase).
+        """
+        from arcpy import da
+        fields = _sorted_fields(fields, unique)
+        columns = [_column_name(field) for field in fields]
+        sql_clause = (None, "ORDER BY %s" % unique) if unique is not None else (None, None)
+        if chunk_size is None:
+            chunk_size = calc_chunk_size()
+        with da.SearchCursor(path, fields,
+                             where_clause=where_clause,
+                             spatial_reference=spatial_reference,
+                             sql_clause=sql_clause) as cursor:
+            while True:
+                rows = list(itertools.islice(cursor, chunk_size))
+                if len(rows) == 0:
+                    break
+                yield pd.DataFrame.from_records(rows, columns=columns)
+    #----------------------------------------------------------------------
+    def create_output(self, template, out_db, out_name, fields=None, add_fields=None):
+        """
+        creates an empty feature class, or table when template has no
+        geometry, like template, see stream_compare.create_output_fc
+        """
+        import arcpy
+        from metadata_cache import describe, list_fields
+        out_fc = os.path.join(out_db, out_name)
+        if arcpy.Exists(out_fc):
+            arcpy.Delete_management(out_fc)
+        desc = describe(template)
+        if not getattr(desc, 'shapeType', None):
+            out_fc = arcpy.CreateTable_management(out_path=out_db,
+                                                  out_name=out_name,
+                                                  template=template if fields is None else None)[0]
+            for field in list_fields(template) if fields is not None else []:
+                if field.name in fields:
+                    arcpy.AddField_management(out_fc, field.name,
+                                              FIELD_TYPES.get(field.type, 'TEXT'),
+                                              field_length=field.length)
+        elif fields is None:
+            out_fc = arcpy.CreateFeatureclass_management(out_path=out_db,
+                                                         out_name=out_name,
+                                                         geometry_type=desc.shapeType.upper(),
+                                                         template=template,
+                                                         spatial_reference=desc.spatialReference)[0]
+        else:
+            out_fc = arcpy.CreateFeatureclass_management(out_path=out_db,
+                                                         out_name=out_name,
+                                                         geometry_type=desc.shapeType.upper(),
+                                                         spatial_reference=desc.spatialReference)[0]
+            for field in list_fields(template):
+                if field.name in fields:
+                    arcpy.AddField_management(out_fc, field.name,
+                                              FIELD_TYPES.get(field.type, 'TEXT'),
+                                              field_length=field.length)
+        for name, field_type in add_fields or []:
+            arcpy.AddField_management(out_fc, name, field_type)
+        return out_fc
+    #----------------------------------------------------------------------
+    def insert_frame(self, path, df, rename=None):
+        """appends the rows of a DataFrame, SHAPE is written as WKB"""
+        from arcpy import da
+        names, rows = _frame_rows(df, rename)
+        names = ['SHAPE@WKB' if name == 'SHAPE' else name for name in names]
+        with da.InsertCursor(path, names) as icur:
+            for row in rows:
+                icur.insertRow(row)
+                del row
+    #----------------------------------------------------------------------
+    def oid_extent(self, path):
+        """(smallest, largest) ObjectID of a dataset, None when it is empty"""
+        import arcpy
+        from arcpy import da
+        oid_field = arcpy.Describe(path).OIDFieldName
+        extent = []
+        for order in ('ASC', 'DESC'):
+            with da.SearchCursor(path, ['OID@'],
+                                 sql_clause=(None, "ORDER BY %s %s" % (oid_field, order))) as cursor:
+                for row in cursor:
+                    extent.append(row[0])
+                    break
+        return tuple(extent) if len(extent) == 2 else None
+    #----------------------------------------------------------------------
+    def update_frame(self, path, df, oid_field):
+        """
+        updates the rows whose oid_field value is in the DataFrame with
+        its other columns, rows missing from the DataFrame are untouched
+        """
+        from arcpy import da
+        if len(df) == 0:
+            return 0
+        names, rows = _frame_rows(df)
+        position = names.index(oid_field)
+        updates = dict((row[position], row) for row in rows)
+        where_clause = "%s >= %s AND %s <= %s" % (oid_field, min(updates),
+                                                  oid_field, max(updates))
+        count = 0
+        with da.UpdateCursor(path, names, where_clause=where_clause) as ucur:
+            for row in ucur:
+                values = updates.get(row[position])
+                if values is not None:
+                    ucur.updateRow(list(values))
+                    count += 1
+        return count
+    #----------------------------------------------------------------------
+    def delete_rows(self, path, where_clause):
+        """deletes the rows matching where_clause, returns their number"""
+        from arcpy import da
+        count = 0
+        with da.UpdateCursor(path, ['OID@'], where_clause=where_clause) as ucur:
+            for row in ucur:
+                ucur.deleteRow()
+                count += 1
+        return count
+    #----------------------------------------------------------------------
+    def write_array(self, array, path, append=False):
+        """
+        writes a structured array to a table, created from the array when
+        it does not exist or append is False
+        """
+        import arcpy
+        from arcpy import da
+        if arcpy.Exists(path) and not append:
+            arcpy.Delete_management(path)
+        if not arcpy.Exists(path):
+            da.NumPyArrayToTable(array, path)
+            return path
+        names = list(array.dtype.names)
+        with da.InsertCursor(path, names) as icur:
+            for row in zip(*[array[name].tolist() for name in names]):
+                icur.insertRow(row)
+        return path
+#--------------------------------------------------------------------------
+# GeoPackage Geometry Blob Envelope Sizes by Flag Value
+_ENVELOPE_BYTES = {0: 0, 1: 32, 2: 48, 3: 48, 4: 64}
+_GPKG_TYPES = {
+    'Integer': 'INTEGER',
+    'SmallInteger': 'SMALLINT',
+    'Double': 'DOUBLE',
+    'Single': 'FLOAT',
+    'Date': 'DATETIME',
+    'GUID': 'TEXT',
+    'GlobalID': 'TEXT',
+    'Blob': 'BLOB',
+    'LONG': 'INTEGER',
+    'SHORT': 'SMALLINT',
+    'DOUBLE': 'DOUBLE',
+    'FLOAT': 'FLOAT',
+    'DATE': 'DATETIME',
+    'TEXT': 'TEXT'
+}
+_SHAPE_TYPES = {
+    'POINT': 'Point',
+    'MULTIPOINT': 'Multipoint',
+    'LINESTRING': 'Polyline',
+    'MULTILINESTRING': 'Polyline',
+    'POLYGON': 'Polygon',
+    'MULTIPOLYGON': 'Polygon'
+}
+_GEOMETRY_NAMES = {
+    'POINT': 'POINT',
+    'MULTIPOINT': 'MULTIPOINT',
+    'POLYLINE': 'MULTILINESTRING',
+    'POLYGON': 'MULTIPOLYGON'
+}
+_DATE_LITERAL = re.compile(r"\b(?:date|timestamp)\s+'(\d{4}-\d{2}-\d{2})(?:[ T]([\d:.]+))?'",
+                           re.IGNORECASE)
+#--------------------------------------------------------------------------
+def split_geopackage(path):
+    """
+    splits a path into (GeoPackage file, table name), the table name is
+    None for the GeoPackage itself. Returns None for other paths.
+    """
+    match = re.search(r'\.gpkg(?=$|[\\/])', str(path), re.IGNORECASE)
+    if match is None:
+        return None
+    db = path[:match.end()]
+    name = path[match.end():].lstrip('\\/') or None
+    if name is not None and name.lower().startswith('main.'):
+        name = name[5:]
+    return db, name
+#--------------------------------------------------------------------------
+def gpkg_to_wkb(blob):
+    """strips the GeoPackage header from a geometry blob"""
+    if blob is None:
+        return None
+    blob = bytes(blob)
+    if blob[:2] != b'GP':
+        return blob
+    flags = bytearray(blob[3:4])[0]
+    if flags & 0x10:
+        return None
+    return blob[8 + _ENVELOPE_BYTES.get((flags >> 1) & 0x07, 0):]
+#--------------------------------------------------------------------------
+def wkb_point_xy(wkb):
+    """(x, y) of a WKB point, (None, None) for other or empty geometries"""
+    if wkb is None or len(wkb) < 21:
+        return (None, None)
+    order = '<' if bytearray(wkb[:1])[0] == 1 else '>'
+    gtype = struct.unpack_from(order + 'I', wkb, 1)[0] & 0x0FFFFFFF
+    if gtype % 1000 != 1:
+        return (None, None)
+    return struct.unpack_from(order + 'dd', wkb, 5)
+#--------------------------------------------------------------------------
+def wkb_to_gpkg(wkb, srs_id):
+    """wraps WKB in a GeoPackage geometry header without an envelope"""
+    if wkb is None:
+        return None
+    return b'GP' + struct.pack('<BBi', 0, 0x01, int(srs_id)) + bytes(wkb)
+#--------------------------------------------------------------------------
+def _quote(name):
+    return '"%s"' % str(name).replace('"', '""')
+#--------------------------------------------------------------------------
+def _sqlite_where(where_clause):
+    """rewrites the date literals of a geodatabase where clause for SQLite"""
+    if not where_clause:
+        return None
+    def literal(match):
+        time = match.group(2)
+        return "'%s'" % (match.group(1) + ('T' + time if time else ''))
+    return _DATE_LITERAL.sub(literal, where_clause)
+#--------------------------------------------------------------------------
+def _sqlite_value(value):
+    if isinstance(value, (datetime.datetime, pd.Timestamp)):
+        return value.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + 'Z'
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+#--------------------------------------------------------------------------
+_PLAIN_TYPES = (type(None), bool, int, float, str, bytes)
+#--------------------------------------------------------------------------
+def _sqlite_column(values):
+    """values of one column as SQLite parameters, NULL as None"""
+    series = pd.Series(values)
+    if series.dtype.kind == 'M':
+        text = series.dt.strftime("%Y-%m-%dT%H:%M:%S.%f").str[:-3] + 'Z'
+        return text.astype(object).where(series.notnull(), None).tolist()
+    values = series.astype(object).where(series.notnull(), None).tolist()
+    return [value if type(value) in _PLAIN_TYPES else _sqlite_value(value)
+            for value in values]
+#--------------------------------------------------------------------------
+class GeoPackageBackend(object):
+    """reads and writes the tables and features of GeoPackage files"""
+    name = 'geopackage'
+    #----------------------------------------------------------------------
+    def _connect(self, db):
+        return sqlite3.connect(db)
+    #----------------------------------------------------------------------
+    @contextlib.contextmanager
+    def _session(self, db):
+        """connection that commits on success and is always closed"""
+        conn = self._connect(db)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+    #----------------------------------------------------------------------
+    def _initialize(self, db):
+        """creates the GeoPackage metadata tables of a new file"""
+        with self._session(db) as conn:
+            conn.execute("PRAGMA application_id = 1196444487")
+            conn.execute("PRAGMA user_version = 10200")
+            conn.execute("""CREATE TABLE IF NOT EXISTS gpkg_spatial_ref_sys (
+                srs_name TEXT NOT NULL, srs_id INTEGER PRIMARY KEY,
+                organization TEXT NOT NULL, organization_coordsys_id INTEGER NOT NULL,
+                definition TEXT NOT NULL, description TEXT)""")
+            conn.execute("""CREATE TABLE IF NOT EXISTS gpkg_contents (
+                table_name TEXT NOT NULL PRIMARY KEY, data_type TEXT NOT NULL,
+                identifier TEXT UNIQUE, description TEXT DEFAULT '',
+                last_change DATETIME NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ','now')),
+                min_x DOUBLE, min_y DOUBLE, max_x DOUBLE, max_y DOUBLE, srs_id INTEGER)""")
+            conn.execute("""CREATE TABLE IF NOT EXISTS gpkg_geometry_columns (
+                table_name TEXT NOT NULL, column_name TEXT NOT NULL,
+                geometry_type_name TEXT NOT NULL, srs_id INTEGER NOT NULL,
+                z TINYINT NOT NULL, m TINYINT NOT NULL,
+                CONSTRAINT pk_geom_cols PRIMARY KEY (table_name, column_name))""")
+            conn.executemany("INSERT OR IGNORE INTO gpkg_spatial_ref_sys VALUES (?,?,?,?,?,?)",
+                             [("Undefined cartesian SRS", -1, "NONE", -1, "undefined", None),
+                              ("Undefined geographic SRS", 0, "NONE", 0, "undefined", None),
+                              ("WGS 84 geodetic", 4326, "EPSG", 4326,
+                               'GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",'
+                               '6378137,298.257223563]],PRIMEM["Greenwich",0],'
+                               'UNIT["degree",0.0174532925199433]]', None)])
+    #----------------------------------------------------------------------
+    def _table(self, path):
+        parts = split_geopackage(path)
+        if parts is None or parts[1] is None:
+            raise ValueError("Not a GeoPackage Table: %s" % path)
+        return parts
+    #----------------------------------------------------------------------
+    def _geometry_column(self, conn, name):
+        row = conn.execute("SELECT column_name, geometry_type_name, srs_id "
+                           "FROM gpkg_geometry_columns WHERE table_name = ?",
+                           (name,)).fetchone()
+        return row
+    #----------------------------------------------------------------------
+    def exists(self, path):
+        parts = split_geopackage(path)
+        if parts is None or not os.path.isfile(parts[0]):
+            return False
+        if parts[1] is None:
+            return True
+        with self._session(parts[0]) as conn:
+            return conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' "
+                                "AND name = ?", (parts[1],)).fetchone() is not None
+    #----------------------------------------------------------------------
+    def delete(self, path):
+        db, name = self._table(path)
+        if not self.exists(path):
+            return
+        with self._session(db) as conn:
+            conn.execute("DROP TABLE %s" % _quote(name))
+            for table in ('gpkg_contents', 'gpkg_geometry_columns'):
+                conn.execute("DELETE FROM %s WHERE table_name = ?" % table, (name,))
+    #----------------------------------------------------------------------
+    def list_datasets(self, workspace):
+        db = split_geopackage(workspace)[0]
+        with self._session(db) as conn:
+            names = [row[0] for row in conn.execute(
+                "SELECT table_name FROM gpkg_contents ORDER BY table_name")]
+        return [os.path.join(db, name) for name in names]
+    #----------------------------------------------------------------------
+    def list_fields(self, path):
+        return self.describe(path).fields
+    #----------------------------------------------------------------------
+    def count_rows(self, path):
+        db, name = self._table(path)
+        with self._session(db) as conn:
+            return conn.execute("SELECT COUNT(*) FROM %s" % _quote(name)).fetchone()[0]
+    #----------------------------------------------------------------------
+    def describe(self, path):
+        db, name = self._table(path)
+        if not self.exists(path):
+            raise ValueError("Dataset Does Not Exist: %s" % path)
+        with self._session(db) as conn:
+            geometry = self._geometry_column(conn, name)
+            columns = conn.execute("PRAGMA table_info(%s)" % _quote(name)).fetchall()
+            sr = None
+            if geometry is not None:
+                srs = conn.execute("SELECT srs_id, srs_name, definition FROM "
+                                   "gpkg_spatial_ref_sys WHERE srs_id = ?",
+                                   (geometry[2],)).fetchone()
+                sr = SpatialReference(*srs) if srs else SpatialReference(geometry[2])
+        fields = []
+        oid_field = None
+        for _, column, declared, notnull, _, pk in columns:
+            declared = (declared or '').upper()
+            length = re.search(r'\((\d+)\)', declared)
+            length = int(length.group(1)) if length else 0
+            if geometry is not None and column == geometry[0]:
+                field_type = 'Geometry'
+            elif pk and declared.startswith('INT'):
+                field_type = 'OID'
+                oid_field = column
+            elif declared.startswith(('INT', 'MEDIUMINT')):
+                field_type = 'Integer'
+            elif declared.startswith(('SMALLINT', 'TINYINT', 'BOOLEAN')):
+                field_type = 'SmallInteger'
+            elif declared.startswith('FLOAT'):
+                field_type = 'Single'
+            elif declared.startswith(('DOUBLE', 'REAL', 'NUMERIC')):
+                field_type = 'Double'
+            elif declared.startswith(('DATE', 'DATETIME')):
+                field_type = 'Date'
+            elif declared.startswith('BLOB'):
+                field_type = 'Blob'
+            else:
+                field_type = 'String'
+            fields.append(Field(column, field_type, length,
+                                editable=field_type not in ('OID', 'Geometry'),
+                                nullable=not notnull))
+        if geometry is None:
+            return Description(path, name, 'Table', fields, oid_field)
+        return Description(path, name, 'FeatureClass', fields, oid_field,
+                           geometry[0], _SHAPE_TYPES.get(geometry[1].upper(), geometry[1]),
+                           sr)
+    #----------------------------------------------------------------------
+    def read_chunks(self, path, fields, unique=None, chunk_size=None,
+                    where_clause=None, spatial_reference=None):
+        """
+        reads a table in chunks, sorted by unique when it is given.
+        SHAPE@WKB/SHAPE@ return WKB, SHAPE@XY the coordinates of points,
+        OID@ the primary key and dates are parsed into datetimes.
+        Reprojection needs ArcpyBackend.
+        """
+        desc = self.describe(path)
+        if spatial_reference is not None and \
+           getattr(spatial_reference, 'factoryCode', None) != \
+           getattr(desc.spatialReference, 'factoryCode', None):
+            raise ValueError("GeoPackage Datasets Cannot Be Projected: %s" % path)
+        fields = _sorted_fields(fields, unique)
+        columns = [_column_name(field) for field in fields]
+        dates = [field.name for field in desc.fields if field.type == 'Date']
+        xy = 'SHAPE@XY' in [field.upper() for field in fields]
+        selected = []
+        for field in fields:
+            if field.upper() in ('SHAPE@WKB', 'SHAPE@', 'SHAPE@XY'):
+                selected.append(_quote(desc.shapeFieldName))
+            elif field.upper() == 'OID@':
+                selected.append(_quote(desc.OIDFieldName))
+            elif field.upper().startswith('SHAPE@'):
+                raise ValueError("Unsupported GeoPackage Field Token: %s" % field)
+            else:
+                selected.append(_quote(field))
+        sql = "SELECT %s FROM %s" % (", ".join(selected), _quote(desc.name))
+        where_clause = _sqlite_where(where_clause)
+        if where_clause:
+            sql += " WHERE %s" % where_clause
+        if unique is not None:
+            sql += " ORDER BY %s" % _quote(unique)
+        if chunk_size is None:
+            chunk_size = calc_chunk_size()
+        conn = self._connect(split_geopackage(path)[0])
+        try:
+            cursor = conn.execute(sql)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if len(rows) == 0:
+                    break
+                df = pd.DataFrame.from_records(rows, columns=columns)
+                if 'SHAPE' in df.columns:
+                    df['SHAPE'] = [wkb_point_xy(gpkg_to_wkb(value)) if xy else
+                                   gpkg_to_wkb(value) for value in df['SHAPE'].values]
+                for column in dates:
+                    if column in df.columns:
+                        values = pd.to_datetime(df[column].astype(object).where(
+                            pd.notnull(df[column]), None).map(
+                                lambda value: value.rstrip('Z') if isinstance(value, str)
+                                else value), format='ISO8601', errors='coerce')
+                        df[column] = [None if pd.isnull(value) else value.to_pydatetime()
+                                      for value in values]
+                yield df
+        finally:
+            conn.close()
+    #----------------------------------------------------------------------
+    def _create_table(self, conn, name, fields, geometry=None):
+        """
+        creates a user table
+        Inputs:
+         fields - list of (name, sqlite type) pairs
+         geometry - optional (geometry type name, srs_id, definition)
+        """
+        columns = ["fid INTEGER PRIMARY KEY AUTOINCREMENT"]
+        columns += ["%s %s" % (_quote(field), field_type) for field, field_type in fields
+                    if field.lower() != 'fid']
+        if geometry is not None:
+            columns.append("geom %s" % geometry[0])
+        conn.execute("CREATE TABLE %s (%s)" % (_quote(name), ", ".join(columns)))
+        if geometry is None:
+            conn.execute("INSERT INTO gpkg_contents (table_name, data_type, identifier) "
+                         "VALUES (?, 'attributes', ?)", (name, name))
+            return
+        geometry_type, srs_id, definition = geometry
+        conn.execute("INSERT OR IGNORE INTO gpkg_spatial_ref_sys VALUES (?,?,?,?,?,?)",
+                     ("srs_%s" % srs_id, srs_id, "NONE" if srs_id <= 0 else "EPSG",
+                      srs_id, definition or "undefined", None))
+        conn.execute("INSERT INTO gpkg_contents (table_name, data_type, identifier, srs_id) "
+                     "VALUES (?, 'features', ?, ?)", (name, name, srs_id))
+        conn.execute("INSERT INTO gpkg_geometry_columns VALUES (?, 'geom', ?, ?, 0, 0)",
+                     (name, geometry_type, srs_id))
+    #----------------------------------------------------------------------
+    def create_output(self, template, out_db, out_name, fields=None, add_fields=None):
+        """
+        creates an empty feature class like template, which may come
+        from either backend
+        """
+        from metadata_cache import describe, list_fields
+        db = split_geopackage(out_db)[0]
+        out_fc = os.path.join(db, out_name)
+        self._initialize(db)
+        self.delete(out_fc)
+        desc = describe(template)
+        columns = []
+        for field in list_fields(template):
+            if field.type in ('OID', 'Geometry') or \
+               (fields is not None and field.name not in fields):
+                continue
+            field_type = _GPKG_TYPES.get(field.type, 'TEXT')
+            if field_type == 'TEXT' and getattr(field, 'length', 0):
+                field_type = 'TEXT(%d)' % field.length
+            columns.append((field.name, field_type))
+        for name, field_type in add_fields or []:
+            columns.append((name, _GPKG_TYPES.get(field_type, 'TEXT')))
+        geometry = None
+        if getattr(desc, 'shapeType', None):
+            sr = desc.spatialReference
+            definition = sr.exportToString() if hasattr(sr, 'exportToString') else ""
+            geometry = (_GEOMETRY_NAMES.get(desc.shapeType.upper(), 'GEOMETRY'),
+                        int(getattr(sr, 'factoryCode', 0) or 0), definition)
+        with self._session(db) as conn:
+            self._create_table(conn, out_name, columns, geometry)
+        return out_fc
+    #----------------------------------------------------------------------
+    def _insert_rows(self, path, names, rows):
+        db, name = self._table(path)
+        desc = self.describe(path)
+        srs_id = getattr(desc.spatialReference, 'factoryCode', 0) or 0
+        shape = names.index('SHAPE') if 'SHAPE' in names else None
+        columns = [_quote(desc.shapeFieldName if i == shape else column)
+                   for i, column in enumerate(names)]
+        sql = "INSERT INTO %s (%s) VALUES (%s)" % (_quote(name), ", ".join(columns),
+                                                   ", ".join("?" * len(columns)))
+        def encoded():
+            for row in rows:
+                row = [_sqlite_value(value) for value in row]
+                if shape is not None:
+                    row[shape] = wkb_to_gpkg(row[shape], srs_id)
+                yield row
+        with self._session(db) as conn:
+            conn.executemany(sql, encoded())
+    #----------------------------------------------------------------------
+    def insert_frame(self, path, df, rename=None):
+        """appends the rows of a DataFrame, SHAPE holds WKB"""
+        names, rows = _frame_rows(df, rename)
+        self._insert_rows(path, names, rows)
+    #----------------------------------------------------------------------
+    def oid_extent(self, path):
+        """(smallest, largest) primary key of a table, None when it is empty"""
+        db, name = self._table(path)
+        oid_field = self.describe(path).OIDFieldName
+        with self._session(db) as conn:
+            extent = conn.execute("SELECT MIN(%s), MAX(%s) FROM %s" %
+                                  (_quote(oid_field), _quote(oid_field),
+                                   _quote(name))).fetchone()
+        return None if extent[0] is None else tuple(extent)
+    #----------------------------------------------------------------------
+    def update_frame(self, path, df, oid_field):
+        """
+        updates the rows whose oid_field value is in the DataFrame with
+        its other columns, rows missing from the DataFrame are untouched
+        """
+        if len(df) == 0:
+            return 0
+        db, name = self._table(path)
+        columns = [column for column in df.columns if column != oid_field]
+        if len(columns) == 0:
+            return 0
+        sql = "UPDATE %s SET %s WHERE %s = ?" % (
+            _quote(name), ", ".join("%s = ?" % _quote(column) for column in columns),
+            _quote(oid_field))
+        values = [_sqlite_column(df[column].values) for column in columns + [oid_field]]
+        with self._session(db) as conn:
+            return conn.executemany(sql, zip(*values)).rowcount
+    #----------------------------------------------------------------------
+    def delete_rows(self, path, where_clause):
+        """deletes the rows matching where_clause, returns their number"""
+        db, name = self._table(path)
+        sql = "DELETE FROM %s" % _quote(name)
+        where_clause = _sqlite_where(where_clause)
+        if where_clause:
+            sql += " WHERE %s" % where_clause
+        with self._session(db) as conn:
+            return conn.execute(sql).rowcount
+    #----------------------------------------------------------------------
+    def write_array(self, array, path, append=False):
+        """
+        writes a structured array to a table, created from the array when
+        it does not exist or append is False
+        """
+        db, name = self._table(path)
+        self._initialize(db)
+        if self.exists(path) and not append:
+            self.delete(path)
+        if not self.exists(path):
+            fields = []
+            for column in array.dtype.names:
+                kind = array.dtype[column].kind
+                if kind in 'iub':
+                    fields.append((column, 'INTEGER'))
+                elif kind == 'f':
+                    fields.append((column, 'DOUBLE'))
+                elif kind == 'M':
+                    fields.append((column, 'DATETIME'))
+                else:
+                    fields.append((column, 'TEXT'))
+            with self._session(db) as conn:
+                self._create_table(conn, name, fields)
+        names = list(array.dtype.names)
+        rows = zip(*[[None if isinstance(value, float) and value != value else value
+                      for value in array[column].tolist()] for column in names])
+        self._insert_rows(path, names, rows)
+        return path
+#--------------------------------------------------------------------------
+def add_message(message):
+    """arcpy.AddMessage when arcpy is available, print otherwise"""
+    try:
+        import arcpy
+    except ImportError:
+        print(message)
+        return
+    arcpy.AddMessage(message)
+#--------------------------------------------------------------------------
+_BACKENDS = {
+    'arcpy': ArcpyBackend(),
+    'geopackage': GeoPackageBackend()
+}
+#--------------------------------------------------------------------------
+def get_backend(path):
+    """backend that handles a dataset or workspace path"""
+    if split_geopackage(path) is not None:
+        return _BACKENDS['geopackage']
+    return _BACKENDS['arcpy']
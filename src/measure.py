@@ -0,0 +1,235 @@
+"""-----------------------------------------------------------------------------
+Name: measure.py
+Purpose: Measures the area and length of many features at once.
+Description: Geometries are unpacked into flat vertex arrays and measured
+        with vectorized NumPy instead of one getArea/getLength call per
+        feature. Projected data uses the shoelace formula and segment
+        lengths. Geographic data uses Vincenty's inverse formula on the
+        ellipsoid for lengths (haversine where it does not converge) and
+        the spherical trapezoid formula on authalic latitudes for areas.
+        GEODESIC measures, the default of getArea/getLength, read
+        projected data in its geographic coordinate system so it is
+        measured on the ellipsoid as well.
+Requirements: Python 2.7.x/Python3.x
+Copyright: Esri
+License:
+-----------------------------------------------------------------------------"""
+import numpy as np
+
+from geometry_compare import pack_geometries, packed_segments, \
+     WKB_POLYGON, WKB_MULTIPOLYGON
+
+WGS84_SEMI_MAJOR = 6378137.0
+WGS84_FLATTENING = 1 / 298.257223563
+# Meters (or Square Meters) per Unit
+LINEAR_UNITS = {
+    'METERS' : 1.0,
+    'KILOMETERS' : 1000.0,
+    'FEET' : 0.3048,
+    'FEETUS' : 1200.0 / 3937.0,
+    'YARDS' : 0.9144,
+    'MILES' : 1609.344,
+    'NAUTICALMILES' : 1852.0
+}
+AREA_UNITS = {
+    'SQUAREMETERS' : 1.0,
+    'SQUAREKILOMETERS' : 1.0e6,
+    'SQUAREFEET' : 0.3048 ** 2,
+    'SQUAREYARDS' : 0.9144 ** 2,
+    'SQUAREMILES' : 1609.344 ** 2,
+    'ACRES' : 4046.8564224,
+    'HECTARES' : 1.0e4
+}
+METHODS = ('PLANAR', 'GEODESIC')
+#--------------------------------------------------------------------------
+def reference_parameters(sr):
+    """
+    reads the measurement parameters of an arcpy SpatialReference
+    Output:
+     dict with geographic, meters_per_unit, semi_major and flattening
+    """
+    geographic = getattr(sr, 'type', None) == 'Geographic'
+    meters_per_unit = getattr(sr, 'metersPerUnit', None) or 1.0
+    semi_major = getattr(sr, 'semiMajorAxis', None) or WGS84_SEMI_MAJOR
+    flattening = getattr(sr, 'flattening', None)
+    if flattening is None:
+        flattening = WGS84_FLATTENING
+    return {'geographic' : geographic,
+            'meters_per_unit' : float(meters_per_unit),
+            'semi_major' : float(semi_major),
+            'flattening' : float(flattening)}
+#--------------------------------------------------------------------------
+def measure_reference(sr, method="GEODESIC"):
+    """
+    chooses the spatial reference to read geometries in for a measure
+    method. GEODESIC measures projected data in the geographic coordinate
+    system of sr, like getArea/getLength without a method, PLANAR in sr
+    itself. Geographic data is always measured on the ellipsoid.
+    Inputs:
+     sr - arcpy SpatialReference of the data
+     method - PLANAR or GEODESIC
+    Output:
+     tuple of (spatial reference to read with, measure_geometries
+     parameters)
+    """
+    method = str(method).upper()
+    if method not in METHODS:
+        raise ValueError("Unsupported Measure Method: %s" % method)
+    params = reference_parameters(sr)
+    if method == 'GEODESIC' and not params['geographic']:
+        gcs = getattr(sr, 'GCS', None)
+        if gcs is None:
+            raise ValueError("Geodesic Measures Need ArcGIS to Project: %s" %
+                             getattr(sr, 'name', sr))
+        return gcs, reference_parameters(gcs)
+    return sr, params
+#--------------------------------------------------------------------------
+def _feature_sums(feature, values, n):
+    """sums per feature values, 0 for features without any"""
+    return np.bincount(feature, weights=values, minlength=n).astype(np.float64)
+#--------------------------------------------------------------------------
+def haversine_distance(lon1, lat1, lon2, lat2, radius):
+    """great circle distance between lon/lat degrees on a sphere"""
+    phi1 = np.radians(lat1)
+    phi2 = np.radians(lat2)
+    dphi = phi2 - phi1
+    dlam = np.radians(lon2 - lon1)
+    h = np.sin(dphi / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlam / 2) ** 2
+    return 2 * radius * np.arcsin(np.sqrt(np.clip(h, 0, 1)))
+#--------------------------------------------------------------------------
+def vincenty_distance(lon1, lat1, lon2, lat2, semi_major=WGS84_SEMI_MAJOR,
+                      flattening=WGS84_FLATTENING, iterations=100, tolerance=1e-12):
+    """
+    geodesic distance between lon/lat degrees on the ellipsoid using
+    Vincenty's inverse formula, evaluated for all pairs at once
+    Output:
+     distances in the units of semi_major. Nearly antipodal pairs that do
+     not converge fall back to the haversine distance.
+    """
+    a = semi_major
+    f = flattening
+    b = a * (1 - f)
+    L = np.radians(np.asarray(lon2, dtype=np.float64) - np.asarray(lon1, dtype=np.float64))
+    U1 = np.arctan((1 - f) * np.tan(np.radians(lat1)))
+    U2 = np.arctan((1 - f) * np.tan(np.radians(lat2)))
+    sinU1, cosU1 = np.sin(U1), np.cos(U1)
+    sinU2, cosU2 = np.sin(U2), np.cos(U2)
+    lam = L.copy()
+    converged = np.zeros(L.shape, dtype=bool)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for _ in range(iterations):
+            sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+            sin_sigma = np.sqrt((cosU2 * sin_lam) ** 2 +
+                                (cosU1 * sinU2 - sinU1 * cosU2 * cos_lam) ** 2)
+            cos_sigma = sinU1 * sinU2 + cosU1 * cosU2 * cos_lam
+            sigma = np.arctan2(sin_sigma, cos_sigma)
+            sin_alpha = np.where(sin_sigma == 0, 0.0, cosU1 * cosU2 * sin_lam / sin_sigma)
+            cos2_alpha = 1 - sin_alpha ** 2
+            cos_2sigma_m = np.where(cos2_alpha == 0, 0.0,
+                                    cos_sigma - 2 * sinU1 * sinU2 / cos2_alpha)
+            C = f / 16 * cos2_alpha * (4 + f * (4 - 3 * cos2_alpha))
+            lam_next = L + (1 - C) * f * sin_alpha * \
+                       (sigma + C * sin_sigma * (cos_2sigma_m + C * cos_sigma *
+                                                 (-1 + 2 * cos_2sigma_m ** 2)))
+            converged = np.abs(lam_next - lam) < tolerance
+            lam = lam_next
+            if converged.all():
+                break
+        u2 = cos2_alpha * (a * a - b * b) / (b * b)
+        A = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+        B = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+        delta_sigma = B * sin_sigma * (cos_2sigma_m + B / 4 *
+                                       (cos_sigma * (-1 + 2 * cos_2sigma_m ** 2) -
+                                        B / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) *
+                                        (-3 + 4 * cos_2sigma_m ** 2)))
+        distance = b * A * (sigma - delta_sigma)
+    failed = ~converged | ~np.isfinite(distance)
+    if failed.any():
+        distance = np.where(failed,
+                            haversine_distance(lon1, lat1, lon2, lat2, (2 * a + b) / 3.0),
+                            distance)
+    return distance
+#--------------------------------------------------------------------------
+def _sin_authalic(lat, flattening):
+    """sine of the authalic latitude of geodetic latitudes in degrees"""
+    sin_phi = np.sin(np.radians(lat))
+    e2 = flattening * (2 - flattening)
+    if e2 <= 0:
+        return sin_phi
+    e = np.sqrt(e2)
+    def q(s):
+        return (1 - e2) * (s / (1 - e2 * s * s) -
+                           np.log((1 - e * s) / (1 + e * s)) / (2 * e))
+    return q(sin_phi) / q(1.0)
+#--------------------------------------------------------------------------
+def authalic_radius(semi_major=WGS84_SEMI_MAJOR, flattening=WGS84_FLATTENING):
+    """radius of the sphere with the surface area of the ellipsoid"""
+    e2 = flattening * (2 - flattening)
+    if e2 <= 0:
+        return semi_major
+    e = np.sqrt(e2)
+    return semi_major * np.sqrt((1 + (1 - e2) / (2 * e) * np.log((1 + e) / (1 - e))) / 2)
+#--------------------------------------------------------------------------
+def planar_measures(packed):
+    """
+    shoelace area and length of every packed geometry in coordinate units
+    Output:
+     tuple of (area, length) arrays. Rings are summed with their sign so
+     holes, which turn the other way, are subtracted.
+    """
+    n = len(packed)
+    feature, x0, y0, x1, y1 = packed_segments(packed)
+    length = _feature_sums(feature, np.hypot(x1 - x0, y1 - y0), n)
+    area = np.abs(_feature_sums(feature, x0 * y1 - x1 * y0, n)) / 2.0
+    return area, length
+#--------------------------------------------------------------------------
+def geodesic_measures(packed, semi_major=WGS84_SEMI_MAJOR,
+                      flattening=WGS84_FLATTENING):
+    """
+    ellipsoidal area and length of every packed lon/lat geometry in
+    meters and square meters
+    Output:
+     tuple of (area, length) arrays
+    """
+    n = len(packed)
+    feature, x0, y0, x1, y1 = packed_segments(packed)
+    length = _feature_sums(feature,
+                           vincenty_distance(x0, y0, x1, y1, semi_major, flattening),
+                           n)
+    # Shortest Way Round the Antimeridian
+    dlam = np.radians(x1 - x0)
+    dlam = (dlam + np.pi) % (2 * np.pi) - np.pi
+    excess = dlam * (2 + _sin_authalic(y0, flattening) + _sin_authalic(y1, flattening))
+    radius = authalic_radius(semi_major, flattening)
+    area = np.abs(_feature_sums(feature, excess, n)) * radius * radius / 2.0
+    return area, length
+#--------------------------------------------------------------------------
+def measure_geometries(values,
+                       geographic=False,
+                       meters_per_unit=1.0,
+                       semi_major=WGS84_SEMI_MAJOR,
+                       flattening=WGS84_FLATTENING,
+                       area_units="SQUAREKILOMETERS",
+                       length_units="KILOMETERS"):
+    """
+    measures a chunk of geometries
+    Inputs:
+     values - sequence of WKB or Esri JSON geometries, or PackedGeometries
+     geographic - True when the coordinates are lon/lat degrees
+     meters_per_unit - size of a coordinate unit for projected data
+     semi_major, flattening - ellipsoid of geographic data
+     area_units, length_units - output units, see AREA_UNITS/LINEAR_UNITS
+    Output:
+     tuple of (area, length) arrays with one value per geometry. Only
+     polygons have an area, the length of a polygon is its perimeter.
+    """
+    packed = values if hasattr(values, 'coord_offsets') else pack_geometries(values)
+    if geographic:
+        area, length = geodesic_measures(packed, semi_major, flattening)
+    else:
+        area, length = planar_measures(packed)
+        area *= meters_per_unit ** 2
+        length *= meters_per_unit
+    area[~np.isin(packed.gtype, (WKB_POLYGON, WKB_MULTIPOLYGON))] = 0.0
+    return area / AREA_UNITS[area_units.upper()], \
+           length / LINEAR_UNITS[length_units.upper()]
@@ -0,0 +1,145 @@
+"""-----------------------------------------------------------------------------
+Name: metadata_cache.py
+Purpose: Shared cache of dataset schema and describe information.
+Description: arcpy.Describe and arcpy.ListFields are slow and the tools call
+        them for the same datasets over and over. Results are memoized by
+        dataset path and modification time, so an edited dataset is
+        described again, and the least recently used entries are evicted
+        once the cache is full. The modification time of a geodatabase
+        table is the newest time of the files in its geodatabase; paths
+        that are not on the file system (enterprise connections, services)
+        have none and are cached until evicted or clear_cache is called.
+Requirements: Python 2.7.x/Python3.x, ArcGIS 10.4+/Pro 1.2+
+Copyright: Esri
+License:
+-----------------------------------------------------------------------------"""
+import os
+import threading
+from collections import OrderedDict
+
+MAX_ENTRIES = 256
+# Workspaces Stored as Files Whose Times Change With the Tables Inside
+_CONTAINERS = ('.gdb', '.gpkg', '.sqlite')
+#--------------------------------------------------------------------------
+def _dataset_files(path):
+    """files whose modification marks an edit of the file dataset path"""
+    stem, extension = os.path.splitext(path)
+    if extension.lower() == '.shp':
+        # .dbf Holds the Attributes, .shx the Index, .prj the Projection
+        folder, name = os.path.split(stem)
+        return [os.path.join(folder, other) for other in os.listdir(folder)
+                if other.lower().startswith(name.lower() + '.')]
+    if extension.lower() in _CONTAINERS:
+        return [name for name in (path, path + '-wal', path + '-journal')
+                if os.path.isfile(name)]
+    return [path]
+#--------------------------------------------------------------------------
+def modified_time(path):
+    """
+    modification time of a dataset, None when the file system cannot tell
+    it: enterprise (.sde) connections, service URLs and anything that is
+    not a file, a folder or a table of a file geodatabase or GeoPackage.
+    The .lock files readers leave in a geodatabase are ignored and the
+    sidecar files of shapefiles and GeoPackages count as the dataset.
+    """
+    path = str(path)
+    if '://' in path:
+        return None
+    path = os.path.abspath(path)
+    base = path
+    while not os.path.exists(base):
+        parent = os.path.dirname(base)
+        if parent == base:
+            return None
+        base = parent
+    extension = os.path.splitext(base)[1].lower()
+    if extension == '.sde' or (base != path and extension not in _CONTAINERS):
+        return None
+    path = base
+    if not os.path.isdir(path):
+        times = []
+        for name in _dataset_files(path):
+            try:
+                times.append(os.path.getmtime(name))
+            except OSError:
+                pass
+        return max(times) if times else None
+    times = [os.path.getmtime(path)]
+    for name in os.listdir(path):
+        if name.lower().endswith('.lock'):
+            continue
+        try:
+            times.append(os.path.getmtime(os.path.join(path, name)))
+        except OSError:
+            pass
+    return max(times[1:]) if len(times) > 1 else times[0]
+#--------------------------------------------------------------------------
+class MetadataCache(object):
+    """
+    least recently used cache of values computed from a dataset path,
+    safe to share between threads
+    """
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    #----------------------------------------------------------------------
+    def __len__(self):
+        return len(self._entries)
+    #----------------------------------------------------------------------
+    def get(self, kind, path, loader):
+        """
+        returns loader(path), computing it only when the dataset is not
+        cached or was modified since it was cached
+        """
+        key = (kind, str(path))
+        mtime = modified_time(path)
+        with self._lock:
+            if key in self._entries:
+                cached_mtime, value = self._entries.pop(key)
+                if cached_mtime == mtime:
+                    self._entries[key] = (cached_mtime, value)
+                    return value
+        value = loader(path)
+        with self._lock:
+            self._entries[key] = (mtime, value)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+    #----------------------------------------------------------------------
+    def clear(self):
+        """removes every entry"""
+        with self._lock:
+            self._entries.clear()
+
+_CACHE = MetadataCache()
+#--------------------------------------------------------------------------
+def _describe(path):
+    from io_backend import get_backend
+    return get_backend(path).describe(path)
+#--------------------------------------------------------------------------
+def _list_fields(path):
+    from io_backend import get_backend
+    return list(get_backend(path).list_fields(path))
+#--------------------------------------------------------------------------
+def describe(path):
+    """cached arcpy.Describe, or its io_backend equivalent"""
+    return _CACHE.get('describe', path, _describe)
+#--------------------------------------------------------------------------
+def list_fields(path):
+    """cached arcpy.ListFields, or its io_backend equivalent, as a list"""
+    return _CACHE.get('fields', path, _list_fields)
+#--------------------------------------------------------------------------
+def field_names(path, exclude_types=('OID', 'Geometry'), editable_only=False):
+    """names of the fields of a dataset, without the excluded field types"""
+    return [field.name for field in list_fields(path)
+            if field.type not in exclude_types and \
+            (field.editable or not editable_only)]
+#--------------------------------------------------------------------------
+def spatial_reference(path):
+    """cached spatial reference of a dataset"""
+    return describe(path).spatialReference
+#--------------------------------------------------------------------------
+def clear_cache():
+    """empties the shared cache"""
+    _CACHE.clear()
@@ -0,0 +1,21 @@
+"""-----------------------------------------------------------------------------
+Name: process_pool.py
+Purpose: Prepares multiprocessing to run inside ArcGIS.
+Description: Inside ArcGIS Pro or ArcMap sys.executable is the application
+        itself, so a process pool would start new copies of it as workers.
+        set_executable points multiprocessing at the Python interpreter
+        that ships with ArcGIS instead and must be called before a Pool is
+        created.
+Requirements: Python 2.7.x/Python3.x
+Copyright: Esri
+License:
+-----------------------------------------------------------------------------"""
+import os
+import sys
+import multiprocessing
+
+#--------------------------------------------------------------------------
+def set_executable():
+    """child processes must start the Python interpreter, not ArcGIS"""
+    if os.path.split(sys.executable)[1].lower() in ('arcgispro.exe', 'arcmap.exe'):
+        multiprocessing.set_executable(os.path.join(sys.exec_prefix, 'python.exe'))
@@ -0,0 +1,236 @@
+"""-----------------------------------------------------------------------------
+Name: profiling.py
+Purpose: Times the stages of a tool run.
+Description: A tool's main function starts a profile, and the code it calls
+        wraps each of its stages (load, dedupe, merge, compare, export,
+        intersect, statistics, ExtendTable, ...) in a stage span. A span
+        records its wall time, the rows it handled and the change of the
+        resident memory of the process. Spans opened inside other spans are
+        named by their path, e.g. compare/load, and repeated spans of the
+        same path, like the chunks of a streaming comparison, are summed.
+        When the run finishes the stages are written as JSON next to the
+        outputs and reported as geoprocessing messages. Without an active
+        profile, or from another thread than the one that started it (the
+        thread pools of basic_table_tracking), the spans do nothing.
+Requirements: Python 2.7.x/Python3.x
+Copyright: Esri
+License:
+-----------------------------------------------------------------------------"""
+import os
+import sys
+import json
+import time
+import datetime
+import platform
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from io_backend import add_message
+
+_profile = None
+#--------------------------------------------------------------------------
+def current_rss():
+    """resident memory of this process in megabytes, None if unknown"""
+    try:
+        with open('/proc/self/statm') as handle:
+            pages = int(handle.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / (1024.0 * 1024.0)
+    except (IOError, OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / (1024.0 * 1024.0)
+    except ImportError:
+        return None
+#--------------------------------------------------------------------------
+def peak_rss():
+    """peak resident memory of this process in megabytes, None if unknown"""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Kilobytes on Linux, Bytes on macOS
+        return peak / (1024.0 * 1024.0) if sys.platform == 'darwin' else peak / 1024.0
+    except ImportError:
+        pass
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss) / (1024.0 * 1024.0)
+    except ImportError:
+        return None
+#--------------------------------------------------------------------------
+def profile_path(out_path, name):
+    """path of the profile of a run, stored next to out_path"""
+    return os.path.join(os.path.dirname(os.path.abspath(out_path)),
+                        "%s_profile.json" % name)
+#--------------------------------------------------------------------------
+class Span(object):
+    """the stage being measured, rows can be set while it runs"""
+    def __init__(self, name, rows=None):
+        self.name = name
+        self.rows = rows
+        self.discard = False
+#--------------------------------------------------------------------------
+class Profiler(object):
+    """
+    collects the stage spans of one run
+    Usage:
+     profiler = Profiler("uid_attribute_checking", out_json)
+     with profiler.stage("load") as span:
+         df = read()
+         span.rows = len(df)
+     profiler.finish()
+    """
+    def __init__(self, name, path=None):
+        self.name = name
+        self.path = path
+        self.started = datetime.datetime.now()
+        self._start = time.time()
+        self.thread = threading.current_thread()
+        self._stack = []
+        self._stages = OrderedDict()
+    #----------------------------------------------------------------------
+    @contextmanager
+    def stage(self, name, rows=None):
+        """measures the code run inside the with block"""
+        span = Span(name, rows)
+        self._stack.append(name)
+        path = "/".join(self._stack)
+        rss = current_rss()
+        start = time.time()
+        try:
+            yield span
+        finally:
+            seconds = time.time() - start
+            end = current_rss()
+            self._stack.pop()
+            if not span.discard:
+                self._record(path, seconds, span.rows,
+                             None if rss is None or end is None else end - rss)
+    #----------------------------------------------------------------------
+    def _record(self, path, seconds, rows, rss_delta):
+        stage = self._stages.get(path)
+        if stage is None:
+            stage = self._stages[path] = {
+                'stage': path,
+                'calls': 0,
+                'seconds': 0.0,
+                'rows': None,
+                'rss_delta_mb': None,
+                'peak_rss_mb': None
+            }
+        stage['calls'] += 1
+        stage['seconds'] += seconds
+        if rows is not None:
+            stage['rows'] = (stage['rows'] or 0) + int(rows)
+        if rss_delta is not None:
+            stage['rss_delta_mb'] = (stage['rss_delta_mb'] or 0.0) + rss_delta
+        peak = peak_rss()
+        if peak is not None:
+            stage['peak_rss_mb'] = max(stage['peak_rss_mb'] or 0.0, peak)
+    #----------------------------------------------------------------------
+    def chunks(self, name, iterable, rows=len):
+        """
+        yields the items of iterable, timing the production of each one as
+        the name stage. rows is a function returning the rows of an item,
+        or None when the items have no row count
+        """
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name) as span:
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    span.discard = True
+                    return
+                if rows is not None:
+                    span.rows = rows(item)
+            yield item
+    #----------------------------------------------------------------------
+    def report(self):
+        """dictionary of the run and its stages"""
+        stages = []
+        for stage in self._stages.values():
+            stage = dict(stage)
+            stage['seconds'] = round(stage['seconds'], 4)
+            stage['rows_per_second'] = round(stage['rows'] / stage['seconds'], 1) \
+                if stage['rows'] and stage['seconds'] > 0 else None
+            for key in ('rss_delta_mb', 'peak_rss_mb'):
+                if stage[key] is not None:
+                    stage[key] = round(stage[key], 1)
+            stages.append(stage)
+        peak = peak_rss()
+        return {
+            'tool': self.name,
+            'started': self.started.isoformat(),
+            'seconds': round(time.time() - self._start, 4),
+            'peak_rss_mb': None if peak is None else round(peak, 1),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'stages': stages
+        }
+    #----------------------------------------------------------------------
+    def finish(self, messages=True):
+        """writes the JSON profile and reports the stages as messages"""
+        report = self.report()
+        for stage in report['stages'] if messages else []:
+            details = ["%s Calls" % stage['calls']] if stage['calls'] > 1 else []
+            if stage['rows'] is not None:
+                details.append("%s Rows" % stage['rows'])
+            if stage['rss_delta_mb'] is not None:
+                details.append("%+.1f MB" % stage['rss_delta_mb'])
+            add_message("... STAGE %s: %s%s ..." %
+                        (stage['stage'],
+                         datetime.timedelta(seconds=stage['seconds']),
+                         " (%s)" % ", ".join(details) if details else ""))
+        if messages:
+            add_message("... %s %s ..." % ("TOTAL PROCESSING TIME: ",
+                                           datetime.timedelta(seconds=report['seconds'])))
+        if self.path is not None:
+            try:
+                with open(self.path, 'w') as handle:
+                    json.dump(report, handle, indent=2)
+                add_message("... Profile: %s ..." % self.path)
+            except (IOError, OSError) as e:
+                # A Missing Profile Must Not Fail the Run
+                add_message("... Profile Not Written: %s ..." % e)
+        return report
+#--------------------------------------------------------------------------
+def start_profile(name, path=None):
+    """starts the profile of a run, stages are recorded until finish"""
+    global _profile
+    _profile = Profiler(name, path)
+    return _profile
+#--------------------------------------------------------------------------
+def finish_profile(messages=True):
+    """ends the active profile, returns its report or None"""
+    global _profile
+    profiler, _profile = _profile, None
+    if profiler is None:
+        return None
+    return profiler.finish(messages)
+#--------------------------------------------------------------------------
+def _active():
+    """active profile of the calling thread"""
+    profiler = _profile
+    if profiler is None or profiler.thread is not threading.current_thread():
+        return None
+    return profiler
+#--------------------------------------------------------------------------
+@contextmanager
+def stage(name, rows=None):
+    """stage span of the active profile, does nothing without one"""
+    profiler = _active()
+    if profiler is None:
+        yield Span(name, rows)
+    else:
+        with profiler.stage(name, rows) as span:
+            yield span
+#--------------------------------------------------------------------------
+def timed_chunks(name, iterable, rows=len):
+    """Profiler.chunks of the active profile, iterable itself without one"""
+    profiler = _active()
+    if profiler is None:
+        return iterable
+    return profiler.chunks(name, iterable, rows)
@@ -0,0 +1,102 @@
+"""-----------------------------------------------------------------------------
+Name: ranking.py
+Purpose: Shared ranking kernel for the grid comparison tools.
+Description: Values are classified with np.digitize against a list of right
+        closed breakpoints, so a scheme with n breakpoints ranks values from
+        1 to n + 1. Change rankings compare new and old metrics: the score
+        is new / old (-1 when old is 0) and the ranking is negated where
+        the metric decreased. Any number of metric columns are ranked at
+        once as 2-D arrays.
+Requirements: Python 2.7.x/Python3.x
+Copyright: Esri
+License:
+-----------------------------------------------------------------------------"""
+import numpy as np
+
+# Score Breakpoints of the Change Rankings (1: <= 0.5 ... 5: > 1.5)
+CHANGE_BREAKS = (0.5, 0.75, 1.25, 1.5)
+# Percent Complete Breakpoints of the Completeness Rankings
+COMPLETENESS_BREAKS = (20, 40, 60, 80)
+# New, Old, Score, Diff and Ranking Columns of Each Ranking Method
+RANKING_METRICS = {
+    "POINT" : ("FREQUENCY", "OLD_FREQUENCY", "SCORE", "DIFF", "RANKING"),
+    "POLYLINE" : ("NEW_LENGTH", "OLD_LENGTH", "SCORE_LENGTH", "DIFF_LENGTH", "RANKING_LENGTH"),
+    "POLYGON" : ("NEW_AREA", "OLD_AREA", "SCORE_AREA", "DIFF_AREA", "RANKING_AREA")
+}
+#--------------------------------------------------------------------------
+def parse_breaks(value, default):
+    """
+    reads breakpoints from a tool parameter such as "0.5;0.75;1.25;1.5"
+    Output:
+     tuple of floats, default when value is empty
+    """
+    if value is None or str(value).strip() in ('', '#'):
+        return tuple(default)
+    breaks = tuple(float(v) for v in str(value).replace(',', ';').split(';')
+                   if v.strip())
+    if list(breaks) != sorted(breaks):
+        raise ValueError("Breakpoints Must Be In Increasing Order: %s" % value)
+    return breaks
+#--------------------------------------------------------------------------
+def classify(values, breaks, lowest=0.0, missing=-1):
+    """
+    ranks values with right closed bins
+    Inputs:
+     values - numeric array of any shape
+     breaks - increasing breakpoints, values <= breaks[0] rank 1 and
+              values > breaks[-1] rank len(breaks) + 1
+     lowest - values below it (and NaN) get the missing rank
+     missing - rank of values that cannot be classified
+    Output:
+     int64 array of the same shape as values
+    """
+    values = np.asarray(values, dtype=np.float64)
+    ranks = np.digitize(values, np.asarray(breaks, dtype=np.float64),
+                        right=True).astype(np.int64) + 1
+    ranks[~(values >= lowest)] = missing
+    return ranks
+#--------------------------------------------------------------------------
+def change_ranking(new, old, breaks=CHANGE_BREAKS):
+    """
+    scores and ranks the change between new and old metrics
+    Inputs:
+     new, old - numeric arrays of the same shape, one column per metric
+     breaks - score breakpoints
+    Output:
+     tuple of (score, diff, ranking) arrays. The score is new / old, or
+     -1 when old is 0, in which case the ranking is the highest rank if
+     new > 0 and 1 otherwise. Rankings are negative where diff < 0.
+    """
+    new = np.asarray(new, dtype=np.float64)
+    old = np.asarray(old, dtype=np.float64)
+    has_old = old > 0
+    score = np.full(new.shape, -1.0)
+    score[has_old] = new[has_old] / old[has_old]
+    diff = new - old
+    ranking = classify(score, breaks)
+    ranking[~has_old] = np.where(new[~has_old] > 0, len(breaks) + 1, 1)
+    ranking[diff < 0] *= -1
+    return score, diff, ranking
+#--------------------------------------------------------------------------
+def rank_changes(df, methods, breaks=CHANGE_BREAKS):
+    """
+    adds the score, diff and ranking columns of every method to a
+    DataFrame, all metrics are ranked in a single pass
+    Inputs:
+     df - pandas DataFrame with the new and old metric columns
+     methods - list of POINT, POLYLINE and/or POLYGON
+     breaks - score breakpoints
+    Output:
+     the DataFrame
+    """
+    metrics = [RANKING_METRICS[method] for method in methods]
+    if len(metrics) == 0:
+        return df
+    new = np.column_stack([df[m[0]].values for m in metrics])
+    old = np.column_stack([df[m[1]].values for m in metrics])
+    score, diff, ranking = change_ranking(new, old, breaks)
+    for i, (_, _, score_col, diff_col, rank_col) in enumerate(metrics):
+        df[rank_col] = ranking[:, i]
+        df[score_col] = score[:, i]
+        df[diff_col] = diff[:, i]
+    return df
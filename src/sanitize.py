@@ -2,7 +2,8 @@
 Name: sanitize.py
 Purpose: Replaces values in a field of a feature class with another value.
 Description: Replaces a specific value within an attribute field with a user
-        defined value.
+        defined value. A JSON rules file (see load_rules) applies many
+        find/replace rules and lookup remaps in a single pass instead.
 Requirements: Python 2.7.x/Python3.x, ArcGIS 10.4+/Pro 1.2+
 Author(s): Andrew Chapkowski, Contractor for National Geospatial-Intelligence
         Agency (NGA) | Gregory Brunner, Contractor NGA
@@ -14,15 +15,26 @@ License:
 -----------------------------------------------------------------------------"""
 
 import os
+import re
+import csv
 import sys
-import platform
-import itertools
+import json
+import datetime
 
-import arcpy
-from arcpy import env
-from arcpy import da
+try:
+    import arcpy
+    from arcpy import env
+    from arcpy import da
+except ImportError:
+    # Without ArcGIS Only the io_backend Based Kernels Can Run
+    arcpy = env = da = None
 import numpy as np
 import pandas as pd
+from metadata_cache import describe, field_names, list_fields
+from io_backend import get_backend, add_message, calc_chunk_size
+from process_pool import set_executable
+from where_clause import WhereClause
+from profiling import start_profile, finish_profile, profile_path, stage
 
 #--------------------------------------------------------------------------
 class FunctionError(Exception):
@@ -44,38 +56,459 @@ def trace():
     #
     synerror = traceback.format_exc().splitlines()[-1]
     return line, __file__, synerror
+GUID_PATTERN = re.compile(r"^\{?[0-9A-Fa-f]{8}(-[0-9A-Fa-f]{4}){3}-[0-9A-Fa-f]{12}\}?$")
 #--------------------------------------------------------------------------
-def grouper_it(n, iterable):
+def is_null_search(find_value):
+    """True when the find value means NULL: None, 'None' or empty text"""
+    return find_value is None or \
+           str(find_value).lower() == "none" or \
+           str(find_value).strip() == ""
+#--------------------------------------------------------------------------
+def field_value(value, field_type):
     """
-    creates chunks of cursor row objects to make the memory
-    footprint more manageable
+    converts a value, usually the text of a tool parameter, to the type
+    of a field. Raises ValueError when the field cannot hold it.
     """
-    it = iter(iterable)
-    while True:
-        chunk_it = itertools.islice(it, n)
-        try:
-            first_el = next(chunk_it)
-        except StopIteration:
-            return
-        yield itertools.chain((first_el,), chunk_it)
+    if value is None:
+        return None
+    if field_type in ('Integer', 'SmallInteger'):
+        number = float(value)
+        if number != int(number):
+            raise ValueError("%r Is Not an Integer" % value)
+        return int(number)
+    if field_type in ('Double', 'Single'):
+        return float(value)
+    if field_type == 'Date':
+        if isinstance(value, (datetime.date, pd.Timestamp)):
+            return pd.Timestamp(value)
+        date = pd.NaT if isinstance(value, (int, float)) else pd.Timestamp(u"%s" % value)
+        if pd.isnull(date):
+            raise ValueError("%r Is Not a Date" % value)
+        return date
+    if field_type in ('GUID', 'GlobalID'):
+        if not GUID_PATTERN.match(u"%s" % value):
+            raise ValueError("%r Is Not a GUID" % value)
+        return u"{%s}" % (u"%s" % value).strip(u"{}").upper()
+    if field_type == 'String':
+        return u"%s" % value
+    return value
 #--------------------------------------------------------------------------
-def calc_chunk_size():
-    """determines the chunk size based on 32 vs 64-bit python"""
+def _can_hold(value, field_type):
+    """False when a field can never match or store the value"""
+    if is_null_search(value):
+        return True
     try:
-        if platform.architecture()[0].lower() == "32bit":
-            return 50000
+        field_value(value, field_type)
+    except (TypeError, ValueError):
+        return False
+    return True
+#--------------------------------------------------------------------------
+def read_lookup(path):
+    """
+    reads a remap table from a CSV file, the first column holds the old
+    and the second the new values, the first row is a header. Empty cells
+    are NULL.
+    """
+    lookup = {}
+    with open(path) as handle:
+        reader = csv.reader(handle)
+        next(reader, None)
+        for row in reader:
+            if len(row) < 2:
+                continue
+            old, new = [value if value.strip() != "" else None for value in row[:2]]
+            lookup[old] = new
+    return lookup
+#--------------------------------------------------------------------------
+class SanitizeRule(object):
+    """
+    one change applied to a set of fields: either find_value is replaced
+    with replace_value, or, when lookup is set, every value found in the
+    lookup is remapped to its new value. where_clause limits the rule to
+    the rows it selects and is evaluated in memory (see where_clause.py).
+    """
+    def __init__(self, fields="*", find_value=None, replace_value=0,
+                 where_clause=None, lookup=None):
+        if isinstance(fields, str) and fields != "*":
+            fields = [field.strip() for field in fields.split(';') if field.strip()]
+        if fields == ["*"]:
+            fields = "*"
+        self.fields = fields
+        self.find_value = find_value
+        self.replace_value = None if is_null_search(replace_value) else replace_value
+        self.where_clause = where_clause or None
+        self.lookup = lookup
+        self.where = WhereClause(where_clause) if where_clause else None
+        self.targets = []
+        self._values = {}
+    #----------------------------------------------------------------------
+    def resolve(self, all_fields, field_types):
+        """
+        matches the rule fields to the dataset fields, ignoring case, and
+        converts the values to the field types
+        Inputs:
+         all_fields - fields "*" stands for
+         field_types - dictionary of field name: field type
+        """
+        names = dict((name.upper(), name) for name in field_types)
+        fields = all_fields if self.fields in (None, "*") else self.fields
+        targets = []
+        for field in fields:
+            if field.upper() not in names:
+                raise ValueError("Sanitize Field Does Not Exist: %s" % field)
+            targets.append(names[field.upper()])
+        self._values = {}
+        if self.lookup is None:
+            # Fields That Cannot Hold the Find or Replace Value Are Left Alone
+            self.targets = [field for field in targets
+                            if _can_hold(self.find_value, field_types.get(field)) and
+                            _can_hold(self.replace_value, field_types.get(field))]
+            for field in self.targets:
+                field_type = field_types.get(field)
+                find = None if is_null_search(self.find_value) else \
+                    field_value(self.find_value, field_type)
+                self._values[field] = (find, field_value(self.replace_value, field_type))
         else:
-            return 500000
+            self.targets = targets
+            for field in targets:
+                field_type = field_types.get(field)
+                keys, values, null = [], [], ()
+                for old, new in self.lookup.items():
+                    if not _can_hold(new, field_type):
+                        continue
+                    if is_null_search(old):
+                        null = (field_value(new, field_type),)
+                    elif _can_hold(old, field_type):
+                        keys.append(field_value(old, field_type))
+                        values.append(field_value(new, field_type))
+                self._values[field] = (pd.Index(keys, dtype=object),
+                                       np.array(values, dtype=object), null)
+        self.where_fields = []
+        for name in self.where.fields if self.where is not None else []:
+            if name not in names:
+                raise ValueError("Where Clause Field Does Not Exist: %s" % name)
+            self.where_fields.append(names[name])
+        if self.where is not None:
+            self.where.bind(dict((name.upper(), field_type)
+                                 for name, field_type in field_types.items()))
+        return self
+    #----------------------------------------------------------------------
+    def apply(self, field, values):
+        """
+        Output:
+         tuple of (boolean mask of the changed values, new values), the
+         new values are an array for lookups and a scalar otherwise
+        """
+        if self.lookup is None:
+            find, replace = self._values[field]
+            if find is None:
+                return np.asarray(pd.isnull(values)), replace
+            return np.asarray(values == find, dtype=bool), replace
+        keys, targets, null = self._values[field]
+        codes, uniques = pd.factorize(values)
+        # NULL Values Have Code -1 and Take the Appended -1 Position
+        position = np.append(keys.get_indexer(uniques), -1).take(codes)
+        mask = position >= 0
+        new = np.empty(len(values), dtype=object)
+        new[mask] = targets.take(position[mask])
+        if null:
+            nulls = codes < 0
+            mask |= nulls
+            new[nulls] = null[0]
+        return mask, new
+#--------------------------------------------------------------------------
+def load_rules(path):
+    """
+    reads a JSON rules file, a list of rules like
+     [{"fields": ["F_CODE"], "find": "AL013", "replace": "AL015"},
+      {"fields": "*", "find": null, "replace": 0, "where": "FCSUBTYPE = 5"},
+      {"fields": "ZVH;HGT", "lookup": {"-999999": null}},
+      {"fields": ["FFN"], "lookup": "ffn_remap.csv"}]
+    A lookup is either a JSON object or the path of a CSV file, see
+    read_lookup; relative paths start at the folder of the rules file.
+    Output:
+     list of SanitizeRule in file order
+    """
+    with open(path) as handle:
+        items = json.load(handle)
+    if isinstance(items, dict):
+        items = items.get('rules', [])
+    rules = []
+    for item in items:
+        lookup = item.get('lookup')
+        if isinstance(lookup, str):
+            if not os.path.isabs(lookup):
+                lookup = os.path.join(os.path.dirname(os.path.abspath(path)), lookup)
+            lookup = read_lookup(lookup)
+        rules.append(SanitizeRule(fields=item.get('fields', "*"),
+                                  find_value=item.get('find'),
+                                  replace_value=item.get('replace', 0),
+                                  where_clause=item.get('where'),
+                                  lookup=lookup))
+    return rules
+#--------------------------------------------------------------------------
+def rule_values(df, rules, selected=None):
+    """
+    applies resolved rules in order to the rows of one chunk, later rules
+    see the values written by earlier ones
+    Inputs:
+     selected - optional boolean array of the rows the rules may change
+    Output:
+     tuple of (dictionary of field: new values, dictionary of field:
+     changed mask) for the fields a rule changed
+    """
+    n = len(df)
+    work = {}
+    changed = {}
+    for rule in rules:
+        rows = selected
+        if rule.where is not None:
+            columns = dict((field.upper(), work.get(field, df[field].values))
+                           for field in rule.where_fields)
+            rows = rule.where.mask(columns, n)
+            if selected is not None:
+                rows &= selected
+            if not rows.any():
+                continue
+        for field in rule.targets:
+            mask, new = rule.apply(field, work.get(field, df[field].values))
+            if rows is not None:
+                mask &= rows
+            if not mask.any():
+                continue
+            if field not in work:
+                # Through pandas, Dates Become Timestamps Rather Than Integers
+                work[field] = df[field].to_numpy(dtype=object, copy=True)
+                changed[field] = np.zeros(n, dtype=bool)
+            work[field][mask] = new[mask] if isinstance(new, np.ndarray) else new
+            changed[field] |= mask
+    return work, changed
+#--------------------------------------------------------------------------
+def apply_rules(df, rules, oid_field):
+    """
+    applies resolved rules to one chunk, see rule_values
+    Output:
+     DataFrame of the OID and the changed fields of the changed rows
+     only, None when no rule changes the chunk
+    """
+    work, changed = rule_values(df, rules)
+    if len(changed) == 0:
+        return None
+    fields = [field for field in df.columns if field in changed]
+    rows = np.logical_or.reduce([changed[field] for field in fields])
+    result = pd.DataFrame({oid_field: df[oid_field].values[rows]})
+    for field in fields:
+        result[field] = work[field][rows]
+    return result
+#--------------------------------------------------------------------------
+def oid_ranges(fc, chunk_size):
+    """[start, end) ObjectID ranges of at most chunk_size IDs covering fc"""
+    extent = get_backend(fc).oid_extent(fc)
+    if extent is None:
+        return []
+    low, high = int(extent[0]), int(extent[1])
+    return [(start, min(start + chunk_size, high + 1))
+            for start in range(low, high + 1, chunk_size)]
+#--------------------------------------------------------------------------
+def _range_clause(oid_field, bounds, where_clause=None):
+    clause = "%s >= %s AND %s < %s" % (oid_field, bounds[0], oid_field, bounds[1])
+    if where_clause:
+        clause = "(%s) AND (%s)" % (where_clause, clause)
+    return clause
+#--------------------------------------------------------------------------
+def _sanitize_range(task):
+    """
+    reads one ObjectID range and returns its changed rows, the process
+    pool entry point of sanitize_table
+    Output:
+     tuple of (rows read, DataFrame of changed rows or None)
+    """
+    fc, oid_field, fields, rules, where_clause, bounds = task
+    read = 0
+    parts = []
+    for df in get_backend(fc).read_chunks(fc, [oid_field] + fields,
+                                          chunk_size=bounds[1] - bounds[0],
+                                          where_clause=_range_clause(oid_field, bounds,
+                                                                     where_clause)):
+        read += len(df)
+        changed = apply_rules(df, rules, oid_field)
+        if changed is not None:
+            parts.append(changed)
+        del df
+    if len(parts) == 0:
+        return read, None
+    return read, pd.concat(parts, ignore_index=True)
+#--------------------------------------------------------------------------
+def _map_ranges(function, tasks, processes=None):
+    """
+    yields function(task) for every task in order, from a process pool
+    when processes is more than one
+    """
+    if processes is None or processes < 2 or len(tasks) < 2:
+        for task in tasks:
+            yield function(task)
+        return
+    import multiprocessing
+    set_executable()
+    pool = multiprocessing.Pool(processes=min(processes, len(tasks)))
+    try:
+        for result in pool.imap(function, tasks):
+            yield result
+    finally:
+        pool.close()
+        pool.join()
+#--------------------------------------------------------------------------
+def _resolve_rules(fc, rules, oid_field):
+    """
+    resolves rules against the editable fields of fc
+    Output:
+     tuple of (rules changing at least one field, fields the rules read)
+    """
+    field_types = dict((field.name, field.type) for field in list_fields(fc))
+    editable = [field for field in field_names(fc, exclude_types=('Geometry', 'Blob', 'Raster'),
+                                               editable_only=True)
+                if field != oid_field]
+    fields = []
+    for rule in rules:
+        rule.resolve(editable, field_types)
+        for field in rule.targets + rule.where_fields:
+            if field not in fields and field != oid_field:
+                fields.append(field)
+    return [rule for rule in rules if len(rule.targets) > 0], fields
+#--------------------------------------------------------------------------
+def sanitize_table(fc, rules, oid_field=None, where_clause=None,
+                   chunk_size=None, processes=None):
+    """
+    applies a list of rules to a table in one pass
+
+    The table is split into ObjectID ranges of chunk_size IDs. Every range
+    is read once with the fields of all rules, the rules are applied in
+    order with NumPy masks and only the rows that changed are written
+    back, in place. Ranges without changes are not written at all.
+    Inputs:
+     rules - list of SanitizeRule
+     where_clause - optional selection of the rows to read, applied by
+                    the cursor before any rule
+     processes - number of worker processes reading and changing ranges
+                 in parallel, the updates are always written by the
+                 calling process
+    Output:
+     number of rows changed
+    """
+    if oid_field is None:
+        oid_field = describe(fc).OIDFieldName
+    if chunk_size is None:
+        chunk_size = calc_chunk_size()
+    rules, fields = _resolve_rules(fc, rules, oid_field)
+    if len(rules) == 0:
+        return 0
+    tasks = [(fc, oid_field, fields, rules, where_clause, bounds)
+             for bounds in oid_ranges(fc, chunk_size)]
+    backend = get_backend(fc)
+    read = updated = 0
+    for rows, changed in _map_ranges(_sanitize_range, tasks, processes):
+        read += rows
+        if changed is not None:
+            updated += backend.update_frame(fc, changed, oid_field)
+        del changed
+    add_message("... Sanitized %s of %s Rows with %s Rules ..." % (updated, read, len(rules)))
+    return updated
+#--------------------------------------------------------------------------
+def _copy_range(task):
+    """
+    reads one ObjectID range, geometry as WKB, and applies the rules to
+    it, the process pool entry point of copy_sanitized
+    Output:
+     tuple of (rows changed, list of DataFrames to append)
+    """
+    fc, oid_field, fields, rules, where, bounds = task
+    updated = 0
+    frames = []
+    for df in get_backend(fc).read_chunks(fc, fields,
+                                          chunk_size=bounds[1] - bounds[0],
+                                          where_clause=_range_clause(oid_field, bounds)):
+        selected = None
+        if where is not None:
+            selected = where.mask(dict((column.upper(), df[column].values)
+                                       for column in df.columns), len(df))
+        work, changed = rule_values(df, rules, selected)
+        for field in work:
+            df[field] = work[field]
+        if len(changed) > 0:
+            updated += int(np.logical_or.reduce(list(changed.values())).sum())
+        frames.append(df)
+    return updated, frames
+#--------------------------------------------------------------------------
+def copy_sanitized(fc, out_db, out_name, rules, where_clause=None,
+                   chunk_size=None, processes=None):
+    """copies a table or feature class with the rules applied
+
+    Reads every ObjectID range of fc once, applies the rules in memory
+    and appends the rows to a new dataset like fc, instead of copying
+    the data and sanitizing the copy in a second pass. Geometries are
+    read and written as WKB and are never decoded. A where_clause that
+    where_clause.WhereClause cannot evaluate falls back to a plain copy
+    sanitized in place with sanitize_table.
+    Inputs:
+     rules - list of SanitizeRule
+     where_clause - optional selection of the rows to sanitize, every
+                    row is copied
+     processes - number of worker processes, see sanitize_table
+    Output:
+     path of the new dataset
+    """
+    try:
+        desc = describe(fc)
+        oid_field = desc.OIDFieldName
+        if chunk_size is None:
+            chunk_size = calc_chunk_size()
+        fields = field_names(fc, exclude_types=('OID', 'Geometry', 'Raster'),
+                             editable_only=True)
+        where = None
+        if where_clause:
+            try:
+                where = WhereClause(where_clause)
+                copied = [field.upper() for field in fields]
+                for name in where.fields:
+                    if name not in copied:
+                        raise ValueError("Field %s Is Not Copied" % name)
+                where.bind(dict((field.name.upper(), field.type)
+                                for field in list_fields(fc)))
+            except ValueError:
+                out_fc = copy_sanitized(fc, out_db, out_name, [],
+                                        chunk_size=chunk_size, processes=processes)
+                sanitize_table(out_fc, rules, where_clause=where_clause,
+                               chunk_size=chunk_size, processes=processes)
+                return out_fc
+        rules = _resolve_rules(fc, rules, oid_field)[0]
+        if getattr(desc, 'shapeType', None):
+            fields = fields + ['SHAPE@WKB']
+        backend = get_backend(out_db)
+        out_fc = backend.create_output(fc, out_db, out_name)
+        tasks = [(fc, oid_field, fields, rules, where, bounds)
+                 for bounds in oid_ranges(fc, chunk_size)]
+        read = updated = 0
+        for changed, frames in _map_ranges(_copy_range, tasks, processes):
+            updated += changed
+            for df in frames:
+                read += len(df)
+                backend.insert_frame(out_fc, df)
+            del frames
+        add_message("... Copied %s Rows, Sanitized %s with %s Rules ..." %
+                    (read, updated, len(rules)))
+        return out_fc
+    except FunctionError:
+        raise
     except:
         line, filename, synerror = trace()
         raise FunctionError(
-                {
-                    "function": "calc_chunk_size",
-                    "line": line,
-                    "filename": __file__,
-                    "synerror": synerror,
-                    "arc" : str(arcpy.GetMessages(2))
-                }
+            {
+                "function": "copy_sanitized",
+                "line": line,
+                "filename": filename,
+                "synerror": synerror,
+                "arc" : str(arcpy.GetMessages(2)) if arcpy else ""
+            }
         )
 #--------------------------------------------------------------------------
 def replace_values(fc,
@@ -83,40 +516,28 @@ def replace_values(fc,
                   oid_field=None,
                   find_value=None,
                   replace_value=0,
-                  where_clause=None):
+                  where_clause=None,
+                  chunk_size=None,
+                  processes=None):
     """updates a set of rows in chunks
 
+    Replaces find_value with replace_value, see sanitize_table.
+    Inputs:
+     fields - list of fields, "*" or None for every editable field
+     find_value - value to replace, None or empty text for NULL
+     replace_value - new value, converted to the type of each field
+     where_clause - optional selection of the rows to sanitize
+     processes - number of worker processes, see sanitize_table
+    Output:
+     fc
     """
     try:
         if fields is None or \
            isinstance(fields, list) == False or \
            fields == "*":
-            fields = [field.name for field in arcpy.ListFields(fc) \
-                      if field.type not in ('Geometry', 'Blob', 'Raster')]
-        if oid_field is None:
-            oid_field = arcpy.Describe(fc).OIDFieldName
-        chunk_size = calc_chunk_size()
-        if oid_field not in fields:
-            fields.append(oid_field)
-        with da.SearchCursor(fc, fields,
-                             where_clause=where_clause) as cursor:
-            search_fields = [field for field in cursor.fields if field != oid_field]
-            for group in grouper_it(chunk_size, cursor):
-                df = pd.DataFrame.from_records(group, columns=cursor.fields)
-                for field in search_fields:
-                    if  find_value is None or \
-                        str(find_value).lower() == "none" or \
-                        str(find_value).lower().strip() == "":
-                        df.loc[df[field].isnull(), field] = replace_value
-                    else:
-                        df.loc[df[field] == find_value, field] = replace_value
-                    del field
-                array = df.to_records(index=False)
-                da.ExtendTable(fc, oid_field,
-                               array, oid_field,
-                               False)
-                del array
-                del df
+            fields = "*"
+        rule = SanitizeRule(fields, find_value, replace_value)
+        sanitize_table(fc, [rule], oid_field, where_clause, chunk_size, processes)
         return fc
     except:
         line, filename, synerror = trace()
@@ -126,7 +547,7 @@ def replace_values(fc,
                 "line": line,
                 "filename": filename,
                 "synerror": synerror,
-                "arc" : str(arcpy.GetMessages(2))
+                "arc" : str(arcpy.GetMessages(2)) if arcpy else ""
             }
         )
 #--------------------------------------------------------------------------
@@ -139,35 +560,51 @@ def main(*argv):
         replace_value = argv[3]#None#
         where_clause = argv[4]#None#
         in_place = str(argv[5]).lower() == "true"#argv[5]
+        # Optional Number of Worker Processes (argv[6] Is the Output)
+        processes = int(argv[7]) if len(argv) > 7 and argv[7] else None
+        # Optional JSON Rules File, Applied Instead of the Find/Replace Pair
+        rules_file = argv[8] if len(argv) > 8 and argv[8] else None
         #  Local Variables
         #
         scratchGDB = env.scratchGDB
         scratchFolder = env.scratchFolder
-        in_place_fc = os.path.join(scratchGDB, os.path.basename(table)+"_copy")
         isFC = False
         #  Logic
         #
+        start_profile("sanitize", profile_path(scratchGDB, "sanitize"))
         # Determine if table or feature class
-        desc = arcpy.Describe(table)
+        desc = describe(table)
         datasetType = desc.datasetType
+        del desc
         if in_place == False:
-
-            if datasetType == "Table":
-                in_place_fc = arcpy.CopyRows_management(table, in_place_fc)[0]
-            elif datasetType == "FeatureClass":
-                in_place_fc = arcpy.CopyFeatures_management(table, in_place_fc)[0]
+            if datasetType not in ("Table", "FeatureClass"):
+                raise Exception("Invalid datatype of " + datasetType)
+            # Copy and Sanitize in One Pass
+            if rules_file:
+                rules = load_rules(rules_file)
             else:
-                raise Exception("Invalid datatype of " + desc.datasetType)
+                rules = [SanitizeRule(fields, find_value, replace_value)]
+            with stage("copy"):
+                table = copy_sanitized(table, scratchGDB,
+                                       os.path.basename(table) + "_copy",
+                                       rules,
+                                       where_clause=where_clause,
+                                       processes=processes)
         else:
-            in_place_fc = table
-        del desc
-        #perform the replace
-        table = replace_values(fc=in_place_fc,
-                              fields=fields,
-                              oid_field=None,
-                              find_value=find_value,
-                              replace_value=replace_value,
-                              where_clause=where_clause)
+            #perform the replace
+            with stage("replace"):
+                if rules_file:
+                    sanitize_table(table, load_rules(rules_file),
+                                   where_clause=where_clause,
+                                   processes=processes)
+                else:
+                    table = replace_values(fc=table,
+                                          fields=fields,
+                                          oid_field=None,
+                                          find_value=find_value,
+                                          replace_value=replace_value,
+                                          where_clause=where_clause,
+                                          processes=processes)
         # return results
         arcpy.SetParameterAsText(6, table)
 
@@ -190,6 +627,8 @@ def main(*argv):
         arcpy.AddError("error on line: %s" % line)
         arcpy.AddError("error in file name: %s" % filename)
         arcpy.AddError("with error message: %s" % synerror)
+    finally:
+        finish_profile()
 #--------------------------------------------------------------------------
 if __name__ == "__main__":
     env.overwriteOutput = True
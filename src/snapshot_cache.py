@@ -0,0 +1,299 @@
+"""-----------------------------------------------------------------------------
+Name: snapshot_cache.py
+Purpose: Columnar on-disk cache of feature class snapshots.
+Description: A snapshot is read from the geodatabase once and stored as a
+        folder of raw column files: integers, doubles and dates (microseconds) as typed
+        arrays with a null mask, text and WKB geometries as one byte buffer
+        plus row offsets. Rows are sorted by the unique ID, so the ID column
+        doubles as the index of the snapshot. Columns are memory-mapped on
+        read and handed out in the same DataFrame chunks as
+        stream_compare.cursor_chunks, so the comparison tools can read an
+        unchanged baseline without decoding it from the geodatabase again.
+        A snapshot is rebuilt when its source, spatial reference or fields
+        change or the source is modified. Sources without a file system
+        modification time (enterprise geodatabases, services) are never
+        cached, their edits could not be detected.
+Requirements: Python 2.7.x/Python3.x, ArcGIS 10.4+/Pro 1.2+
+Copyright: Esri
+License:
+-----------------------------------------------------------------------------"""
+import os
+import json
+import shutil
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+from metadata_cache import list_fields, modified_time
+from io_backend import get_backend, calc_chunk_size, _column_name
+
+SNAPSHOT_VERSION = 1
+# Storage of Each Geodatabase Field Type
+FIELD_KINDS = {
+    'OID' : 'int',
+    'SmallInteger' : 'int',
+    'Integer' : 'int',
+    'BigInteger' : 'int',
+    'Single' : 'float',
+    'Double' : 'float',
+    'Date' : 'date',
+    'String' : 'text',
+    'GUID' : 'text',
+    'GlobalID' : 'text'
+}
+#--------------------------------------------------------------------------
+def _sr_string(spatial_reference):
+    if spatial_reference is None:
+        return ""
+    if hasattr(spatial_reference, 'exportToString'):
+        return spatial_reference.exportToString()
+    return str(spatial_reference)
+#--------------------------------------------------------------------------
+def snapshot_path(cache_dir, fc, spatial_reference=None):
+    """folder of the snapshot of fc inside cache_dir"""
+    source = os.path.abspath(str(fc))
+    key = hashlib.md5((source + _sr_string(spatial_reference)).encode('utf-8'))
+    name = os.path.splitext(os.path.basename(source))[0]
+    return os.path.join(cache_dir, "%s_%s.snapshot" % (name, key.hexdigest()[:12]))
+#--------------------------------------------------------------------------
+class _ColumnWriter(object):
+    """appends the chunks of one column to its files"""
+    def __init__(self, folder, index, name, kind):
+        self.name = name
+        self.kind = kind
+        base = os.path.join(folder, "c%d" % index)
+        self.files = {'data': open(base + ".data", 'wb'),
+                      'nulls': open(base + ".nulls", 'wb')}
+        if kind in ('text', 'wkb'):
+            self.files['offsets'] = open(base + ".offsets", 'wb')
+            self.files['offsets'].write(np.zeros(1, dtype=np.int64).tobytes())
+            self.position = 0
+    #----------------------------------------------------------------------
+    def write(self, values):
+        series = pd.Series(values)
+        nulls = series.isnull().values
+        if self.kind == 'int':
+            data = series.fillna(0).values.astype(np.int64)
+        elif self.kind == 'float':
+            data = series.values.astype(np.float64)
+        elif self.kind == 'date':
+            data = pd.to_datetime(series).values.astype('datetime64[us]').view(np.int64)
+        else:
+            items = []
+            for value, null in zip(series.values, nulls):
+                if null:
+                    items.append(b"")
+                elif self.kind == 'wkb' or isinstance(value, bytes):
+                    items.append(bytes(value))
+                else:
+                    items.append((u"%s" % value).encode('utf-8'))
+            sizes = np.fromiter((len(item) for item in items),
+                                dtype=np.int64, count=len(items))
+            offsets = self.position + np.cumsum(sizes)
+            if len(items) > 0:
+                self.position = int(offsets[-1])
+            self.files['offsets'].write(offsets.tobytes())
+            data = np.frombuffer(b"".join(items), dtype=np.uint8)
+        self.files['data'].write(np.ascontiguousarray(data).tobytes())
+        self.files['nulls'].write(nulls.astype(np.uint8).tobytes())
+    #----------------------------------------------------------------------
+    def close(self):
+        for handle in self.files.values():
+            handle.close()
+#--------------------------------------------------------------------------
+def _read_rows(fc, fields, unique, chunk_size, spatial_reference):
+    """cursor chunks of fc, sorted by unique when it is given"""
+    for chunk in get_backend(fc).read_chunks(fc, fields, unique, chunk_size,
+                                             spatial_reference=spatial_reference):
+        yield chunk
+#--------------------------------------------------------------------------
+def build_snapshot(fc, path, fields, unique=None, spatial_reference=None,
+                   chunk_size=None):
+    """
+    reads a feature class once and writes its snapshot
+    Inputs:
+     fc - feature class or table
+     path - snapshot folder, replaced if it exists
+     fields - cursor fields, SHAPE@WKB stores the geometries
+     unique - optional unique ID field, rows are sorted by it
+     spatial_reference - optional spatial reference of the geometries
+    Output:
+     Snapshot
+    """
+    if chunk_size is None:
+        chunk_size = calc_chunk_size()
+    fields = list(fields)
+    if unique is not None and unique not in fields:
+        fields = [unique] + fields
+    field_types = dict((field.name, field.type) for field in list_fields(fc))
+    kinds = []
+    for field in fields:
+        if field.upper() == 'SHAPE@WKB':
+            kinds.append('wkb')
+        elif field in field_types and field_types[field] in FIELD_KINDS:
+            kinds.append(FIELD_KINDS[field_types[field]])
+        else:
+            raise ValueError("Field Cannot Be Cached: %s" % field)
+    modified = modified_time(fc)
+    building = path + ".building"
+    if os.path.isdir(building):
+        shutil.rmtree(building)
+    os.makedirs(building)
+    writers = [_ColumnWriter(building, i, field, kind)
+               for i, (field, kind) in enumerate(zip(fields, kinds))]
+    count = 0
+    try:
+        for chunk in _read_rows(fc, fields, unique, chunk_size, spatial_reference):
+            for writer in writers:
+                writer.write(chunk[_column_name(writer.name)].values)
+            count += len(chunk)
+            del chunk
+    finally:
+        for writer in writers:
+            writer.close()
+    meta = {'version': SNAPSHOT_VERSION,
+            'source': os.path.abspath(str(fc)),
+            'modified': modified,
+            'spatial_reference': _sr_string(spatial_reference),
+            'unique': unique,
+            'count': count,
+            'fields': fields,
+            'kinds': kinds}
+    with open(os.path.join(building, "snapshot.json"), 'w') as writer:
+        json.dump(meta, writer)
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    os.rename(building, path)
+    return Snapshot(path)
+#--------------------------------------------------------------------------
+class Snapshot(object):
+    """
+    a memory-mapped snapshot written by build_snapshot
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "snapshot.json"), 'r') as reader:
+            self.meta = json.load(reader)
+        self._maps = {}
+    #----------------------------------------------------------------------
+    def __len__(self):
+        return self.meta['count']
+    #----------------------------------------------------------------------
+    @property
+    def fields(self):
+        """cursor fields stored in the snapshot"""
+        return list(self.meta['fields'])
+    #----------------------------------------------------------------------
+    @property
+    def unique(self):
+        """unique ID field the rows are sorted by, or None"""
+        return self.meta['unique']
+    #----------------------------------------------------------------------
+    def _map(self, index, part, dtype):
+        key = (index, part)
+        if key not in self._maps:
+            filename = os.path.join(self.path, "c%d.%s" % (index, part))
+            if os.path.getsize(filename) == 0:
+                self._maps[key] = np.zeros(0, dtype=dtype)
+            else:
+                self._maps[key] = np.memmap(filename, dtype=dtype, mode='r')
+        return self._maps[key]
+    #----------------------------------------------------------------------
+    def column(self, field, start=0, stop=None):
+        """
+        decodes rows start:stop of a field with the dtype a cursor chunk
+        would have: integers with NULLs become floats, dates datetime64,
+        text and WKB object arrays with None for NULL and columns that are
+        entirely NULL object arrays of None
+        """
+        index = self.meta['fields'].index(field)
+        kind = self.meta['kinds'][index]
+        if stop is None:
+            stop = len(self)
+        nulls = self._map(index, 'nulls', np.uint8)[start:stop].astype(bool)
+        if kind in ('text', 'wkb'):
+            offsets = self._map(index, 'offsets', np.int64)[start:stop + 1]
+            data = self._map(index, 'data', np.uint8)
+            values = np.empty(stop - start, dtype=object)
+            for i in range(stop - start):
+                if not nulls[i]:
+                    item = data[offsets[i]:offsets[i + 1]].tobytes()
+                    values[i] = item.decode('utf-8') if kind == 'text' else bytearray(item)
+            return values
+        if len(nulls) > 0 and nulls.all():
+            return np.full(len(nulls), None, dtype=object)
+        if kind == 'float':
+            return np.array(self._map(index, 'data', np.float64)[start:stop])
+        values = np.array(self._map(index, 'data', np.int64)[start:stop])
+        if kind == 'date':
+            values = values.view('datetime64[us]')
+            values[nulls] = np.datetime64('NaT')
+            values = pd.Series(values).values
+        elif nulls.any():
+            values = values.astype(np.float64)
+            values[nulls] = np.nan
+        return values
+    #----------------------------------------------------------------------
+    def chunks(self, fields=None, chunk_size=None):
+        """
+        yields DataFrames of the stored rows, named like cursor_chunks
+        (the unique ID first, geometry tokens as SHAPE)
+        """
+        if chunk_size is None:
+            chunk_size = calc_chunk_size()
+        if fields is None:
+            fields = self.fields
+        fields = list(fields)
+        if self.unique is not None and self.unique not in fields:
+            fields = [self.unique] + fields
+        for start in range(0, len(self), chunk_size):
+            stop = min(start + chunk_size, len(self))
+            yield pd.DataFrame(dict((_column_name(field), self.column(field, start, stop))
+                                    for field in fields),
+                               columns=[_column_name(field) for field in fields])
+    #----------------------------------------------------------------------
+    def is_current(self, fc, fields, unique=None, spatial_reference=None):
+        """True when the snapshot can stand in for reading fc"""
+        meta = self.meta
+        modified = modified_time(fc)
+        return meta['version'] == SNAPSHOT_VERSION and \
+               meta['source'] == os.path.abspath(str(fc)) and \
+               modified is not None and meta['modified'] == modified and \
+               meta['spatial_reference'] == _sr_string(spatial_reference) and \
+               meta['unique'] == unique and \
+               all(field in meta['fields'] for field in fields)
+#--------------------------------------------------------------------------
+def open_snapshot(fc, cache_dir, fields, unique=None, spatial_reference=None,
+                  chunk_size=None):
+    """
+    opens the cached snapshot of fc, building it when it is missing or out
+    of date. A rebuilt snapshot keeps the fields of the previous one.
+    """
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    path = snapshot_path(cache_dir, fc, spatial_reference)
+    fields = list(fields)
+    if os.path.isfile(os.path.join(path, "snapshot.json")):
+        snapshot = Snapshot(path)
+        if snapshot.is_current(fc, fields, unique, spatial_reference):
+            return snapshot
+        fields += [field for field in snapshot.fields
+                   if field not in fields and field != unique]
+        del snapshot
+    return build_snapshot(fc, path, fields, unique, spatial_reference, chunk_size)
+#--------------------------------------------------------------------------
+def snapshot_chunks(fc, fields, unique=None, cache_dir=None, chunk_size=None,
+                    spatial_reference=None):
+    """
+    reads fc in DataFrame chunks through the snapshot cache, or straight
+    from the geodatabase when cache_dir is None or fc has no modification
+    time to validate a snapshot with
+    """
+    if cache_dir is None or modified_time(fc) is None:
+        if chunk_size is None:
+            chunk_size = calc_chunk_size()
+        return _read_rows(fc, list(fields), unique, chunk_size, spatial_reference)
+    snapshot = open_snapshot(fc, cache_dir, fields, unique, spatial_reference,
+                             chunk_size)
+    return snapshot.chunks(fields, chunk_size)
@@ -25,9 +25,25 @@ import sys
 import datetime
 import pandas as pd
 import numpy as np
-import arcpy
-from arcpy import env
-from arcpy import da
+try:
+    import arcpy
+    from arcpy import env
+    from arcpy import da
+except ImportError:
+    # Without ArcGIS Only the io_backend Based Kernels Can Run
+    arcpy = env = da = None
+from grid_binning import RegularGrid, bin_geometries, bin_points, bin_tiles, \
+     add_counts
+from spatial_index import build_fc_index
+from ranking import rank_changes, parse_breaks, CHANGE_BREAKS
+from metadata_cache import describe, spatial_reference
+from snapshot_cache import snapshot_chunks
+from geometry_compare import pack_geometries
+from table_writer import frame_to_array
+from io_backend import get_backend, calc_chunk_size
+from process_pool import set_executable
+from measure import planar_measures
+from profiling import start_profile, finish_profile, profile_path, stage
 #--------------------------------------------------------------------------
 class FunctionError(Exception):
     """ raised when a function fails to run """
@@ -49,67 +65,26 @@ def trace():
     synerror = traceback.format_exc().splitlines()[-1]
     return line, __file__, synerror
 #--------------------------------------------------------------------------
-def calculate_frequency_ranking(array, methods=None):
+def calculate_frequency_ranking(array, methods=None, breaks=CHANGE_BREAKS):
     """
 
     Calculates rankings from a numpy array
     expects the columns: FREQUENCY, OLD_FREQUENCY, SCORE, and RANKING
     Input:
      array - numpy ndarray
+     methods - list of POINT, POLYLINE and/or POLYGON
+     breaks - score breakpoints of the rankings
     Output:
-     FGDB table path
+     tuple of (numpy structured array of the statistics and rankings,
+     list of its field names)
     """
     try:
         if methods is None:
             methods = ['POINT']
-        tcsv = os.path.join(env.scratchFolder, 'data.csv')
-        tcsv_fgdb = os.path.join(env.scratchGDB, 'data_stats')
         df = pd.DataFrame(array,
                           columns=array.dtype.names)
-        for m in methods:
-            if m == "POINT":
-                df.loc[df['OLD_FREQUENCY'] > 0, 'SCORE'] = df['FREQUENCY']/df['OLD_FREQUENCY']
-                df.loc[df['OLD_FREQUENCY'] == 0, 'SCORE'] = -1
-                df['DIFF'] = df['FREQUENCY'] - df['OLD_FREQUENCY']
-                df.loc[(df['SCORE'] >= 0) & (df['SCORE'] <= .5), 'RANKING'] = 1
-                df.loc[(df['SCORE'] > 0.5) & (df['SCORE'] <= .75), 'RANKING'] = 2
-                df.loc[(df['SCORE'] > 0.75) & (df['SCORE'] <= 1.25), 'RANKING'] = 3
-                df.loc[(df['SCORE'] > 1.25) & (df['SCORE'] <= 1.5), 'RANKING'] = 4
-                df.loc[df['SCORE' ] > 1.5, 'RANKING'] = 5
-                df.loc[(df['SCORE'] == -1) & (df['FREQUENCY'] > 0), 'RANKING'] = 5
-                df.loc[(df['SCORE'] == -1) & (df['FREQUENCY'] <= 0), 'RANKING'] = 1
-                df.loc[(df['DIFF'] < 0), 'RANKING'] = -1 * df['RANKING']
-            elif m == "POLYLINE":
-                df['RANKING_LENGTH'] = 0.0
-                df['SCORE_LENGTH'] = 0.0
-                df['DIFF_LENGTH'] = df['NEW_LENGTH'] - df['OLD_LENGTH']
-                df.loc[df['OLD_LENGTH'] > 0, 'SCORE_LENGTH'] = df['NEW_LENGTH']/df['OLD_LENGTH']
-                df.loc[df['OLD_LENGTH'] == 0, 'SCORE_LENGTH'] = -1
-                df.loc[(df['SCORE_LENGTH'] >= 0) & (df['SCORE_LENGTH'] <= .5), 'RANKING_LENGTH'] = 1
-                df.loc[(df['SCORE_LENGTH'] > 0.5) & (df['SCORE_LENGTH'] <= .75), 'RANKING_LENGTH'] = 2
-                df.loc[(df['SCORE_LENGTH'] > 0.75) & (df['SCORE_LENGTH'] <= 1.25), 'RANKING_LENGTH'] = 3
-                df.loc[(df['SCORE_LENGTH'] > 1.25) & (df['SCORE_LENGTH'] <= 1.5), 'RANKING_LENGTH'] = 4
-                df.loc[df['SCORE_LENGTH' ] > 1.5, 'RANKING_LENGTH'] = 5
-                df.loc[(df['SCORE_LENGTH'] == -1) & (df['NEW_LENGTH'] > 0), 'RANKING_LENGTH'] = 5
-                df.loc[(df['SCORE_LENGTH'] == -1) & (df['NEW_LENGTH'] <= 0), 'RANKING_LENGTH'] = 1
-                df.loc[(df['DIFF_LENGTH'] < 0), 'RANKING_LENGTH'] = -1 * df['RANKING_LENGTH']
-            elif m == "POLYGON":
-                df['RANKING_AREA'] = 0.0
-                df['SCORE_AREA'] = 0.0
-                df['DIFF_AREA'] = df['NEW_AREA'] - df['OLD_AREA']
-                df.loc[df['OLD_AREA'] > 0, 'SCORE_AREA'] = df['NEW_AREA']/df['OLD_AREA']
-                df.loc[df['OLD_AREA'] == 0, 'SCORE_AREA'] = -1
-                df.loc[(df['SCORE_AREA'] >= 0) & (df['SCORE_AREA'] <= .5), 'RANKING_AREA'] = 1
-                df.loc[(df['SCORE_AREA'] > 0.5) & (df['SCORE_AREA'] <= .75), 'RANKING_AREA'] = 2
-                df.loc[(df['SCORE_AREA'] > 0.75) & (df['SCORE_AREA'] <= 1.25), 'RANKING_AREA'] = 3
-                df.loc[(df['SCORE_AREA'] > 1.25) & (df['SCORE_AREA'] <= 1.5), 'RANKING_AREA'] = 4
-                df.loc[df['SCORE_AREA' ] > 1.5, 'RANKING_AREA'] = 5
-                df.loc[(df['SCORE_AREA'] == -1) & (df['NEW_AREA'] > 0), 'RANKING_AREA'] = 5
-                df.loc[(df['SCORE_AREA'] == -1) & (df['NEW_AREA'] <= 0), 'RANKING_AREA'] = 1
-                df.loc[(df['DIFF_AREA'] < 0), 'RANKING_AREA'] = -1 * df['RANKING_AREA']
-            del m
-        df.to_csv(tcsv, columns=df.columns.tolist(), index=False)
-        return arcpy.CopyRows_management(tcsv, tcsv_fgdb)[0], df.columns.tolist()
+        df = rank_changes(df, methods, breaks)
+        return frame_to_array(df), df.columns.tolist()
 
     except:
         line, filename, synerror = trace()
@@ -123,79 +98,260 @@ def calculate_frequency_ranking(array, methods=None):
                 }
                 )
 #--------------------------------------------------------------------------
-def data_comparison(in_grid,
-                    in_fcs,
-                    in_old_gdb,
-                    in_new_gdb,
-                    out_grid,
-                    geom_type="POINT",
-                    scratchGDB=env.scratchGDB):
+def read_regular_grid(in_grid):
     """
-    Generates rankings based on a given grid and data type
-
+    describes the grid polygons as a RegularGrid
+    Output:
+     RegularGrid or None when the cells are not equal, axis aligned
+     rectangles in a projected coordinate system
+    """
+    if spatial_reference(in_grid).type != "Projected":
+        return None
+    oids, values = [], []
+    for chunk in get_backend(in_grid).read_chunks(in_grid, ['OID@', 'SHAPE@WKB']):
+        oids.extend(chunk['OID@'].tolist())
+        values.extend(chunk['SHAPE'].tolist())
+        del chunk
+    packed = pack_geometries(values)
+    del values
+    if (packed.gtype == 0).any() or (np.diff(packed.part_offsets) != 1).any() or \
+       (np.diff(packed.coord_offsets) != 5).any():
+        return None
+    xy = packed.coords.reshape(-1, 5, 2)
+    xmin, ymin = xy[:, :, 0].min(axis=1), xy[:, :, 1].min(axis=1)
+    xmax, ymax = xy[:, :, 0].max(axis=1), xy[:, :, 1].max(axis=1)
+    extent_area = (xmax - xmin) * (ymax - ymin)
+    area, _ = planar_measures(packed)
+    if (np.abs(area - extent_area) > 1e-6 * extent_area).any():
+        return None
+    return RegularGrid.from_extents(oids, xmin, ymin, xmax, ymax)
+#--------------------------------------------------------------------------
+def _read_chunks(in_fcs, gdb, token, sr, chunk_size, cache_dir=None):
+    """
+    yields the geometries of every feature class in chunks, read from the
+    snapshot cache (as WKB) when cache_dir is set
+    """
+    for fc in in_fcs:
+        fc = os.path.join(gdb, fc)
+        if cache_dir is not None:
+            for chunk in snapshot_chunks(fc, ['SHAPE@WKB'], cache_dir=cache_dir,
+                                         chunk_size=chunk_size,
+                                         spatial_reference=sr):
+                yield chunk['SHAPE'].values
+                del chunk
+            continue
+        for chunk in get_backend(fc).read_chunks(fc, [token], chunk_size=chunk_size,
+                                                 spatial_reference=sr):
+            yield chunk['SHAPE'].values
+            del chunk
+        del fc
+#--------------------------------------------------------------------------
+def _xy_array(values, token):
+    """(n, 2) array of point coordinates read with SHAPE@XY or SHAPE@WKB"""
+    if token == 'SHAPE@XY':
+        return np.array([v for v in values if v is not None and v[0] is not None],
+                        dtype=np.float64).reshape(-1, 2)
+    return pack_geometries(values).coords
+#--------------------------------------------------------------------------
+def bin_feature_classes(grid, in_grid, in_fcs, gdb, geom_type, chunk_size=None,
+                        processes=None, cache_dir=None):
+    """
+    bins the features of every feature class into the grid cells
     Inputs:
-     in_grid: path to area of interests
-     in_fcs: list of feature class names
-     in_old_gdb: old FGDB path for comparison
-     in_new_gdb: new FGDB path for comparison
-     out_grid: path of the output GDB feature class
-     geom_type: string value of POINT, POLYLINE, or POLYGON
+     grid - RegularGrid of in_grid
+     in_grid - grid feature class, features are projected to its
+               spatial reference
+     in_fcs - list of feature class names
+     gdb - FGDB holding the feature classes
+     geom_type - string value of POINT, POLYLINE, or POLYGON
+     processes - when more than one, the grid is split into tiles that
+                 are binned in a process pool
+     cache_dir - optional snapshot cache folder the features are read from
+    Output:
+     dict of per cell arrays with FREQUENCY, LENGTH (kilometers) and
+     AREA (square kilometers)
     """
-    try:
-        merged_points_n = os.path.join("in_memory", "merged_pts_n")#scratchGDB
-        merged_points_o = os.path.join("in_memory", "merged_pts_o")#scratchGDB
-        temp_out_grid = os.path.join(scratchGDB, "grid")
-        old_stats = os.path.join(scratchGDB, "old_stats")
-        new_stats = os.path.join(scratchGDB, "new_stats")
-        # Copy Grid to Temp Folder
-        temp_out_grid = arcpy.CopyFeatures_management(in_grid, temp_out_grid)[0]
-        # Merge all fcs into one fc
+    if chunk_size is None:
+        chunk_size = calc_chunk_size()
+    sr = spatial_reference(in_grid)
+    if processes is not None and processes > 1:
+        set_executable()
+        totals = bin_tiles(grid,
+                           _read_chunks(in_fcs, gdb, 'SHAPE@WKB', sr, chunk_size,
+                                        cache_dir),
+                           geom_type,
+                           processes=processes)
+    else:
+        token = 'SHAPE@XY' if geom_type.lower() == "point" and cache_dir is None \
+                else 'SHAPE@WKB'
+        totals = {}
+        for values in _read_chunks(in_fcs, gdb, token, sr, chunk_size, cache_dir):
+            if token == 'SHAPE@XY':
+                xy = _xy_array(values, token)
+                counts = bin_points(grid, xy[:, 0], xy[:, 1])
+            else:
+                counts = bin_geometries(grid, values, geom_type)
+            totals = add_counts(totals, counts)
+            del values, counts
+    if 'FREQUENCY' not in totals:
+        totals['FREQUENCY'] = np.zeros(grid.ncells, dtype=np.int64)
+    km = sr.metersPerUnit / 1000.0
+    if 'LENGTH' in totals:
+        totals['LENGTH'] = totals['LENGTH'] * km
+    if 'AREA' in totals:
+        totals['AREA'] = totals['AREA'] * km * km
+    return totals
+#--------------------------------------------------------------------------
+def statistics_array(fids, new_counts, old_counts, geom_type):
+    """
+    builds the per cell statistics table from per cell arrays
+    Inputs:
+     fids - grid OID of every cell
+     new_counts, old_counts - dict of FREQUENCY, LENGTH and AREA arrays
+    Output:
+     tuple of (numpy array with the export fields, ranking methods).
+     Only cells holding new features are returned, as with the
+     Statistics table of the Intersect path.
+    """
+    keep = new_counts['FREQUENCY'] > 0
+    if geom_type.lower() == "point":
+        method = ['POINT']
+        fields = [('FREQUENCY', '<i4'), ('OLD_FREQUENCY', '<i4')]
+    elif geom_type.lower() == "polyline":
+        method = ['POINT', 'POLYLINE']
+        fields = [('FREQUENCY', '<i4'), ('OLD_FREQUENCY', '<i4'),
+                  ('OLD_LENGTH', np.float64), ('NEW_LENGTH', np.float64)]
+    else:
+        method = ['POINT', 'POLYLINE', 'POLYGON']
+        fields = [('FREQUENCY', '<i4'), ('OLD_FREQUENCY', '<i4'),
+                  ('OLD_LENGTH', np.float64), ('NEW_LENGTH', np.float64),
+                  ('OLD_AREA', np.float64), ('NEW_AREA', np.float64)]
+    array = np.zeros(int(keep.sum()),
+                     np.dtype([('FID_grid', '<i4')] + fields +
+                              [('SCORE', np.float64), ('RANKING', np.int64)]))
+    array['FID_grid'] = fids[keep]
+    for name, _ in fields:
+        if name.startswith('OLD_'):
+            source = old_counts[name[4:]]
+        elif name.startswith('NEW_'):
+            source = new_counts[name[4:]]
+        else:
+            source = new_counts[name]
+        array[name] = source[keep]
+    return array, method
+#--------------------------------------------------------------------------
+def binned_statistics(grid, in_grid, in_fcs, in_old_gdb, in_new_gdb, geom_type,
+                      processes=None, cache_dir=None):
+    """
+    builds the per cell statistics table with NumPy binning, the old
+    features are read through the snapshot cache when cache_dir is set
+    Output:
+     tuple of (numpy array with the export fields, ranking methods)
+    """
+    new_counts = bin_feature_classes(grid, in_grid, in_fcs, in_new_gdb, geom_type,
+                                     processes=processes)
+    old_counts = bin_feature_classes(grid, in_grid, in_fcs, in_old_gdb, geom_type,
+                                     processes=processes, cache_dir=cache_dir)
+    fids, new_counts = grid.table(new_counts)
+    _, old_counts = grid.table(old_counts)
+    return statistics_array(fids, new_counts, old_counts, geom_type)
+#--------------------------------------------------------------------------
+def count_points(index, in_grid, in_fcs, gdb, chunk_size=None, cache_dir=None):
+    """
+    counts the points of every feature class in each polygon of an
+    irregular grid using its spatial index
+    Output:
+     dict with FREQUENCY, one value per polygon of the index
+    """
+    if chunk_size is None:
+        chunk_size = calc_chunk_size()
+    sr = spatial_reference(in_grid)
+    frequency = np.zeros(len(index), dtype=np.int64)
+    token = 'SHAPE@XY' if cache_dir is None else 'SHAPE@WKB'
+    for values in _read_chunks(in_fcs, gdb, token, sr, chunk_size, cache_dir):
+        xy = _xy_array(values, token)
+        _, poly = index.query_points(xy[:, 0], xy[:, 1])
+        frequency += np.bincount(poly, minlength=len(index))
+        del values, xy, poly
+    return {'FREQUENCY': frequency}
+#--------------------------------------------------------------------------
+def indexed_statistics(in_grid, in_fcs, in_old_gdb, in_new_gdb, geom_type,
+                       cache_dir=None):
+    """
+    builds the per cell statistics table of point features for any grid
+    using a packed STR-tree over the grid polygons
+    Output:
+     tuple of (numpy array with the export fields, ranking methods)
+    """
+    index = build_fc_index(in_grid)
+    new_counts = count_points(index, in_grid, in_fcs, in_new_gdb)
+    old_counts = count_points(index, in_grid, in_fcs, in_old_gdb,
+                              cache_dir=cache_dir)
+    return statistics_array(index.ids, new_counts, old_counts, geom_type)
+#--------------------------------------------------------------------------
+def intersect_statistics(temp_out_grid, in_fcs, in_old_gdb, in_new_gdb,
+                         geom_type, scratchGDB):
+    """
+    builds the per cell statistics table with Intersect and Statistics,
+    used when the grid is not regular
+    Output:
+     tuple of (numpy array with the export fields, ranking methods)
+    """
+    merged_points_n = os.path.join("in_memory", "merged_pts_n")#scratchGDB
+    merged_points_o = os.path.join("in_memory", "merged_pts_o")#scratchGDB
+    old_stats = os.path.join(scratchGDB, "old_stats")
+    new_stats = os.path.join(scratchGDB, "new_stats")
+    # Merge all fcs into one fc
+    with stage("merge") as span:
         merged_points_n, total_n_count = merge_fcs(in_fcs,
                                                    merged_points_n,
                                                    gdb=in_new_gdb)
         merged_points_o, total_o_count = merge_fcs(in_fcs,
                                                    merged_points_o,
                                                    gdb=in_old_gdb)
-        # intersect the grid
+        span.rows = total_n_count + total_o_count
+    # intersect the grid
+    with stage("intersect", total_n_count + total_o_count):
         new_pts_int = arcpy.Intersect_analysis(in_features=[merged_points_n, temp_out_grid],
                                                out_feature_class=os.path.join(scratchGDB, "new_pts_int"),
                                                join_attributes="ONLY_FID")[0]
         old_pts_int = arcpy.Intersect_analysis(in_features=[merged_points_o, temp_out_grid],
                                                 out_feature_class=os.path.join(scratchGDB, "old_pts_int"),
                                                 join_attributes="ONLY_FID")[0]
-        if geom_type.lower() == "point":
-            stat_fields_new = "FID_grid COUNT"
-            stat_fields_old = "FID_grid COUNT"
-            method = ["POINT"]
-        elif geom_type.lower() in ("polyline", 'polygon'):
-            arcpy.AddField_management(old_pts_int, "OLD_LENGTH", "FLOAT")
+    if geom_type.lower() == "point":
+        stat_fields_new = "FID_grid COUNT"
+        stat_fields_old = "FID_grid COUNT"
+        method = ["POINT"]
+    elif geom_type.lower() in ("polyline", 'polygon'):
+        arcpy.AddField_management(old_pts_int, "OLD_LENGTH", "FLOAT")
+        arcpy.CalculateField_management(in_table=old_pts_int,
+                                        field="OLD_LENGTH", expression="!shape.length@kilometers!",
+                                        expression_type="PYTHON_9.3", code_block="")
+        arcpy.AddField_management(new_pts_int, "NEW_LENGTH", "FLOAT")
+        arcpy.CalculateField_management(in_table=new_pts_int,
+                                        field="NEW_LENGTH", expression="!shape.length@kilometers!",
+                                        expression_type="PYTHON_9.3", code_block="")
+        if geom_type.lower() == "polygon":
+            arcpy.AddField_management(old_pts_int, "OLD_AREA", "FLOAT")
+            #!shape.area@squarekilometers!
             arcpy.CalculateField_management(in_table=old_pts_int,
-                                            field="OLD_LENGTH", expression="!shape.length@kilometers!",
+                                            field="OLD_AREA", expression="!shape.area@squarekilometers!",
                                             expression_type="PYTHON_9.3", code_block="")
-            arcpy.AddField_management(new_pts_int, "NEW_LENGTH", "FLOAT")
+            arcpy.AddField_management(new_pts_int, "NEW_AREA", "FLOAT")
             arcpy.CalculateField_management(in_table=new_pts_int,
-                                            field="NEW_LENGTH", expression="!shape.length@kilometers!",
+                                            field="NEW_AREA", expression="!shape.area@squarekilometers!",
                                             expression_type="PYTHON_9.3", code_block="")
-            if geom_type.lower() == "polygon":
-                arcpy.AddField_management(old_pts_int, "OLD_AREA", "FLOAT")
-                #!shape.area@squarekilometers!
-                arcpy.CalculateField_management(in_table=old_pts_int,
-                                                field="OLD_AREA", expression="!shape.area@squarekilometers!",
-                                                expression_type="PYTHON_9.3", code_block="")
-                arcpy.AddField_management(new_pts_int, "NEW_AREA", "FLOAT")
-                arcpy.CalculateField_management(in_table=new_pts_int,
-                                                field="NEW_AREA", expression="!shape.area@squarekilometers!",
-                                                expression_type="PYTHON_9.3", code_block="")
-            if geom_type.lower() == "polygon":
-                stat_fields_new = "FID_grid COUNT;NEW_LENGTH SUM;NEW_AREA SUM"
-                stat_fields_old = "FID_grid COUNT;OLD_LENGTH SUM;OLD_AREA SUM"
-                method = ['POINT', 'POLYLINE', 'POLYGON']
-            else:
-                stat_fields_new = "FID_grid COUNT;NEW_LENGTH SUM"
-                stat_fields_old = "FID_grid COUNT;OLD_LENGTH SUM"
-                method = ['POINT', 'POLYLINE']
+        if geom_type.lower() == "polygon":
+            stat_fields_new = "FID_grid COUNT;NEW_LENGTH SUM;NEW_AREA SUM"
+            stat_fields_old = "FID_grid COUNT;OLD_LENGTH SUM;OLD_AREA SUM"
+            method = ['POINT', 'POLYLINE', 'POLYGON']
+        else:
+            stat_fields_new = "FID_grid COUNT;NEW_LENGTH SUM"
+            stat_fields_old = "FID_grid COUNT;OLD_LENGTH SUM"
+            method = ['POINT', 'POLYLINE']
 
-        # get the counts
+    # get the counts
+    with stage("statistics"):
         old_stats = arcpy.Statistics_analysis(in_table=old_pts_int,
                                               out_table=old_stats,
                                               statistics_fields=stat_fields_old,
@@ -204,38 +360,39 @@ def data_comparison(in_grid,
                                               out_table=new_stats,
                                               statistics_fields=stat_fields_new,
                                               case_field="FID_grid")[0]
-        # join the old stats to the new stats
-        if geom_type.lower() == "polygon":
-            arcpy.AlterField_management(new_stats, field="SUM_NEW_LENGTH",
-                                        new_field_name="NEW_LENGTH")
-            arcpy.AlterField_management(new_stats, field="SUM_NEW_AREA",
-                                        new_field_name="NEW_AREA")
-            out_fields = ['FID_grid', 'FREQUENCY', 'SUM_OLD_LENGTH', 'SUM_OLD_AREA']
-            ndt = np.dtype([('FID_grid', '<i4'), ('OLD_FREQUENCY', '<i4'),
-                            ('OLD_LENGTH', np.float64), ('OLD_AREA', np.float64)])
-            export_fields = ['FID_grid',
-                             'FREQUENCY','OLD_FREQUENCY',
-                             'OLD_LENGTH', 'NEW_LENGTH',
-                             'OLD_AREA', 'NEW_AREA',
-                             'SCORE','RANKING']
-        elif geom_type.lower() == "point":
-            out_fields = ['FID_grid', 'FREQUENCY']
-            ndt = np.dtype([('FID_grid', '<i4'), ('OLD_FREQUENCY', '<i4')])
-            export_fields = ['FID_grid', 'FREQUENCY','OLD_FREQUENCY', 'SCORE','RANKING']
-        elif geom_type.lower() == "polyline":
-            arcpy.AlterField_management(new_stats, field="SUM_NEW_LENGTH",
-                                        new_field_name="NEW_LENGTH")
-            out_fields = ['FID_grid', 'FREQUENCY', 'SUM_OLD_LENGTH']
-            ndt = np.dtype([('FID_grid', '<i4'), ('OLD_FREQUENCY', '<i4'),
-                            ('OLD_LENGTH', np.float64)])
-            export_fields = ['FID_grid',
-                             'FREQUENCY','OLD_FREQUENCY',
-                             'OLD_LENGTH', 'NEW_LENGTH',
-                             'SCORE','RANKING']
-        old_array = da.TableToNumPyArray(in_table=old_stats,
-                                         field_names=out_fields)
-        old_array.dtype = ndt
-        # Add SCORE and RANKING fields and remove unneeded fields
+    # join the old stats to the new stats
+    if geom_type.lower() == "polygon":
+        arcpy.AlterField_management(new_stats, field="SUM_NEW_LENGTH",
+                                    new_field_name="NEW_LENGTH")
+        arcpy.AlterField_management(new_stats, field="SUM_NEW_AREA",
+                                    new_field_name="NEW_AREA")
+        out_fields = ['FID_grid', 'FREQUENCY', 'SUM_OLD_LENGTH', 'SUM_OLD_AREA']
+        ndt = np.dtype([('FID_grid', '<i4'), ('OLD_FREQUENCY', '<i4'),
+                        ('OLD_LENGTH', np.float64), ('OLD_AREA', np.float64)])
+        export_fields = ['FID_grid',
+                         'FREQUENCY','OLD_FREQUENCY',
+                         'OLD_LENGTH', 'NEW_LENGTH',
+                         'OLD_AREA', 'NEW_AREA',
+                         'SCORE','RANKING']
+    elif geom_type.lower() == "point":
+        out_fields = ['FID_grid', 'FREQUENCY']
+        ndt = np.dtype([('FID_grid', '<i4'), ('OLD_FREQUENCY', '<i4')])
+        export_fields = ['FID_grid', 'FREQUENCY','OLD_FREQUENCY', 'SCORE','RANKING']
+    elif geom_type.lower() == "polyline":
+        arcpy.AlterField_management(new_stats, field="SUM_NEW_LENGTH",
+                                    new_field_name="NEW_LENGTH")
+        out_fields = ['FID_grid', 'FREQUENCY', 'SUM_OLD_LENGTH']
+        ndt = np.dtype([('FID_grid', '<i4'), ('OLD_FREQUENCY', '<i4'),
+                        ('OLD_LENGTH', np.float64)])
+        export_fields = ['FID_grid',
+                         'FREQUENCY','OLD_FREQUENCY',
+                         'OLD_LENGTH', 'NEW_LENGTH',
+                         'SCORE','RANKING']
+    old_array = da.TableToNumPyArray(in_table=old_stats,
+                                     field_names=out_fields)
+    old_array.dtype = ndt
+    # Add SCORE and RANKING fields and remove unneeded fields
+    with stage("ExtendTable", len(old_array)):
         da.ExtendTable(new_stats, "FID_grid",
                        old_array, "FID_grid", False)
         array = np.array([],
@@ -246,18 +403,81 @@ def data_comparison(in_grid,
                        arcpy.Describe(new_stats).OIDFieldName,
                        array,
                        "_id", False)
-        arcpy.DeleteField_management(new_stats, ['COUNT_FID_grid'])
-        array = da.TableToNumPyArray(in_table=new_stats,
-                                    field_names=export_fields,
-                                    null_value=0)
+    arcpy.DeleteField_management(new_stats, ['COUNT_FID_grid'])
+    array = da.TableToNumPyArray(in_table=new_stats,
+                                field_names=export_fields,
+                                null_value=0)
+    return array, method
+#--------------------------------------------------------------------------
+def data_comparison(in_grid,
+                    in_fcs,
+                    in_old_gdb,
+                    in_new_gdb,
+                    out_grid,
+                    geom_type="POINT",
+                    scratchGDB=None,
+                    engine="numpy",
+                    processes=None,
+                    breaks=CHANGE_BREAKS,
+                    cache_dir=None):
+    """
+    Generates rankings based on a given grid and data type
+
+    Inputs:
+     in_grid: path to area of interests
+     in_fcs: list of feature class names
+     in_old_gdb: old FGDB path for comparison
+     in_new_gdb: new FGDB path for comparison
+     out_grid: path of the output GDB feature class
+     geom_type: string value of POINT, POLYLINE, or POLYGON
+     engine: numpy bins the features directly into a regular grid and
+             assigns points to irregular grids with a spatial index,
+             intersect uses Intersect and Statistics. Lines and polygons
+             on irregular grids always use intersect.
+     processes: number of worker processes binning grid tiles in
+                parallel (numpy engine on a regular grid)
+     breaks: score breakpoints of the rankings
+     cache_dir: optional snapshot cache folder, the old features are read
+                from their cached snapshots (numpy engine)
+    """
+    try:
+        if scratchGDB is None:
+            scratchGDB = env.scratchGDB
+        temp_out_grid = os.path.join(scratchGDB, "grid")
+        # Copy Grid to Temp Folder
+        with stage("copy"):
+            temp_out_grid = arcpy.CopyFeatures_management(in_grid, temp_out_grid)[0]
+        grid = None
+        if engine.lower() == "numpy":
+            with stage("grid"):
+                grid = read_regular_grid(temp_out_grid)
+        if grid is not None:
+            with stage("binning"):
+                array, method = binned_statistics(grid, temp_out_grid, in_fcs,
+                                                  in_old_gdb, in_new_gdb,
+                                                  geom_type, processes, cache_dir)
+        elif engine.lower() == "numpy" and geom_type.lower() == "point":
+            arcpy.AddMessage("... Grid Is Not Regular, Using Spatial Index ...")
+            with stage("index"):
+                array, method = indexed_statistics(temp_out_grid, in_fcs,
+                                                   in_old_gdb, in_new_gdb,
+                                                   geom_type, cache_dir)
+        else:
+            if engine.lower() == "numpy":
+                arcpy.AddMessage("... Grid Is Not Regular, Using Intersect ...")
+            array, method = intersect_statistics(temp_out_grid, in_fcs,
+                                                 in_old_gdb, in_new_gdb,
+                                                 geom_type, scratchGDB)
         # Calculate the rankings
-        tcsv, column_list = calculate_frequency_ranking(array=array,
-                                                        methods=method)
-        array = da.TableToNumPyArray(tcsv, column_list)
-        da.ExtendTable(temp_out_grid,
-                       arcpy.Describe(temp_out_grid).OIDFieldName,
-                       array,
-                       "FID_grid")
+        with stage("ranking", len(array)):
+            array, column_list = calculate_frequency_ranking(array=array,
+                                                             methods=method,
+                                                             breaks=breaks)
+        with stage("ExtendTable", len(array)):
+            da.ExtendTable(temp_out_grid,
+                           arcpy.Describe(temp_out_grid).OIDFieldName,
+                           array,
+                           "FID_grid")
         # Clean up NULL values
         if geom_type.lower() == "point":
             sql = """RANKING IS NULL"""
@@ -289,7 +509,8 @@ def data_comparison(in_grid,
                 del row
         del urows
         # return the output grid
-        return arcpy.CopyFeatures_management(temp_out_grid, out_grid)[0]
+        with stage("export"):
+            return arcpy.CopyFeatures_management(temp_out_grid, out_grid)[0]
     except:
         line, filename, synerror = trace()
         raise FunctionError(
@@ -332,7 +553,7 @@ def gather_fcs(workspace, check=False, other=None):
 def merge_fcs(fcs, merged_fc, gdb):
     """combines like geometries into a feature class"""
 
-    desc = arcpy.Describe(os.path.join(gdb, fcs[0]))
+    desc = describe(os.path.join(gdb, fcs[0]))
     if arcpy.Exists(merged_fc):
         arcpy.Delete_management(merged_fc)
     ifc = arcpy.CreateFeatureclass_management(out_path=os.path.dirname(merged_fc),
@@ -353,6 +574,79 @@ def merge_fcs(fcs, merged_fc, gdb):
     del icur, desc
     return ifc, count
 #--------------------------------------------------------------------------
+def run_branch(task, scratchGDB=None):
+    """
+    runs the data comparison of one geometry type
+    Inputs:
+     task - tuple of (feature type, geometry type, grid, feature classes,
+            old FGDB, new FGDB, output grid, engine, tile processes,
+            ranking breakpoints, snapshot cache folder)
+     scratchGDB - scratch workspace for the intermediate data
+    Output:
+     tuple of (feature type, output grid, elapsed time)
+    """
+    feature_type, geom_type, grid_fc, fcs, old_gdb, new_gdb, out_grid, \
+        engine, processes, breaks, cache_dir = task
+    if scratchGDB is None:
+        scratchGDB = env.scratchGDB
+    start = datetime.datetime.now()
+    out_grid = data_comparison(in_grid=grid_fc,
+                               in_fcs=fcs,
+                               in_old_gdb=old_gdb,
+                               in_new_gdb=new_gdb,
+                               out_grid=out_grid,
+                               geom_type=geom_type,
+                               scratchGDB=scratchGDB,
+                               engine=engine,
+                               processes=processes,
+                               breaks=breaks,
+                               cache_dir=cache_dir)
+    return feature_type, out_grid, datetime.datetime.now() - start
+#--------------------------------------------------------------------------
+def _branch_worker(args):
+    """
+    process pool entry point. Every branch gets its own scratch FGDB and
+    writes its grid there, so no two processes share a workspace. Pool
+    workers cannot start pools of their own, so tiles are not split
+    across processes here.
+    """
+    task, scratch_folder = args
+    env.overwriteOutput = True
+    if not os.path.isdir(scratch_folder):
+        os.makedirs(scratch_folder)
+    scratchGDB = os.path.join(scratch_folder, "scratch.gdb")
+    if not arcpy.Exists(scratchGDB):
+        arcpy.CreateFileGDB_management(scratch_folder, "scratch.gdb")
+    env.scratchWorkspace = scratchGDB
+    out_grid = task[6]
+    task = task[:6] + (os.path.join(scratchGDB, os.path.basename(out_grid)),
+                       task[7], None, task[9], task[10])
+    return run_branch(task, scratchGDB)
+#--------------------------------------------------------------------------
+def run_parallel(tasks, processes=None):
+    """
+    runs the data comparison of every geometry type in a process pool
+    and copies each result grid into its output FGDB
+    Output:
+     dictionary of feature type: output grid
+    """
+    import multiprocessing
+    set_executable()
+    scratch_root = env.scratchFolder
+    args = [(task, os.path.join(scratch_root, "branch_%s" % task[0].lower()))
+            for task in tasks]
+    outputs = {}
+    pool = multiprocessing.Pool(processes=processes or max(len(tasks), 1))
+    try:
+        for feature_type, scratch_grid, elapsed in pool.imap_unordered(_branch_worker, args):
+            arcpy.AddMessage("... %s PROCESSING TIME: %s ..." % (feature_type, elapsed))
+            out_grid = [task[6] for task in tasks if task[0] == feature_type][0]
+            outputs[feature_type] = arcpy.CopyFeatures_management(scratch_grid, out_grid)[0]
+    finally:
+        pool.close()
+        pool.join()
+    return outputs
+#--------------------------------------------------------------------------
 def main(*argv):
     """ main driver of program """
     try:
@@ -360,51 +654,57 @@ def main(*argv):
         new_gdb = argv[1]#
         grid_fc = argv[2]#
         out_gdb = argv[3]#
+        # Optional Binning Engine (argv[4:7] Are the Output Parameters)
+        engine = argv[7] if len(argv) > 7 and argv[7] else "numpy"
+        # Optional Process Pool Mode, One Process per Geometry Type
+        parallel = len(argv) > 8 and str(argv[8]).lower() == "true"
+        # Optional Number of Processes Binning Grid Tiles
+        processes = int(argv[9]) if len(argv) > 9 and argv[9] else None
+        # Optional Ranking Breakpoints, e.g. 0.5;0.75;1.25;1.5
+        breaks = parse_breaks(argv[10] if len(argv) > 10 else None, CHANGE_BREAKS)
+        # Optional Snapshot Cache Folder for the Old Feature Classes
+        cache_dir = argv[11] if len(argv) > 11 and argv[11] else None
         #  Local Variable
         #
         scratchGDB = env.scratchGDB
         output_fc_pts = os.path.join(out_gdb,"grid_pts")
         output_fc_lns = os.path.join(out_gdb,"grid_lns")
         output_fc_ply = os.path.join(out_gdb,"grid_ply")
-        results = []
         #  Logic
         #
-        mt_now = datetime.datetime.now()
+        start_profile("spatial_grid_comparison",
+                      profile_path(out_gdb, "spatial_grid_comparison"))
         if arcpy.Exists(out_gdb) == False:
             arcpy.CreateFileGDB_management(out_folder_path=os.path.dirname(out_gdb),
                                           out_name=os.path.basename(out_gdb))
         compare_fcs = gather_fcs(workspace=new_gdb, check=True, other=old_gdb)
 
-        for feature_type in compare_fcs.keys():
-            if feature_type == "POINTS":
-
-                arcpy.AddMessage("... Processing Points ...")
-                output_fc_pts = data_comparison(in_grid=grid_fc,
-                                                in_fcs=compare_fcs[feature_type],
-                                                in_old_gdb=old_gdb,
-                                                in_new_gdb=new_gdb,
-                                                out_grid=output_fc_pts,
-                                                geom_type="POINT")
-                results.append(output_fc_pts)
-            elif feature_type == "POLYLINES":
-                arcpy.AddMessage("... Processing Polylines ...")
-                output_fc_lns = data_comparison(in_grid=grid_fc,
-                                                in_fcs=compare_fcs[feature_type],
-                                                in_old_gdb=old_gdb,
-                                                in_new_gdb=new_gdb,
-                                                out_grid=output_fc_lns,
-                                                geom_type="POLYLINE")
-                results.append(output_fc_lns)
-            elif feature_type == "POLYGONS":
-                arcpy.AddMessage("... Processing Polygons ...")
-                output_fc_ply = data_comparison(in_grid=grid_fc,
-                                                in_fcs=compare_fcs[feature_type],
-                                                in_old_gdb=old_gdb,
-                                                in_new_gdb=new_gdb,
-                                                out_grid=output_fc_ply,
-                                                geom_type="POLYGON")
-                results.append(output_fc_ply)
-        arcpy.AddMessage("... %s %s ..." % ("TOTAL PROCESSING TIME: ", datetime.datetime.now() - mt_now))
+        branches = {
+            "POINTS" : ("POINT", output_fc_pts),
+            "POLYLINES" : ("POLYLINE", output_fc_lns),
+            "POLYGONS" : ("POLYGON", output_fc_ply)
+        }
+        tasks = [(feature_type, branches[feature_type][0], grid_fc,
+                  compare_fcs[feature_type], old_gdb, new_gdb,
+                  branches[feature_type][1], engine, processes, breaks,
+                  cache_dir)
+                 for feature_type in compare_fcs.keys()]
+        if parallel:
+            arcpy.AddMessage("... Processing %s Geometry Types in Parallel ..." % len(tasks))
+            with stage("parallel"):
+                outputs = run_parallel(tasks)
+        else:
+            outputs = {}
+            for task in tasks:
+                arcpy.AddMessage("... Processing %s ..." % task[0].title())
+                with stage(task[0].lower()):
+                    feature_type, output, elapsed = run_branch(task)
+                arcpy.AddMessage("... %s PROCESSING TIME: %s ..." % (feature_type, elapsed))
+                outputs[feature_type] = output
+                del task
+        output_fc_pts = outputs.get("POINTS", output_fc_pts)
+        output_fc_lns = outputs.get("POLYLINES", output_fc_lns)
+        output_fc_ply = outputs.get("POLYGONS", output_fc_ply)
         arcpy.SetParameterAsText(4, output_fc_pts)
         arcpy.SetParameterAsText(5, output_fc_lns)
         arcpy.SetParameterAsText(6, output_fc_ply)
@@ -426,6 +726,8 @@ def main(*argv):
         arcpy.AddError("error on line: %s" % line)
         arcpy.AddError("error in file name: %s" % filename)
         arcpy.AddError("with error message: %s" % synerror)
+    finally:
+        finish_profile()
 #--------------------------------------------------------------------------
 if __name__ == "__main__":
     env.overwriteOutput = True
@@ -0,0 +1,513 @@
+"""-----------------------------------------------------------------------------
+Name: spatial_index.py
+Purpose: Assigns features to the polygons of an arbitrary (non-regular) grid
+        or area of interest layer in memory.
+Description: The grid polygons are bulk loaded into a packed STR-tree. The
+        tree is a set of flat arrays: the bounding boxes of every level
+        stored one after another and the item order of the leaves, so
+        the children of a node are found by position instead of pointers.
+        Queries are answered in batches by walking all of the query boxes
+        down the tree level by level. Candidates are confirmed with
+        vectorized point in polygon and segment crossing tests against the
+        packed polygon rings, following the rules of Intersect: points on
+        a shared edge count in every polygon there, lines and polygons
+        count only where they share a length or an area. The index can be
+        saved to and loaded from a .npz file.
+Requirements: Python 2.7.x/Python3.x, ArcGIS 10.4+/Pro 1.2+
+Copyright: Esri
+License:
+-----------------------------------------------------------------------------"""
+import os
+import math
+
+import numpy as np
+
+from geometry_compare import PackedGeometries, pack_geometries, \
+     packed_segments, geometry_bounds, WKB_POLYGON, WKB_MULTIPOLYGON, \
+     WKB_POINT, WKB_MULTIPOINT
+
+NODE_SIZE = 16
+EDGE_BATCH = 2000000
+INDEX_VERSION = 1
+# Relative Distance Treated as Zero When Points Meet Segments
+TOLERANCE = 1e-9
+# Relative Step Off a Shared Boundary to Find Which Side the Areas Lie On
+OFFSET = 1e-3
+#--------------------------------------------------------------------------
+def _expand(offsets, idx):
+    """
+    expands each index into the positions of its segment
+    Output:
+     tuple of (position in idx, element) arrays
+    """
+    counts = offsets[idx + 1] - offsets[idx]
+    total = int(counts.sum())
+    rep = np.repeat(np.arange(len(idx), dtype=np.int64), counts)
+    within = np.arange(total, dtype=np.int64) - np.repeat(np.cumsum(counts) - counts, counts)
+    return rep, np.repeat(offsets[idx], counts) + within
+#--------------------------------------------------------------------------
+def _batches(counts, limit):
+    """
+    splits rows into (start, stop) ranges whose counts add up to about
+    limit, every range holds at least one row
+    """
+    csum = np.cumsum(counts)
+    start = 0
+    while start < len(counts):
+        base = csum[start - 1] if start > 0 else 0
+        stop = max(int(np.searchsorted(csum, base + limit, side='right')),
+                   start + 1)
+        yield start, stop
+        start = stop
+#--------------------------------------------------------------------------
+class PackedRTree(object):
+    """
+    static, bulk loaded R-tree using the Sort-Tile-Recursive packing
+    Attributes:
+     boxes - float64 array (M, 4) of node boxes, the leaves come first
+             followed by each level up to the root level
+     level_offsets - int array, slice of boxes for every level
+     order - int array, item index of every leaf
+     node_size - maximum number of children per node
+    """
+    def __init__(self, boxes, level_offsets, order, node_size=NODE_SIZE):
+        self.boxes = boxes
+        self.level_offsets = level_offsets
+        self.order = order
+        self.node_size = int(node_size)
+    #----------------------------------------------------------------------
+    def __len__(self):
+        return len(self.order)
+    #----------------------------------------------------------------------
+    @classmethod
+    def build(cls, boxes, node_size=NODE_SIZE):
+        """
+        bulk loads the tree
+        Inputs:
+         boxes - float64 array (n, 4) of xmin, ymin, xmax, ymax per item
+         node_size - maximum number of children per node
+        """
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        n = len(boxes)
+        # Sort by X, Cut Into Vertical Slices, Then Sort Each Slice by Y
+        cx = (boxes[:, 0] + boxes[:, 2]) / 2.0
+        cy = (boxes[:, 1] + boxes[:, 3]) / 2.0
+        cx[~np.isfinite(cx)] = np.inf
+        cy[~np.isfinite(cy)] = np.inf
+        nslices = max(int(math.ceil(math.sqrt(math.ceil(n / float(node_size))))), 1)
+        slice_len = nslices * node_size
+        by_x = np.argsort(cx, kind='mergesort')
+        slices = np.arange(n) // slice_len
+        order = by_x[np.lexsort((cy[by_x], slices))]
+        levels = [boxes[order]]
+        while len(levels[-1]) > node_size:
+            child = levels[-1]
+            starts = np.arange(0, len(child), node_size)
+            parent = np.empty((len(starts), 4), dtype=np.float64)
+            parent[:, 0] = np.minimum.reduceat(child[:, 0], starts)
+            parent[:, 1] = np.minimum.reduceat(child[:, 1], starts)
+            parent[:, 2] = np.maximum.reduceat(child[:, 2], starts)
+            parent[:, 3] = np.maximum.reduceat(child[:, 3], starts)
+            levels.append(parent)
+        level_offsets = np.concatenate([[0], np.cumsum([len(level) for level in levels])])
+        return cls(np.concatenate(levels), level_offsets.astype(np.int64),
+                   order.astype(np.int64), node_size)
+    #----------------------------------------------------------------------
+    def query_boxes(self, xmin, ymin, xmax, ymax):
+        """
+        finds the items whose box intersects each query box
+        Inputs:
+         xmin, ymin, xmax, ymax - arrays with one value per query
+        Output:
+         tuple of (query index, item index) arrays, one row per hit
+        """
+        xmin = np.asarray(xmin, dtype=np.float64)
+        ymin = np.asarray(ymin, dtype=np.float64)
+        xmax = np.asarray(xmax, dtype=np.float64)
+        ymax = np.asarray(ymax, dtype=np.float64)
+        nlevels = len(self.level_offsets) - 1
+        if len(self) == 0 or len(xmin) == 0:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty
+        level = nlevels - 1
+        ntop = self.level_offsets[level + 1] - self.level_offsets[level]
+        query = np.repeat(np.arange(len(xmin), dtype=np.int64), ntop)
+        node = np.tile(np.arange(ntop, dtype=np.int64), len(xmin))
+        while True:
+            box = self.boxes[self.level_offsets[level] + node]
+            hit = (box[:, 0] <= xmax[query]) & (box[:, 2] >= xmin[query]) & \
+                  (box[:, 1] <= ymax[query]) & (box[:, 3] >= ymin[query])
+            query = query[hit]
+            node = node[hit]
+            del box, hit
+            if level == 0:
+                return query, self.order[node]
+            # Children of a Node Are Stored Next to Each Other One Level Down
+            nchild = self.level_offsets[level] - self.level_offsets[level - 1]
+            first = node * self.node_size
+            counts = np.minimum(self.node_size, nchild - first)
+            within = np.arange(int(counts.sum()), dtype=np.int64) - \
+                     np.repeat(np.cumsum(counts) - counts, counts)
+            query = np.repeat(query, counts)
+            node = np.repeat(first, counts) + within
+            level -= 1
+#--------------------------------------------------------------------------
+def _segment_arrays(packed):
+    """
+    segments of packed geometries with the slice of segments per geometry
+    Output:
+     tuple of ((x0, y0, x1, y1) arrays, offsets array of length n + 1)
+    """
+    feature, x0, y0, x1, y1 = packed_segments(packed)
+    counts = np.bincount(feature, minlength=len(packed))
+    offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+    return (x0, y0, x1, y1), offsets
+#--------------------------------------------------------------------------
+def _contains(px, py, segments, offsets, owner):
+    """
+    even-odd point in polygon test of each point against the rings of
+    its owner
+    Inputs:
+     px, py - point coordinates
+     segments - (x0, y0, x1, y1) ring segment arrays
+     offsets - slice of segments per polygon
+     owner - polygon index for every point
+    Output:
+     boolean array, True when the point is inside
+    """
+    x0, y0, x1, y1 = segments
+    result = np.zeros(len(px), dtype=bool)
+    counts = offsets[owner + 1] - offsets[owner]
+    for start, stop in _batches(counts, EDGE_BATCH):
+        rep, edge = _expand(offsets, owner[start:stop])
+        qx = px[start:stop][rep]
+        qy = py[start:stop][rep]
+        ey0 = y0[edge]
+        ey1 = y1[edge]
+        straddle = (ey0 > qy) != (ey1 > qy)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            xcross = x0[edge] + (qy - ey0) * (x1[edge] - x0[edge]) / (ey1 - ey0)
+        crossing = straddle & (qx < xcross)
+        result[start:stop] = np.bincount(rep[crossing],
+                                         minlength=stop - start) % 2 == 1
+        del rep, edge, qx, qy, ey0, ey1, straddle, xcross, crossing
+    return result
+#--------------------------------------------------------------------------
+def _on_boundary(px, py, segments, offsets, owner):
+    """
+    checks if each point lies on a ring of its owner, within TOLERANCE
+    times the length of the ring segment
+    Output:
+     boolean array, True when the point is on the boundary
+    """
+    x0, y0, x1, y1 = segments
+    result = np.zeros(len(px), dtype=bool)
+    counts = offsets[owner + 1] - offsets[owner]
+    for start, stop in _batches(counts, EDGE_BATCH):
+        rep, edge = _expand(offsets, owner[start:stop])
+        qx = px[start:stop][rep] - x0[edge]
+        qy = py[start:stop][rep] - y0[edge]
+        dx = x1[edge] - x0[edge]
+        dy = y1[edge] - y0[edge]
+        length = dx * dx + dy * dy
+        slack = TOLERANCE * length
+        dot = dx * qx + dy * qy
+        on = (length > 0) & (np.abs(dx * qy - dy * qx) <= slack) & \
+             (dot >= -slack) & (dot <= length + slack)
+        result[start + np.unique(rep[on])] = True
+        del rep, edge, qx, qy, dx, dy, length, slack, dot, on
+    return result
+#--------------------------------------------------------------------------
+def _pieces(seg_a, off_a, idx_a, seg_b, off_b, idx_b, boxes_b):
+    """
+    cuts the segments of geometry idx_a where they meet the segments of
+    geometry idx_b, pair by pair. Every piece lies entirely inside,
+    outside or on the boundary of idx_b, so its midpoint tells which.
+    Pieces outside the box of idx_b are left out.
+    Output:
+     tuple of (pair index, x, y, hx, hy) arrays, one row per piece, with
+     the midpoint and the vector from the midpoint to the piece end
+    """
+    ax0, ay0, ax1, ay1 = seg_a
+    bx0, by0, bx1, by1 = seg_b
+    parts = []
+    counts = (off_a[idx_a + 1] - off_a[idx_a]) * (off_b[idx_b + 1] - off_b[idx_b])
+    for start, stop in _batches(counts, EDGE_BATCH):
+        # Only Segments of A Near the Box of B Can Meet It
+        rep, ea = _expand(off_a, idx_a[start:stop])
+        gb = idx_b[start:stop][rep]
+        box = boxes_b[gb]
+        near = (np.minimum(ax0[ea], ax1[ea]) <= box[:, 2]) & \
+               (np.maximum(ax0[ea], ax1[ea]) >= box[:, 0]) & \
+               (np.minimum(ay0[ea], ay1[ea]) <= box[:, 3]) & \
+               (np.maximum(ay0[ea], ay1[ea]) >= box[:, 1])
+        rep, ea, gb = rep[near], ea[near], gb[near]
+        del box, near
+        px, py = ax0[ea], ay0[ea]
+        dx, dy = ax1[ea] - px, ay1[ea] - py
+        length = dx * dx + dy * dy
+        # Parameter Along Segment A of Every Point Where Segment B Meets It
+        row, eb = _expand(off_b, gb)
+        ux, uy = dx[row], dy[row]
+        rx, ry = bx0[eb] - px[row], by0[eb] - py[row]
+        sx, sy = bx1[eb] - bx0[eb], by1[eb] - by0[eb]
+        denom = ux * sy - uy * sx
+        parallel = np.abs(denom) <= TOLERANCE * np.sqrt(length[row] * (sx * sx + sy * sy))
+        collinear = parallel & (np.abs(rx * uy - ry * ux) <= TOLERANCE * length[row])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = (rx * sy - ry * sx) / denom
+            u = (rx * uy - ry * ux) / denom
+            # Collinear Segments Are Cut Where the Other One Ends
+            t_start = (rx * ux + ry * uy) / length[row]
+            t_end = ((rx + sx) * ux + (ry + sy) * uy) / length[row]
+        crossing = ~parallel & (u >= -TOLERANCE) & (u <= 1 + TOLERANCE)
+        ends = np.arange(len(ea), dtype=np.int64)
+        row = np.concatenate([row[crossing], row[collinear], row[collinear], ends, ends])
+        t = np.concatenate([t[crossing], t_start[collinear], t_end[collinear],
+                            np.zeros(len(ea)), np.ones(len(ea))])
+        del eb, ux, uy, rx, ry, sx, sy, denom, parallel, collinear, u, \
+            t_start, t_end, crossing, ends
+        keep = (t >= 0) & (t <= 1)
+        row, t = row[keep], t[keep]
+        order = np.lexsort((t, row))
+        row, t = row[order], t[order]
+        piece = (row[1:] == row[:-1]) & (t[1:] - t[:-1] > TOLERANCE)
+        t0, t1, row = t[:-1][piece], t[1:][piece], row[:-1][piece]
+        piece = length[row] > 0
+        t0, t1, row = t0[piece], t1[piece], row[piece]
+        mid = (t0 + t1) / 2.0
+        half = (t1 - t0) / 2.0
+        parts.append((start + rep[row],
+                      px[row] + mid * dx[row], py[row] + mid * dy[row],
+                      half * dx[row], half * dy[row]))
+        del rep, ea, gb, px, py, dx, dy, length, keep, order, piece, t, t0, t1, \
+            row, mid, half
+    if len(parts) == 0:
+        empty = np.zeros(0, dtype=np.float64)
+        return (np.zeros(0, dtype=np.int64), empty, empty, empty, empty)
+    return tuple(np.concatenate(arrays) for arrays in zip(*parts))
+#--------------------------------------------------------------------------
+def _shares(feature, poly, geometries, boxes, polygons, poly_boxes, area):
+    """
+    checks pair by pair if the feature shares more than isolated points
+    with the polygon: a length for lines, an area for polygons (area True)
+    Inputs:
+     feature, poly - index arrays of the pairs
+     geometries, polygons - (segments, offsets) of the features and polygons
+     boxes, poly_boxes - bounding boxes of the features and polygons
+    Output:
+     boolean array with one value per pair
+    """
+    segments, offsets = geometries
+    poly_segments, poly_offsets = polygons
+    result = np.zeros(len(feature), dtype=bool)
+    pair, x, y, hx, hy = _pieces(segments, offsets, feature, poly_segments,
+                                 poly_offsets, poly, poly_boxes)
+    owner = poly[pair]
+    edge = _on_boundary(x, y, poly_segments, poly_offsets, owner)
+    inside = _contains(x, y, poly_segments, poly_offsets, owner)
+    if not area:
+        result[np.unique(pair[edge | inside])] = True
+        return result
+    result[np.unique(pair[inside & ~edge])] = True
+    # A Piece of the Polygon Ring Inside the Feature Polygon
+    check = np.nonzero(~result)[0]
+    if len(check) > 0:
+        part, x2, y2, _, _ = _pieces(poly_segments, poly_offsets, poly[check],
+                                     segments, offsets, feature[check], boxes)
+        owner = feature[check][part]
+        inside = _contains(x2, y2, segments, offsets, owner) & \
+                 ~_on_boundary(x2, y2, segments, offsets, owner)
+        result[check[np.unique(part[inside])]] = True
+    # Shared Boundary Pieces: Both Interiors on the Same Side of the Piece
+    shared = np.nonzero(edge & ~result[pair])[0]
+    for side in (1.0, -1.0):
+        if len(shared) == 0:
+            break
+        ox = x[shared] - side * OFFSET * hy[shared]
+        oy = y[shared] + side * OFFSET * hx[shared]
+        both = _contains(ox, oy, segments, offsets, feature[pair[shared]]) & \
+               _contains(ox, oy, poly_segments, poly_offsets, poly[pair[shared]])
+        result[np.unique(pair[shared][both])] = True
+        shared = shared[~result[pair[shared]]]
+    return result
+#--------------------------------------------------------------------------
+class PolygonIndex(object):
+    """
+    polygons of a grid or area of interest layer with a packed STR-tree
+    over their bounding boxes
+    Attributes:
+     ids - array of the polygon IDs (usually the grid OIDs)
+     polygons - geometry_compare.PackedGeometries of the polygons
+     tree - PackedRTree over the polygon bounding boxes
+    """
+    def __init__(self, ids, polygons, tree=None, node_size=NODE_SIZE):
+        self.ids = np.asarray(ids)
+        self.polygons = polygons
+        self.bounds = geometry_bounds(polygons)
+        if tree is None:
+            tree = PackedRTree.build(self.bounds, node_size)
+        self.tree = tree
+        self.segments, self.seg_offsets = _segment_arrays(polygons)
+    #----------------------------------------------------------------------
+    def __len__(self):
+        return len(self.ids)
+    #----------------------------------------------------------------------
+    @classmethod
+    def from_geometries(cls, ids, values, node_size=NODE_SIZE):
+        """builds the index from WKB or Esri JSON polygons"""
+        return cls(ids, pack_geometries(values), node_size=node_size)
+    #----------------------------------------------------------------------
+    def query_points(self, x, y):
+        """
+        finds the polygons containing each point, as Intersect does a
+        point on a shared edge or corner belongs to every polygon there
+        Output:
+         tuple of (point index, polygon index) arrays, one row per hit
+        """
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        point, poly = self.tree.query_boxes(x, y, x, y)
+        inside = _contains(x[point], y[point], self.segments,
+                           self.seg_offsets, poly)
+        check = np.nonzero(~inside)[0]
+        if len(check) > 0:
+            inside[check] = _on_boundary(x[point[check]], y[point[check]],
+                                         self.segments, self.seg_offsets,
+                                         poly[check])
+        return point[inside], poly[inside]
+    #----------------------------------------------------------------------
+    def locate_points(self, x, y):
+        """
+        polygon index of each point, -1 when no polygon holds it. Points
+        inside overlapping polygons get the first polygon.
+        """
+        point, poly = self.query_points(x, y)
+        located = np.full(len(np.asarray(x)), -1, dtype=np.int64)
+        located[point[::-1]] = poly[::-1]
+        return located
+    #----------------------------------------------------------------------
+    def query_boxes(self, xmin, ymin, xmax, ymax):
+        """
+        candidate polygons whose bounding box intersects each query box
+        Output:
+         tuple of (query index, polygon index) arrays
+        """
+        return self.tree.query_boxes(xmin, ymin, xmax, ymax)
+    #----------------------------------------------------------------------
+    def intersecting_pairs(self, values):
+        """
+        finds the polygons each feature intersects, keeping the pairs
+        Intersect would output: points inside or on the boundary, lines
+        sharing a length and polygons sharing an area with the polygon.
+        Features that only touch a polygon at isolated points, or
+        polygons that only share an edge, are not paired.
+        Inputs:
+         values - sequence of WKB or Esri JSON geometries, or
+                  PackedGeometries
+        Output:
+         tuple of (feature index, polygon index) arrays, one row per
+         intersecting pair
+        """
+        if isinstance(values, PackedGeometries):
+            packed = values
+        else:
+            packed = pack_geometries(values)
+        is_point = np.isin(packed.gtype, (WKB_POINT, WKB_MULTIPOINT))
+        nverts = np.diff(packed.coord_offsets)
+        # Points and Multipoints: Any Vertex Inside or on the Boundary
+        owner = np.repeat(np.arange(len(packed), dtype=np.int64), nverts)
+        vertex = np.nonzero(is_point[owner])[0]
+        point, poly = self.query_points(packed.coords[vertex, 0],
+                                        packed.coords[vertex, 1])
+        point_pairs = np.unique(np.stack([owner[vertex][point], poly]), axis=1)
+        del owner, vertex, point, poly
+        # Lines and Polygons: Box Candidates Confirmed Exactly
+        bounds = geometry_bounds(packed)
+        bounds[is_point] = [np.inf, np.inf, -np.inf, -np.inf]
+        feature, poly = self.tree.query_boxes(bounds[:, 0], bounds[:, 1],
+                                              bounds[:, 2], bounds[:, 3])
+        # A Vertex Strictly Inside Shares Its Neighbourhood With the Polygon
+        first = packed.coord_offsets[:-1][feature]
+        fx, fy = packed.coords[first, 0], packed.coords[first, 1]
+        hit = _contains(fx, fy, self.segments, self.seg_offsets, poly) & \
+              ~_on_boundary(fx, fy, self.segments, self.seg_offsets, poly)
+        del first, fx, fy
+        segments, seg_offsets = _segment_arrays(packed)
+        is_area = np.isin(packed.gtype, (WKB_POLYGON, WKB_MULTIPOLYGON))
+        check = np.nonzero(~hit & is_area[feature])[0]
+        if len(check) > 0:
+            # Grid Polygon Corner Strictly Inside a Feature Polygon
+            corner = self.polygons.coord_offsets[:-1][poly[check]]
+            cx = self.polygons.coords[corner, 0]
+            cy = self.polygons.coords[corner, 1]
+            hit[check] = _contains(cx, cy, segments, seg_offsets, feature[check]) & \
+                         ~_on_boundary(cx, cy, segments, seg_offsets, feature[check])
+        for area in (False, True):
+            check = np.nonzero(~hit & (is_area[feature] == area))[0]
+            if len(check) > 0:
+                hit[check] = _shares(feature[check], poly[check],
+                                     (segments, seg_offsets), bounds,
+                                     (self.segments, self.seg_offsets),
+                                     self.bounds, area)
+        return np.concatenate([point_pairs[0], feature[hit]]), \
+               np.concatenate([point_pairs[1], poly[hit]])
+    #----------------------------------------------------------------------
+    def save(self, path):
+        """writes the index to a .npz file"""
+        ids = self.ids
+        if ids.dtype.kind not in 'iuf':
+            ids = ids.astype(np.str_)
+        np.savez(path,
+                 ids=ids,
+                 gtype=self.polygons.gtype,
+                 part_sizes=self.polygons.part_sizes,
+                 part_offsets=self.polygons.part_offsets,
+                 coords=self.polygons.coords,
+                 coord_offsets=self.polygons.coord_offsets,
+                 boxes=self.tree.boxes,
+                 level_offsets=self.tree.level_offsets,
+                 order=self.tree.order,
+                 node_size=np.array(self.tree.node_size),
+                 version=np.array(INDEX_VERSION))
+        return path
+    #----------------------------------------------------------------------
+    @classmethod
+    def load(cls, path):
+        """
+        reads an index written by save
+        Output:
+         PolygonIndex or None if the file does not exist or is from
+         another version
+        """
+        if not os.path.isfile(path):
+            return None
+        data = np.load(path)
+        try:
+            if int(data['version']) != INDEX_VERSION:
+                return None
+            polygons = PackedGeometries(data['gtype'], data['part_sizes'],
+                                        data['part_offsets'], data['coords'],
+                                        data['coord_offsets'])
+            tree = PackedRTree(data['boxes'], data['level_offsets'],
+                               data['order'], int(data['node_size']))
+            return cls(data['ids'], polygons, tree)
+        finally:
+            data.close()
+#--------------------------------------------------------------------------
+def build_fc_index(fc, spatial_reference=None, node_size=NODE_SIZE):
+    """
+    builds a PolygonIndex from a polygon feature class keyed by OID
+    Inputs:
+     fc - polygon feature class
+     spatial_reference - optional spatial reference to project to
+    """
+    from io_backend import get_backend
+    ids, values = [], []
+    for chunk in get_backend(fc).read_chunks(fc, ['OID@', 'SHAPE@WKB'],
+                                             spatial_reference=spatial_reference):
+        ids.extend(chunk['OID@'].tolist())
+        values.extend(chunk['SHAPE'].tolist())
+        del chunk
+    return PolygonIndex.from_geometries(np.array(ids, dtype=np.int64), values,
+                                        node_size)
@@ -0,0 +1,192 @@
+"""-----------------------------------------------------------------------------
+Name: stream_compare.py
+Purpose: Compares two snapshots of a dataset without loading either one
+        completely into memory.
+Description: Both datasets are read in chunks ordered by the unique ID field
+        and merge-joined as they stream in. Additions, deletions and
+        attribute or geometry changes are yielded chunk by chunk so the peak
+        memory depends on the chunk size rather than the dataset size.
+Requirements: Python 2.7.x/Python3.x, ArcGIS 10.4+/Pro 1.2+
+Copyright: Esri
+License:
+-----------------------------------------------------------------------------"""
+import numpy as np
+import pandas as pd
+
+from diff_engine import compare_attributes, changed_features
+from geometry_compare import geometry_equal
+from io_backend import get_backend, calc_chunk_size
+
+#--------------------------------------------------------------------------
+def cursor_chunks(fc, fields, unique, chunk_size=None, where_clause=None):
+    """
+    reads a feature class in chunks sorted by the unique ID field
+    Inputs:
+     fc - feature class or table path. The workspace must support
+          ORDER BY (file or enterprise geodatabase, GeoPackage).
+     fields - cursor field names, geometry tokens such as SHAPE@WKB are
+              returned in a column named SHAPE
+     unique - unique ID field name
+     chunk_size - rows per chunk, defaults to calc_chunk_size()
+     where_clause - optional where clause
+    Output:
+     generator of pandas DataFrames
+    """
+    for chunk in get_backend(fc).read_chunks(fc, fields, unique, chunk_size,
+                                             where_clause=where_clause):
+        yield chunk
+#--------------------------------------------------------------------------
+def layer_chunks(feat_lyr, unique, chunk_size=None, where="1=1"):
+    """
+    pages through a FeatureLayer ordered by the unique ID field and
+    yields a SpatialDataFrame per page
+    """
+    if chunk_size is None:
+        chunk_size = min(calc_chunk_size(),
+                         feat_lyr.properties.get('maxRecordCount', 1000))
+    offset = 0
+    while True:
+        fset = feat_lyr.query(where=where,
+                              order_by_fields="%s ASC" % unique,
+                              result_offset=offset,
+                              result_record_count=chunk_size)
+        if len(fset.features) == 0:
+            return
+        yield fset.df
+        offset += len(fset.features)
+#--------------------------------------------------------------------------
+def _next_chunk(chunks, unique, state):
+    """pulls the next chunk and validates it continues the sort order"""
+    try:
+        chunk = next(chunks)
+    except StopIteration:
+        return None
+    ids = chunk[unique]
+    if not ids.is_monotonic_increasing or \
+       (state['last'] is not None and ids.iloc[0] < state['last']):
+        raise ValueError("Input Is Not Sorted By The Unique Field: %s" % unique)
+    state['last'] = ids.iloc[-1]
+    return chunk
+#--------------------------------------------------------------------------
+def merge_join(old_chunks, new_chunks, unique):
+    """
+    merge-joins two streams of DataFrames sorted by the unique ID field.
+    Rows with a duplicated unique ID are dropped, as in the in-memory
+    tools.
+    Output:
+     generator of (deletes, adds, old_matched, new_matched) DataFrames.
+     old_matched and new_matched hold the same IDs in the same order.
+    """
+    sides = []
+    for chunks in (old_chunks, new_chunks):
+        state = {'last': None}
+        it = iter(chunks)
+        sides.append({'it': it, 'state': state,
+                      'buf': _next_chunk(it, unique, state),
+                      'done': False})
+    columns = [unique]
+    for side in sides:
+        if side['buf'] is not None:
+            columns = side['buf'].columns
+    for side in sides:
+        side['done'] = side['buf'] is None
+        if side['buf'] is None:
+            side['buf'] = pd.DataFrame(columns=columns)
+    while len(sides[0]['buf']) > 0 or len(sides[1]['buf']) > 0:
+        # Rows Below the Smallest Unread Key Are Complete on Both Sides
+        bounds = [side['buf'][unique].iloc[-1] for side in sides
+                  if not side['done'] and len(side['buf']) > 0]
+        ready = []
+        for side in sides:
+            buf = side['buf']
+            if len(bounds) == 0:
+                mask = np.ones(len(buf), dtype=bool)
+            else:
+                mask = (buf[unique] < min(bounds)).values
+            part = buf[mask]
+            ready.append(part[~part[unique].duplicated(keep=False)])
+            side['buf'] = buf[~mask]
+        old_ready, new_ready = ready
+        in_new = old_ready[unique].isin(new_ready[unique]).values
+        in_old = new_ready[unique].isin(old_ready[unique]).values
+        yield old_ready[~in_new], new_ready[~in_old], \
+              old_ready[in_new], new_ready[in_old]
+        # Refill the Side(s) That Limited This Pass
+        for side in sides:
+            if side['done']:
+                continue
+            if len(bounds) == 0 or len(side['buf']) == 0 or \
+               side['buf'][unique].iloc[-1] == min(bounds):
+                chunk = _next_chunk(side['it'], unique, side['state'])
+                if chunk is None:
+                    side['done'] = True
+                else:
+                    side['buf'] = pd.concat([side['buf'], chunk])
+#--------------------------------------------------------------------------
+def stream_attribute_changes(old_chunks, new_chunks, unique, fields):
+    """
+    streams the attribute comparison
+    Output:
+     generator of (deletes, adds, change table, changed features)
+     where the change table and changed features match
+     diff_engine.compare_attributes and diff_engine.changed_features
+    """
+    for deletes, adds, old_m, new_m in merge_join(old_chunks, new_chunks, unique):
+        if len(old_m) > 0:
+            df_changes = compare_attributes(old_m, new_m, unique, fields)
+            changed = changed_features(new_m, unique, df_changes)
+        else:
+            df_changes = changed = None
+        yield deletes, adds, df_changes, changed
+#--------------------------------------------------------------------------
+def stream_geometry_status(old_chunks, new_chunks, unique, status_func=None,
+                           xy_tolerance=None):
+    """
+    streams the geometry comparison
+    Inputs:
+     status_func - callable taking the matched old and new DataFrames and
+                   returning a boolean array that is True where the
+                   geometry is unchanged. Defaults to a row by row
+                   comparison of the SHAPE column.
+     xy_tolerance - optional XY tolerance for the default comparison
+    Output:
+     generator of DataFrames with the unique ID, SHAPE and STATUS columns
+    """
+    for deletes, adds, old_m, new_m in merge_join(old_chunks, new_chunks, unique):
+        old_df = deletes[[unique, 'SHAPE']].copy()
+        old_df['STATUS'] = "REMOVED FEATURE"
+        new_df = adds[[unique, 'SHAPE']].copy()
+        new_df['STATUS'] = "NEW FEATURE"
+        merged = new_m[[unique, 'SHAPE']].copy()
+        if status_func is None:
+            same = geometry_equal(old_m['SHAPE'].values,
+                                  new_m['SHAPE'].values,
+                                  xy_tolerance)
+        else:
+            same = status_func(old_m, new_m)
+        merged['STATUS'] = np.where(same, 'GEOMETRY CONSISTENT', 'GEOMETRY MODIFIED')
+        yield pd.concat([merged, old_df, new_df], ignore_index=True)
+#--------------------------------------------------------------------------
+def create_output_fc(template, out_db, out_name, fields=None, add_fields=None):
+    """
+    creates an empty feature class to stream results into
+    Inputs:
+     template - feature class whose geometry type, spatial reference and
+                fields are copied
+     out_db - output workspace
+     out_name - output feature class name
+     fields - optional list of template field names to keep, all template
+              fields are kept when None
+     add_fields - optional list of (name, type) fields to add
+    Output:
+     path of the new feature class
+    """
+    return get_backend(out_db).create_output(template, out_db, out_name,
+                                             fields, add_fields)
+#--------------------------------------------------------------------------
+def insert_frame(out_fc, df, rename=None):
+    """
+    appends the rows of a DataFrame to a table or feature class. The
+    SHAPE column is written as WKB.
+    """
+    get_backend(out_fc).insert_frame(out_fc, df, rename)
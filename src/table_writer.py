@@ -0,0 +1,190 @@
+"""-----------------------------------------------------------------------------
+Name: table_writer.py
+Purpose: Writes result tables as NumPy structured arrays.
+Description: DataFrames are converted once into structured arrays with
+        geodatabase friendly types and handed straight to arcpy, instead of
+        being written to a CSV file and parsed back by CopyRows or
+        TableToNumPyArray. Paths ending in .npz are written as a binary
+        columnar file, one array per field, for sinks without ArcGIS.
+Requirements: Python 2.7.x/Python3.x, ArcGIS 10.4+/Pro 1.2+
+Copyright: Esri
+License:
+-----------------------------------------------------------------------------"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from io_backend import get_backend
+
+TEXT_WIDTH = 255
+#--------------------------------------------------------------------------
+def _column_array(values, text_width=None):
+    """converts a column into an array NumPyArrayToTable can write"""
+    series = pd.Series(values)
+    kind = series.dtype.kind
+    if kind == 'b':
+        return series.values.astype(np.int16)
+    if kind in 'iu':
+        values = series.values
+        if len(values) == 0 or \
+           (values.min() >= np.iinfo(np.int32).min and values.max() <= np.iinfo(np.int32).max):
+            return values.astype(np.int32)
+        return values.astype(np.float64)
+    if kind == 'f':
+        return series.values.astype(np.float64)
+    if kind == 'M':
+        return series.values.astype('datetime64[us]')
+    if pd.api.types.is_numeric_dtype(series.dtype):
+        # Nullable Integer and Float Extension Types
+        return series.astype(np.float64).values
+    # NULL Text Is Written as an Empty String
+    text = series.astype(object).where(pd.notnull(series), u"").astype(str).values
+    width = max([1] + [len(value) for value in text])
+    if text_width is not None:
+        width = text_width
+    return np.asarray(text, dtype='U%d' % width)
+#--------------------------------------------------------------------------
+def frame_to_array(df, columns=None, index=False, text_width=None):
+    """
+    converts a DataFrame into a NumPy structured array
+    Inputs:
+     df - pandas DataFrame
+     columns - columns to convert, defaults to all of them
+     index - True to write the index as the first field, named after
+             the index
+     text_width - fixed width of the text fields, defaults to the
+                  longest value
+    Output:
+     numpy structured array, integers as int32 (float64 when they do not
+     fit), booleans as int16, dates as datetime64[us] and everything else
+     as unicode text
+    """
+    if columns is None:
+        columns = df.columns.tolist()
+    names = []
+    arrays = []
+    if index:
+        names.append(str(df.index.name or 'index'))
+        arrays.append(_column_array(df.index.values, text_width))
+    for column in columns:
+        names.append(str(column))
+        arrays.append(_column_array(df[column].values, text_width))
+    array = np.empty(len(df), dtype=[(name, values.dtype)
+                                     for name, values in zip(names, arrays)])
+    for name, values in zip(names, arrays):
+        array[name] = values
+    return array
+#--------------------------------------------------------------------------
+def save_columns(path, array):
+    """writes a structured array to a .npz file, one array per field"""
+    np.savez(path, **dict((name, array[name]) for name in array.dtype.names))
+    return path
+#--------------------------------------------------------------------------
+def load_columns(path):
+    """reads a file written by save_columns back into a structured array"""
+    data = np.load(path)
+    try:
+        names = list(data.files)
+        columns = [data[name] for name in names]
+    finally:
+        data.close()
+    array = np.empty(len(columns[0]) if columns else 0,
+                     dtype=[(name, values.dtype) for name, values in zip(names, columns)])
+    for name, values in zip(names, columns):
+        array[name] = values
+    return array
+#--------------------------------------------------------------------------
+class ArrayWriter(object):
+    """
+    writes structured arrays to a table of any io_backend, or to a
+    columnar .npz file when the path ends in .npz
+    Usage:
+     with ArrayWriter(out_table) as writer:
+         for df in chunks:
+             writer.write(frame_to_array(df))
+    The first array creates the table, replacing an existing one unless
+    append is True. Later arrays are inserted into it; text longer than
+    the fields created by the first array is cut to the field width.
+    """
+    def __init__(self, path, append=False):
+        self.path = path
+        self.append = append
+        self.count = 0
+        self._dtype = None
+        self._columns = None
+    #----------------------------------------------------------------------
+    def __enter__(self):
+        return self
+    #----------------------------------------------------------------------
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+        return False
+    #----------------------------------------------------------------------
+    @property
+    def columnar(self):
+        return self.path.lower().endswith('.npz')
+    #----------------------------------------------------------------------
+    def write(self, array):
+        """writes the rows of a structured array"""
+        if len(array) == 0:
+            return self.count
+        if self.columnar:
+            self._write_columns(array)
+        elif self._dtype is None:
+            self._create(array)
+        else:
+            self._insert(array)
+        self.count += len(array)
+        return self.count
+    #----------------------------------------------------------------------
+    def _write_columns(self, array):
+        if self._columns is None:
+            self._columns = dict((name, []) for name in array.dtype.names)
+            if self.append and os.path.isfile(self.path):
+                previous = load_columns(self.path)
+                for name in array.dtype.names:
+                    self._columns[name].append(previous[name])
+        for name in array.dtype.names:
+            self._columns[name].append(array[name])
+    #----------------------------------------------------------------------
+    def _create(self, array):
+        get_backend(self.path).write_array(array, self.path, append=self.append)
+        self._dtype = array.dtype
+    #----------------------------------------------------------------------
+    def _insert(self, array):
+        names = [name for name in array.dtype.names if name in self._dtype.names]
+        fitted = np.empty(len(array), dtype=[(name, self._dtype[name]
+                                                if array.dtype[name].kind == 'U' and \
+                                                self._dtype[name].kind == 'U'
+                                                else array.dtype[name])
+                                               for name in names])
+        for name in names:
+            fitted[name] = array[name]
+        get_backend(self.path).write_array(fitted, self.path, append=True)
+    #----------------------------------------------------------------------
+    def close(self):
+        """finishes the output, the columnar file is written here"""
+        if self._columns is not None:
+            names = list(self._columns)
+            columns = [np.concatenate(self._columns[name]) for name in names]
+            array = np.empty(len(columns[0]),
+                             dtype=[(name, values.dtype)
+                                    for name, values in zip(names, columns)])
+            for name, values in zip(names, columns):
+                array[name] = values
+            save_columns(self.path, array)
+            self._columns = None
+        return self.path
+#--------------------------------------------------------------------------
+def write_frame(df, path, columns=None, index=False, append=False, text_width=None):
+    """
+    writes a DataFrame to a geodatabase table or .npz file in one call
+    Output:
+     path, or None when df is empty
+    """
+    if len(df) == 0:
+        return None
+    with ArrayWriter(path, append=append) as writer:
+        writer.write(frame_to_array(df, columns, index, text_width))
+    return path
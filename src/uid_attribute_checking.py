@@ -17,10 +17,30 @@ License:
 -----------------------------------------------------------------------------"""
 import pandas as pd
 import numpy as np
-import arcgis
-import arcpy
+try:
+    import arcgis
+except ImportError:
+    arcgis = None
+try:
+    import arcpy
+except ImportError:
+    # Without ArcGIS Only the io_backend Based Comparisons Can Run
+    arcpy = None
 import sys
 import os
+from diff_engine import compare_attributes, changed_features, stable_digests, \
+     drop_duplicate_ids, duplicate_table
+from incremental_state import state_path, save_state, load_state, \
+     watermark_clause, in_clauses, max_watermark
+from metadata_cache import describe, list_fields, field_names, modified_time
+from snapshot_cache import snapshot_chunks
+from stream_compare import cursor_chunks, stream_attribute_changes, \
+     create_output_fc, insert_frame
+from table_writer import ArrayWriter, frame_to_array, write_frame, TEXT_WIDTH, \
+     save_columns, load_columns
+from io_backend import get_backend, add_message
+from profiling import start_profile, finish_profile, profile_path, stage, \
+     timed_chunks
 #--------------------------------------------------------------------------
 class FunctionError(Exception):
     """ raised when a function fails to run """
@@ -58,10 +78,10 @@ def build_information_table(db, new, old):
     arcpy.da.ExtendTable(tbl, arcpy.Describe(tbl).OIDFieldName, array, "_id")
     del array
 
-    desc_old = arcpy.Describe(old)
-    desc_new = arcpy.Describe(new)
-    fields_old = set([field.name for field in arcpy.ListFields(old)])
-    fields_new = set([field.name for field in arcpy.ListFields(new)])
+    desc_old = describe(old)
+    desc_new = describe(new)
+    fields_old = set([field.name for field in list_fields(old)])
+    fields_new = set([field.name for field in list_fields(new)])
 
     # Handle Field Concatenation (Except Used for Edge Cases)
     try:
@@ -97,20 +117,243 @@ def build_information_table(db, new, old):
         del cursor, row
 #--------------------------------------------------------------------------
 def handle_duplicates(sdf_set, unique, t_flag):
-
-    len_sfd = len(sdf_set[0])
-    sdf = sdf_set[0].drop_duplicates(subset=unique, keep=False)
-    len_sfd_after = len(sdf)
-
-    if len_sfd - len_sfd_after != 0:
-        arcpy.AddMessage(len_sfd)
-        arcpy.AddMessage(len_sfd_after)
-        arcpy.AddMessage("Dropping Dublicates from Old Feature Classs")
+    """
+    drops the rows of sdf_set[0] whose unique ID is duplicated, in place,
+    and returns the distinct duplicated IDs
+    """
+    dups = drop_duplicate_ids(sdf_set[0], unique)
+    if len(dups) > 0:
+        arcpy.AddMessage("Dropping %s Duplicated IDs Based on Unique Field: %s" % (len(dups), unique))
 
     if t_flag != 'sdf':
-        if arcpy.Describe(sdf_set[1]).oidFieldName in sdf.columns:
+        oid_field = describe(sdf_set[1]).oidFieldName
+        if oid_field in sdf_set[0].columns:
             arcpy.AddMessage("deleting oid field")
-            sdf_set[0].drop(arcpy.Describe(sdf_set[1]).oidFieldName, axis=1, inplace=True)
+            sdf_set[0].drop(oid_field, axis=1, inplace=True)
+    return dups
+#--------------------------------------------------------------------------
+def write_duplicates(out_table, duplicates, unique):
+    """
+    writes the dropped duplicate IDs, with the dataset they came from,
+    to out_table. Nothing is written when there are no duplicates.
+    """
+    df = duplicate_table(duplicates, unique)
+    if len(df) == 0:
+        return None
+    ids = df[unique].values
+    if ids.dtype.kind not in 'iuf':
+        ids = ids.astype(np.str_)
+    array = np.empty(len(df), dtype=[('Dataset', 'U%d' % max(1, df['Dataset'].str.len().max())),
+                                     (str(unique), ids.dtype)])
+    array['Dataset'] = df['Dataset'].values.astype(np.str_)
+    array[str(unique)] = ids
+    get_backend(out_table).write_array(array, out_table)
+    return out_table
+#--------------------------------------------------------------------------
+def stream_comparison(in_old, in_new, unique, out_db, change_table, chunk_size=None,
+                      cache_dir=None):
+    """
+    compares the feature classes in unique ID sorted chunks and writes
+    the added, deleted and changed features as each chunk is processed,
+    so neither dataset is ever fully loaded into memory. When cache_dir
+    is set the old feature class is read from its snapshot cache.
+    Output:
+     True if any attribute changes were written to change_table
+    """
+    fields_old = field_names(in_old, editable_only=True)
+    fields = [name for name in field_names(in_new, editable_only=True)
+              if name in fields_old]
+    cursor_fields = fields + ['SHAPE@WKB']
+    old_chunks = timed_chunks("load", snapshot_chunks(in_old, cursor_fields, unique,
+                                                      cache_dir, chunk_size))
+    new_chunks = timed_chunks("load", cursor_chunks(in_new, cursor_fields, unique,
+                                                    chunk_size))
+
+    outputs = {}
+    writer = ArrayWriter(change_table)
+    changes = stream_attribute_changes(old_chunks, new_chunks, unique, fields)
+    for deletes, adds, df_changes, changed in timed_chunks("compare", changes,
+                                                           rows=None):
+        with stage("export"):
+            for name, template, df in [("deleted_features", in_old, deletes),
+                                       ("added_features", in_new, adds)]:
+                if len(df) > 0:
+                    if name not in outputs:
+                        outputs[name] = create_output_fc(template, out_db, name)
+                    insert_frame(outputs[name], df)
+            if df_changes is not None and len(df_changes) > 0:
+                if "changed_features" not in outputs:
+                    outputs["changed_features"] = create_output_fc(in_new, out_db,
+                                                                   "changed_features",
+                                                                   add_fields=[('Edit_Count', 'LONG')])
+                insert_frame(outputs["changed_features"], changed,
+                             rename={'Edit Count': 'Edit_Count'})
+                writer.write(frame_to_array(df_changes, index=True, text_width=TEXT_WIDTH))
+        del deletes, adds, df_changes, changed
+    writer.close()
+    return writer.count > 0
+#--------------------------------------------------------------------------
+def _read_frame(fc, fields, unique, where_clauses, chunk_size=None):
+    """reads the rows matching any of the where clauses into one DataFrame"""
+    parts = []
+    with stage("load") as span:
+        for where_clause in where_clauses:
+            for chunk in cursor_chunks(fc, fields, unique, chunk_size,
+                                       where_clause=where_clause):
+                parts.append(chunk)
+        span.rows = sum(len(part) for part in parts)
+    if len(parts) == 0:
+        columns = [unique] + ['SHAPE' if field.upper().startswith('SHAPE@') else field
+                              for field in fields if field != unique]
+        return pd.DataFrame(columns=columns)
+    with stage("dedupe"):
+        df = pd.concat(parts, ignore_index=True)
+        return df[~df[unique].duplicated(keep=False)]
+#--------------------------------------------------------------------------
+def _output_fc(template, out_db, name, add_fields=None):
+    """existing output feature class, created when it is missing"""
+    out_fc = os.path.join(out_db, name)
+    if get_backend(out_fc).exists(out_fc):
+        return out_fc
+    return create_output_fc(template, out_db, name, add_fields=add_fields)
+#--------------------------------------------------------------------------
+def _remove_ids(path, unique, ids):
+    """deletes the rows of the given IDs from the output of an earlier run"""
+    if len(ids) == 0:
+        return
+    if path.lower().endswith('.npz'):
+        if os.path.isfile(path):
+            array = load_columns(path)
+            save_columns(path, array[~np.isin(array[unique], np.asarray(ids))])
+        return
+    backend = get_backend(path)
+    if not backend.exists(path):
+        return
+    for where_clause in in_clauses(unique, ids):
+        backend.delete_rows(path, where_clause)
+#--------------------------------------------------------------------------
+def incremental_comparison(in_old, in_new, unique, out_db, change_table,
+                           watermark_field=None, chunk_size=None):
+    """
+    compares only the rows of in_new edited since the previous run and
+    updates the outputs of that run. Every ID edited, added or deleted
+    since then is compared again and its earlier output rows are
+    replaced, so the outputs match a full comparison of in_old with the
+    current in_new: an ID added by an earlier run and deleted since
+    leaves added_features without reaching deleted_features. The state
+    is only used against the same, unmodified in_old; a rolled baseline,
+    or one without a file system modification time, runs the full
+    streaming comparison, which also saves a new state.
+    Inputs:
+     watermark_field - edit date or ObjectID field, rows at or above the
+                       saved watermark are compared. Defaults to the
+                       ObjectID field, which only finds inserted rows.
+    Output:
+     True if any attribute changes were written to change_table
+    """
+    fields_old = field_names(in_old, editable_only=True)
+    fields = [name for name in field_names(in_new, editable_only=True)
+              if name in fields_old]
+    compared = [field for field in fields if field != unique]
+    if watermark_field is None:
+        watermark_field = describe(in_new).OIDFieldName
+    read_fields = fields + [field for field in [watermark_field]
+                            if field not in fields and field != unique]
+    path = state_path(out_db, in_new)
+    old_modified = modified_time(in_old)
+    state = load_state(path, in_new, fields, watermark_field, in_old, old_modified)
+
+    if state is None:
+        add_message("No Incremental State, Comparing Every Row: %s" % path)
+        # Rows Kept From Runs Against Another Baseline Would Linger
+        for output in [os.path.join(out_db, name) for name in
+                       ("deleted_features", "added_features", "changed_features")] + \
+                      [change_table]:
+            if output.lower().endswith('.npz'):
+                if os.path.isfile(output):
+                    os.remove(output)
+            elif get_backend(output).exists(output):
+                get_backend(output).delete(output)
+        changes = stream_comparison(in_old, in_new, unique, out_db, change_table,
+                                    chunk_size)
+        parts = []
+        watermark = None
+        for chunk in timed_chunks("digest", cursor_chunks(in_new, read_fields, unique,
+                                                          chunk_size)):
+            parts.append(pd.Series(stable_digests(chunk, compared),
+                                   index=chunk[unique].values))
+            watermark = max_watermark(chunk[watermark_field].values, watermark)
+            del chunk
+        digests = pd.concat(parts) if len(parts) > 0 else pd.Series([], dtype=np.uint64)
+        digests = digests[~digests.index.duplicated(keep=False)]
+        save_state(path, digests, watermark, in_new, fields, watermark_field,
+                   in_old, old_modified)
+        return changes
+
+    digests, watermark = state
+    if watermark is None:
+        clauses = [None]
+    else:
+        clauses = [watermark_clause(watermark_field, watermark)]
+    touched = _read_frame(in_new, read_fields + ['SHAPE@WKB'], unique, clauses, chunk_size)
+    # Deleted Features Never Reach the Watermark, Only Their IDs Are Read
+    new_ids = [chunk[unique].values for chunk in timed_chunks("load",
+                                                              cursor_chunks(in_new, [unique],
+                                                                            unique, chunk_size))]
+    new_ids = pd.Index(np.concatenate(new_ids) if len(new_ids) > 0 else [])
+    dels = digests.index.difference(new_ids)
+
+    with stage("digest", len(touched)):
+        touched_digests = pd.Series(stable_digests(touched, compared),
+                                    index=touched[unique].values)
+        known = touched_digests.index.isin(digests.index)
+        suspect = touched_digests.index[known][
+            touched_digests.values[known] != digests.reindex(touched_digests.index[known]).values]
+        edited = suspect.append(touched_digests.index[~known])
+    # Added IDs Are Looked Up Too, They May Have Been Deleted by an Earlier Run
+    redo = edited.append(dels)
+    old = _read_frame(in_old, fields + ['SHAPE@WKB'], unique,
+                      in_clauses(unique, redo), chunk_size)
+    in_old_ids = pd.Index(old[unique].values)
+    output_columns = [column for column in touched.columns
+                      if column in fields or column in (unique, 'SHAPE')]
+    current = touched.loc[touched[unique].isin(edited), output_columns]
+
+    with stage("remove", len(redo)):
+        for name in ("deleted_features", "added_features", "changed_features"):
+            _remove_ids(os.path.join(out_db, name), unique, redo)
+        _remove_ids(change_table, unique, redo)
+    deletes = old[old[unique].isin(dels)]
+    adds = current[~current[unique].isin(in_old_ids)]
+    with stage("export"):
+        for name, template, df in [("deleted_features", in_old, deletes),
+                                   ("added_features", in_new, adds)]:
+            if len(df) > 0:
+                insert_frame(_output_fc(template, out_db, name), df)
+    changes = False
+    new_chg = current[current[unique].isin(in_old_ids)]
+    old_chg = old[old[unique].isin(new_chg[unique])]
+    if len(new_chg) > 0:
+        with stage("compare", len(new_chg)):
+            df_changes = compare_attributes(old_chg, new_chg, unique, fields)
+        if len(df_changes) > 0:
+            with stage("export", len(df_changes)):
+                changed = changed_features(new_chg, unique, df_changes)
+                insert_frame(_output_fc(in_new, out_db, "changed_features",
+                                        add_fields=[('Edit_Count', 'LONG')]),
+                             changed, rename={'Edit Count': 'Edit_Count'})
+                changes = write_frame(df_changes, change_table, index=True,
+                                      append=True, text_width=TEXT_WIDTH) is not None
+    add_message("Incremental Comparison: %s Edited, %s Added, %s Deleted, %s Modified" %
+                     (len(touched), len(adds), len(deletes), len(new_chg)))
+
+    digests = pd.concat([digests[~digests.index.isin(touched_digests.index) & \
+                                 ~digests.index.isin(dels)],
+                         touched_digests]).sort_index()
+    watermark = max_watermark(touched[watermark_field].values, watermark)
+    save_state(path, digests, watermark, in_new, fields, watermark_field,
+               in_old, old_modified)
+    return changes
 #--------------------------------------------------------------------------
 def main(*argv):
     """ main driver of program """
@@ -122,6 +365,7 @@ def main(*argv):
             in_old = argv[1]
             unique = argv[2]
             out_db = argv[3]
+            t_flag = 'fc'
 
         else:
 
@@ -135,98 +379,108 @@ def main(*argv):
             if t_flag.lower() not in ['fc', 'fs', 'sdf']:
                 raise Exception('Input Type Not In Accepted Options: fc | fs | sdf')
 
+        # Optional Streaming Mode (Feature Classes Only), "incremental"
+        # Only Compares the Rows Edited Since the Previous Run
+        mode = str(argv[5]).lower() if len(argv) > 5 else ""
+        streaming = mode == "true"
+        incremental = mode == "incremental"
+        # Optional Snapshot Cache Folder for the Old Feature Class (Streams)
+        cache_dir = argv[6] if len(argv) > 6 and argv[6] else None
+        streaming = streaming or cache_dir is not None
+        # Optional Edit Date or ObjectID Watermark Field (Incremental Mode)
+        watermark_field = argv[7] if len(argv) > 7 and argv[7] else None
+
         #  Local Variables
         out_table    = os.path.join(out_db, "InformationTable")
         out_fc       = os.path.join(out_db, "changed_features")
-        change_csv   = os.path.join(arcpy.env.scratchFolder, "changes.csv")
         change_table = os.path.join(out_db, "change_table")
+        dup_table    = os.path.join(out_db, "duplicate_ids")
+        start_profile("uid_attribute_checking",
+                      profile_path(out_db, "uid_attribute_checking"))
 
         # Remove Existing Files
-        for target in [out_fc, out_table]:
+        targets = [out_table, dup_table]
+        if not incremental:
+            targets += [out_fc, change_table]
+        for target in targets:
             if arcpy.Exists(target):
                 arcpy.Delete_management(target)
 
         # Create Information Table (Overview of Differences)
         if t_flag!= 'sdf':
-            build_information_table(out_db, in_new, in_old)
+            with stage("information"):
+                build_information_table(out_db, in_new, in_old)
+
+            if incremental and t_flag == 'fc':
+                incremental_comparison(in_old, in_new, unique, out_db,
+                                       change_table,
+                                       watermark_field=watermark_field)
+                arcpy.AddMessage('Done.')
+                return
+
+            if streaming:
+                stream_comparison(in_old, in_new, unique, out_db, change_table,
+                                  cache_dir=cache_dir)
+                arcpy.AddMessage('Done.')
+                return
 
             # Create SpatialDataFrame Objects
-            old_sdf = arcgis.features.SpatialDataFrame.from_featureclass(in_old)
-            new_sdf = arcgis.features.SpatialDataFrame.from_featureclass(in_new)
+            with stage("load") as span:
+                old_sdf = arcgis.features.SpatialDataFrame.from_featureclass(in_old)
+                new_sdf = arcgis.features.SpatialDataFrame.from_featureclass(in_new)
+                span.rows = len(old_sdf) + len(new_sdf)
         else:
             old_sdf=in_old
             new_sdf=in_new
 
         # Remove Duplicate Values in old_sdf/new_sdf
-        for sdf_set in [[old_sdf, in_old], [new_sdf, in_new]]:
-            handle_duplicates(sdf_set, unique, t_flag)
+        with stage("dedupe", len(old_sdf) + len(new_sdf)):
+            duplicates = []
+            for name, sdf_set in [("old", [old_sdf, in_old]), ("new", [new_sdf, in_new])]:
+                duplicates.append((name, handle_duplicates(sdf_set, unique, t_flag)))
+            write_duplicates(dup_table, duplicates, unique)
 
         # Find Adds, Deletes and Matching Values
-        merged = pd.merge(old_sdf, new_sdf, on=[unique], how='outer', indicator=True)
-        adds    = merged.loc[merged['_merge'] == 'right_only']
-        deletes = merged.loc[merged['_merge'] == 'left_only']
-        if len(adds) > 0:
-            q = new_sdf[unique].isin(adds[unique].tolist())
-            new_sdf[q].to_featureclass(
-                out_location=out_db,
-                out_name="added_features",
-                overwrite=True,
-                skip_invalid=True
-            )
-        if len(deletes) > 0:
-            q = old_sdf[unique].isin(deletes[unique].tolist())
-            old_sdf[q].to_featureclass(
-                out_location=out_db,
-                out_name="deleted_features",
-                overwrite=True,
-                skip_invalid=True
-            )
+        with stage("merge", len(old_sdf) + len(new_sdf)):
+            merged = pd.merge(old_sdf, new_sdf, on=[unique], how='outer', indicator=True)
+            adds    = merged.loc[merged['_merge'] == 'right_only']
+            deletes = merged.loc[merged['_merge'] == 'left_only']
+        with stage("export", len(adds) + len(deletes)):
+            if len(adds) > 0:
+                q = new_sdf[unique].isin(adds[unique].tolist())
+                new_sdf[q].to_featureclass(
+                    out_location=out_db,
+                    out_name="added_features",
+                    overwrite=True,
+                    skip_invalid=True
+                )
+            if len(deletes) > 0:
+                q = old_sdf[unique].isin(deletes[unique].tolist())
+                old_sdf[q].to_featureclass(
+                    out_location=out_db,
+                    out_name="deleted_features",
+                    overwrite=True,
+                    skip_invalid=True
+                )
 
         # Assess Changed Features
         fields = [field for field in old_sdf.columns.tolist() if field in new_sdf.columns.tolist()]
         if 'SHAPE' in fields:
             fields.remove("SHAPE")
 
-        old_uids = set(old_sdf[unique].unique().tolist())
-        new_uids = set(new_sdf[unique].unique().tolist())
-        common_uids = list(new_uids.intersection(old_uids))
-        cq = new_sdf[unique].isin(common_uids)
-        cq1 = old_sdf[unique].isin(common_uids)
-        old_sdf = old_sdf[cq1].copy()
-        new_sdf = new_sdf[cq].copy()
-
-        new_sdf.index = new_sdf[unique]
-        old_sdf.index = old_sdf[unique]
-        old_sdf.sort_index(inplace=True)
-        new_sdf.sort_index(inplace=True)
-        ne_stacked = (old_sdf[fields] != new_sdf[fields]).stack()
-        changed = ne_stacked[ne_stacked]
-
-        changed.index.names = [unique, 'col']
-        difference_locations = np.where(old_sdf[fields] != new_sdf[fields])
-        changed_from = new_sdf[fields].values[difference_locations]
-        changed_to = old_sdf[fields].values[difference_locations]
-        df_new = pd.DataFrame({'from_val': changed_from, 'to_val': changed_to}, index=changed.index)
-        df_new.reset_index(level=['col'],inplace=True)
-        q3 = df_new['from_val'].isnull() & df_new['to_val'].isnull()
-        df_new[~q3].to_csv(change_csv)
-        joined_sdf = arcgis.features.SpatialDataFrame.merge(new_sdf, df_new[~q3], right_index=True, left_index=True)
-
-        q4 = joined_sdf['from_val'].isnull() & joined_sdf['to_val'].isnull()
-        stripped_sdf = joined_sdf[~q4]
-        stripped_sdf.drop('from_val', axis=1, inplace=True)
-        stripped_sdf.drop('to_val', axis=1, inplace=True)
-        stripped_sdf.drop('col', axis=1, inplace=True)
-        stripped_sdf['Edit Count'] = stripped_sdf.groupby([unique]).size()
-        stripped_sdf.drop_duplicates(subset=unique, keep='last', inplace=True)
-
-        stripped_sdf.to_featureclass(
-            out_location=out_db,
-            out_name="changed_features",
-            overwrite=True,
-            skip_invalid=True
-        )
-        arcpy.CopyRows_management(change_csv, change_table)
+        with stage("compare", len(old_sdf) + len(new_sdf)):
+            df_new = compare_attributes(old_sdf, new_sdf, unique, fields)
+
+        with stage("export", len(df_new)):
+            stripped_sdf = changed_features(new_sdf, unique, df_new)
+
+            stripped_sdf.to_featureclass(
+                out_location=out_db,
+                out_name="changed_features",
+                overwrite=True,
+                skip_invalid=True
+            )
+            write_frame(df_new, change_table, index=True)
 
         arcpy.AddMessage('Done.')
 
@@ -248,6 +502,8 @@ def main(*argv):
         arcpy.AddError("error on line: %s" % line)
         arcpy.AddError("error in file name: %s" % filename)
         arcpy.AddError("with error message: %s" % synerror)
+    finally:
+        finish_profile()
 #--------------------------------------------------------------------------
 if __name__ == "__main__":
     arcpy.env.overwriteOutput = True
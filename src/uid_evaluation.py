@@ -22,6 +22,10 @@ import arcgis
 import time
 import sys
 import os
+from diff_engine import compare_attributes, changed_features, drop_duplicate_ids, \
+     duplicate_table
+from geometry_compare import geometry_equal
+from stream_compare import layer_chunks, stream_attribute_changes, stream_geometry_status
 #--------------------------------------------------------------------------
 class FunctionError(Exception):
     """ raised when a function fails to run """
@@ -44,18 +48,38 @@ def trace():
     return line, __file__, synerror
 #--------------------------------------------------------------------------
 def handle_duplicates(in_sdf, unique):
-
-    drop_sdf = in_sdf.drop_duplicates(subset=unique, keep=False)
-
-    if len(in_sdf) != len(drop_sdf):
-        print('Dropping Duplicate Rows Based on Unique Field: {}'.format(unique))
-        in_sdf.drop_duplicates(subset=unique, keep=False, inplace=True)
+    """
+    drops the rows whose unique ID is duplicated in place and returns the
+    distinct duplicated IDs
+    """
+    dups = drop_duplicate_ids(in_sdf, unique)
+    if len(dups) > 0:
+        print('Dropping {} Duplicated IDs Based on Unique Field: {}'.format(len(dups), unique))
+    return dups
+#--------------------------------------------------------------------------
+def add_duplicate_table(duplicates, unique, gis):
+    """adds the dropped duplicate IDs to ArcGIS Online/Portal as a CSV"""
+    df = duplicate_table(duplicates, unique)
+    if len(df) == 0:
+        return None
+    handle, path = tempfile.mkstemp(suffix='.csv')
+    os.close(handle)
+    try:
+        df.to_csv(path, index=False)
+        return gis.content.add(
+            {'title': 'DuplicateIDs_{}'.format(time.time()), 'type': 'CSV', 'tags': 'GEOINT'},
+            data=path
+        )
+    finally:
+        os.remove(path)
 #--------------------------------------------------------------------------
 def att_run(old_sdf, new_sdf, unique, gis):
 
     # Remove Duplicate Row Based on Unique Field
-    for sdf in [old_sdf, new_sdf]:
-        handle_duplicates(sdf, unique)
+    duplicates = []
+    for name, sdf in [('old', old_sdf), ('new', new_sdf)]:
+        duplicates.append((name, handle_duplicates(sdf, unique)))
+    add_duplicate_table(duplicates, unique, gis)
 
     # Find Adds, Deletes and Matching Values
     merged  = pd.merge(old_sdf, new_sdf, on=[unique], how='outer', indicator=True)
@@ -89,49 +113,15 @@ def att_run(old_sdf, new_sdf, unique, gis):
         if field.lower() not in ['shape', 'objectid']
     ]
 
-    old_uids    = set(old_sdf[unique].unique().tolist())
-    new_uids    = set(new_sdf[unique].unique().tolist())
-    common_uids = list(new_uids.intersection(old_uids))
-    cq  = new_sdf[unique].isin(common_uids)
-    cq1 = old_sdf[unique].isin(common_uids)
-    old_sdf = old_sdf[cq1].copy()
-    new_sdf = new_sdf[cq].copy()
-
-    new_sdf.index = new_sdf[unique]
-    old_sdf.index = old_sdf[unique]
-    old_sdf.sort_index(inplace=True)
-    new_sdf.sort_index(inplace=True)
-    ne_stacked = (old_sdf[fields] != new_sdf[fields]).stack()
-    changed = ne_stacked[ne_stacked]
-
-    changed.index.names = [unique, 'col']
-    difference_locations = np.where(old_sdf[fields] != new_sdf[fields])
-    changed_from = new_sdf[fields].values[difference_locations]
-    changed_to = old_sdf[fields].values[difference_locations]
-    df_new = pd.DataFrame({'from_val': changed_from, 'to_val': changed_to}, index=changed.index)
-    df_new.reset_index(level=['col'],inplace=True)
-    q3 = df_new['from_val'].isnull() & df_new['to_val'].isnull()
+    df_new = compare_attributes(old_sdf, new_sdf, unique, fields)
 
     # Add Change CSV to AGOL
     gis.content.add(
         {'title': 'ChangeCSV_{}'.format(time.time()), 'type': 'CSV', 'tags': 'GEOINT'},
-        data=df_new[~q3].to_csv(tempfile.NamedTemporaryFile(mode='w', suffix='.csv', delete=True))
-    )
-
-    joined_sdf = arcgis.features.SpatialDataFrame.merge(
-        new_sdf,
-        df_new[~q3],
-        right_index=True,
-        left_index=True
+        data=df_new.to_csv(tempfile.NamedTemporaryFile(mode='w', suffix='.csv', delete=True))
     )
 
-    q4 = joined_sdf['from_val'].isnull() & joined_sdf['to_val'].isnull()
-    stripped_sdf = joined_sdf[~q4]
-    stripped_sdf.drop('from_val', axis=1, inplace=True)
-    stripped_sdf.drop('to_val', axis=1, inplace=True)
-    stripped_sdf.drop('col', axis=1, inplace=True)
-    stripped_sdf['Edit Count'] = stripped_sdf.groupby([unique]).size()
-    stripped_sdf.drop_duplicates(subset=unique, keep='last', inplace=True)
+    stripped_sdf = changed_features(new_sdf, unique, df_new)
 
     print('Creating Attribute Change Feature Layer')
     chg_lyr = stripped_sdf.to_featurelayer(
@@ -143,7 +133,7 @@ def att_run(old_sdf, new_sdf, unique, gis):
     # Return List of ArcGIS Online/Portal Items
     return [add_lyr, del_lyr, chg_lyr]
 #--------------------------------------------------------------------------
-def geo_run(old_sdf, new_sdf, unique, gis):
+def geo_run(old_sdf, new_sdf, unique, gis, xy_tolerance=None):
 
     # Find Added and Removed Features
     unew = set(new_sdf[unique].unique().tolist())
@@ -169,7 +159,7 @@ def geo_run(old_sdf, new_sdf, unique, gis):
     merged = pd.merge(df2, df1, on=[unique])
     merged.index = merged[unique]
     merged['STATUS'] = np.where(
-        merged['SHAPE_x'].equals(merged['SHAPE_y']),
+        geometry_equal(merged['SHAPE_y'].values, merged['SHAPE_x'].values, xy_tolerance),
         'GEOMETRY CONSISTENT', 'GEOMETRY MODIFIED'
     )
 
@@ -204,27 +194,121 @@ def geo_run(old_sdf, new_sdf, unique, gis):
 
     return spatial_lyr
 #--------------------------------------------------------------------------
-def handle_sdf_conversion(url_list, gis):
-    sdf_list = []
+def handle_layer_conversion(url_list, gis):
+    lyr_list = []
     for url in url_list:
         try:
             int(os.path.split(url)[0])
-            feat_lyr = arcgis.features.FeatureLayer(url, gis=gis)
-            sdf_list.append(arcgis.features.SpatialDataFrame.from_layer(feat_lyr))
+            lyr_list.append(arcgis.features.FeatureLayer(url, gis=gis))
         except ValueError:
-            feat_lyr = arcgis.features.FeatureLayer('{}/0'.format(url), gis=gis)
-            sdf_list.append(arcgis.features.SpatialDataFrame.from_layer(feat_lyr))
+            lyr_list.append(arcgis.features.FeatureLayer('{}/0'.format(url), gis=gis))
+
+    return lyr_list
+#--------------------------------------------------------------------------
+def handle_sdf_conversion(url_list, gis):
+    sdf_list = []
+    for feat_lyr in handle_layer_conversion(url_list, gis):
+        sdf_list.append(arcgis.features.SpatialDataFrame.from_layer(feat_lyr))
 
     return sdf_list
 #--------------------------------------------------------------------------
-def eval_service_attributes(old_url, new_url, unique, gis):
+def att_stream_run(old_lyr, new_lyr, unique, gis, chunk_size=None):
+    """
+    pages through both layers in unique ID order and only keeps the
+    additions, deletions and changes in memory
+    """
+    deletes, adds, changes, changed = [], [], [], []
+    for d_df, a_df, c_df, chg_df in stream_attribute_changes(
+            layer_chunks(old_lyr, unique, chunk_size),
+            layer_chunks(new_lyr, unique, chunk_size),
+            unique,
+            [field['name'] for field in new_lyr.properties.fields
+             if field['name'].lower() not in ['shape', 'objectid']]):
+        deletes.append(d_df)
+        adds.append(a_df)
+        if c_df is not None:
+            changes.append(c_df)
+            changed.append(chg_df)
+
+    add_lyr = None
+    adds = pd.concat(adds) if len(adds) > 0 else []
+    if len(adds) > 0:
+        print('Creating Additions Feature Layer')
+        add_lyr = adds.to_featurelayer(
+            'Attribute_Additions_{}'.format(time.time()),
+            gis=gis,
+            tags='GEOINT'
+        )
+
+    del_lyr = None
+    deletes = pd.concat(deletes) if len(deletes) > 0 else []
+    if len(deletes) > 0:
+        print('Creating Deletions Feature Layer')
+        del_lyr = deletes.to_featurelayer(
+            'Attribute_Deletions_{}'.format(time.time()),
+            gis=gis,
+            tags='GEOINT'
+        )
+
+    chg_lyr = None
+    if len(changes) > 0:
+        df_new = pd.concat(changes)
+
+        # Add Change CSV to AGOL
+        gis.content.add(
+            {'title': 'ChangeCSV_{}'.format(time.time()), 'type': 'CSV', 'tags': 'GEOINT'},
+            data=df_new.to_csv(tempfile.NamedTemporaryFile(mode='w', suffix='.csv', delete=True))
+        )
+
+        print('Creating Attribute Change Feature Layer')
+        chg_lyr = pd.concat(changed).to_featurelayer(
+            'Attribute_Changed_{}'.format(time.time()),
+            gis=gis,
+            tags='GEOINT'
+        )
+
+    # Return List of ArcGIS Online/Portal Items
+    return [add_lyr, del_lyr, chg_lyr]
+#--------------------------------------------------------------------------
+def geo_stream_run(old_lyr, new_lyr, unique, gis, chunk_size=None, xy_tolerance=None):
+    """
+    pages through both layers in unique ID order and classifies each
+    feature without holding both datasets in memory
+    """
+    joined = pd.concat(list(stream_geometry_status(
+        layer_chunks(old_lyr, unique, chunk_size),
+        layer_chunks(new_lyr, unique, chunk_size),
+        unique,
+        xy_tolerance=xy_tolerance
+    )), ignore_index=True)
+    print('Creating Spatial Change Feature Layer')
+    spatial_lyr = joined.to_featurelayer(
+        'Spatial_Updates_{}'.format(time.time()),
+        gis=gis,
+        tags='GEOINT'
+    )
+    del joined
+
+    return spatial_lyr
+#--------------------------------------------------------------------------
+def eval_service_attributes(old_url, new_url, unique, gis, streaming=False):
+
+    if streaming:
+        old_lyr, new_lyr = handle_layer_conversion([old_url, new_url], gis)
+        return att_stream_run(old_lyr, new_lyr, unique, gis)
 
     old_sdf, new_sdf = handle_sdf_conversion([old_url, new_url], gis)
 
     return att_run(old_sdf, new_sdf, unique, gis)
 #--------------------------------------------------------------------------
-def eval_service_geometries(old_url, new_url, unique, gis):
+def eval_service_geometries(old_url, new_url, unique, gis, streaming=False,
+                            xy_tolerance=None):
+
+    if streaming:
+        old_lyr, new_lyr = handle_layer_conversion([old_url, new_url], gis)
+        return geo_stream_run(old_lyr, new_lyr, unique, gis,
+                              xy_tolerance=xy_tolerance)
 
     old_sdf, new_sdf = handle_sdf_conversion([old_url, new_url], gis)
 
-    return geo_run(old_sdf, new_sdf, unique, gis)
+    return geo_run(old_sdf, new_sdf, unique, gis, xy_tolerance)
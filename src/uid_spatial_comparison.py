@@ -17,10 +17,27 @@ License:
 -----------------------------------------------------------------------------"""
 import pandas as pd
 import numpy as np
-import arcgis
-import arcpy
+try:
+    import arcgis
+except ImportError:
+    arcgis = None
+try:
+    import arcpy
+except ImportError:
+    # Without ArcGIS Only the io_backend Based Comparisons Can Run
+    arcpy = None
 import sys
 import os
+from geometry_compare import geometry_equal
+from fingerprint_index import index_path, dataset_quantum, build_fc_index, \
+     save_index, load_index, compare_indexes, select_geometries
+from stream_compare import cursor_chunks, stream_geometry_status, \
+     create_output_fc, insert_frame
+from snapshot_cache import snapshot_chunks
+from metadata_cache import modified_time
+from io_backend import get_backend, add_message
+from profiling import start_profile, finish_profile, profile_path, stage, \
+     timed_chunks
 
 #--------------------------------------------------------------------------
 class FunctionError(Exception):
@@ -44,9 +61,126 @@ def trace():
     return line, __file__, synerror
 
 #--------------------------------------------------------------------------
+def get_tolerance(argv, index):
+    """reads an optional XY tolerance argument, None when it is not set"""
+    if len(argv) > index and str(argv[index]).strip() not in ('', '#', 'None'):
+        return float(argv[index])
+    return None
+#--------------------------------------------------------------------------
+def get_mode(argv):
+    """reads the optional comparison mode: stream, fingerprint or None"""
+    if len(argv) > 5:
+        mode = str(argv[5]).lower().strip()
+        if mode in ('true', 'stream'):
+            return 'stream'
+        elif mode == 'fingerprint':
+            return 'fingerprint'
+    return None
+#--------------------------------------------------------------------------
+def stream_comparison(in_old, in_new, unique, out_db, chunk_size=None,
+                      xy_tolerance=None):
+    """
+    compares the geometries in unique ID sorted chunks and writes the
+    status of each feature to modifed_dataset_check as it goes, so
+    neither dataset is ever fully loaded into memory
+    """
+    fields = [unique, 'SHAPE@WKB']
+    old_chunks = timed_chunks("load", cursor_chunks(in_old, fields, unique, chunk_size))
+    new_chunks = timed_chunks("load", cursor_chunks(in_new, fields, unique, chunk_size))
+    out_fc = create_output_fc(in_new, out_db, "modifed_dataset_check",
+                              fields=[unique],
+                              add_fields=[('STATUS', 'TEXT')])
+    status = stream_geometry_status(old_chunks, new_chunks, unique,
+                                    xy_tolerance=xy_tolerance)
+    for df in timed_chunks("compare", status):
+        with stage("export", len(df)):
+            if len(df) > 0:
+                insert_frame(out_fc, df)
+        del df
+    return out_fc
+#--------------------------------------------------------------------------
+def snapshot_index(fc, unique, out_db, quantum, chunk_size=None, cache_dir=None,
+                   persist=True):
+    """
+    loads the fingerprint index of a snapshot, building it if needed. The
+    index is only saved and reused when persist is set and fc has a file
+    system modification time, edits of enterprise or service data could
+    not be detected otherwise.
+    """
+    modified = modified_time(fc)
+    if not persist or modified is None:
+        return build_fc_index(fc, unique, quantum, chunk_size, cache_dir)
+    path = index_path(out_db, fc)
+    count = get_backend(fc).count_rows(fc)
+    fingerprints = load_index(path, fc, quantum, count, modified)
+    if fingerprints is None:
+        add_message("Building Fingerprint Index: %s" % path)
+        fingerprints = build_fc_index(fc, unique, quantum, chunk_size, cache_dir)
+        save_index(path, fingerprints, fc, quantum, count, modified)
+    return fingerprints
+#--------------------------------------------------------------------------
+def fingerprint_comparison(in_old, in_new, unique, out_db, chunk_size=None,
+                           xy_tolerance=None, cache_dir=None):
+    """
+    compares the datasets through geometry fingerprint indexes. The
+    baseline index is stored next to out_db, built once and reused by
+    later runs, the index of in_new is built on every run; full geometries are only loaded for IDs whose fingerprints
+    differ, and only when an XY tolerance has to be checked. Features
+    sharing a unique ID are combined instead of dissolved. When cache_dir
+    is set the old feature class is read from its snapshot cache.
+    """
+    quantum = dataset_quantum(in_old)
+    with stage("index") as span:
+        old_index = snapshot_index(in_old, unique, out_db, quantum, chunk_size,
+                                   cache_dir)
+        new_index = snapshot_index(in_new, unique, out_db, quantum, chunk_size,
+                                   persist=False)
+        span.rows = len(old_index) + len(new_index)
+    with stage("compare", len(old_index) + len(new_index)):
+        adds, dels, modified = compare_indexes(old_index, new_index)
+    del old_index, new_index
+
+    # Confirm Fingerprint Mismatches Against the Full Geometries
+    if xy_tolerance and len(modified) > 0:
+        with stage("confirm", len(modified)):
+            old_geoms = select_geometries(in_old, unique, modified, chunk_size,
+                                          cache_dir)
+            new_geoms = select_geometries(in_new, unique, modified, chunk_size)
+            single = old_geoms.index.difference(
+                old_geoms.index[old_geoms.index.duplicated()].union(
+                    new_geoms.index[new_geoms.index.duplicated()]))
+            same = geometry_equal(old_geoms.reindex(single).values,
+                                  new_geoms.reindex(single).values,
+                                  xy_tolerance)
+            modified = pd.Index(modified).difference(single[same]).values
+            del old_geoms, new_geoms
+
+    out_fc = create_output_fc(in_new, out_db, "modifed_dataset_check",
+                              fields=[unique],
+                              add_fields=[('STATUS', 'TEXT')])
+    for chunk in timed_chunks("export", cursor_chunks(in_new, [unique, 'SHAPE@WKB'],
+                                                     unique, chunk_size)):
+        chunk['STATUS'] = np.where(chunk[unique].isin(adds), 'NEW FEATURE',
+                                   np.where(chunk[unique].isin(modified),
+                                            'GEOMETRY MODIFIED',
+                                            'GEOMETRY CONSISTENT'))
+        insert_frame(out_fc, chunk)
+        del chunk
+    if len(dels) > 0:
+        for chunk in timed_chunks("export", snapshot_chunks(in_old, [unique, 'SHAPE@WKB'],
+                                                            unique, cache_dir, chunk_size)):
+            chunk = chunk[chunk[unique].isin(dels)].copy()
+            chunk['STATUS'] = 'REMOVED FEATURE'
+            insert_frame(out_fc, chunk)
+            del chunk
+    return out_fc
+#--------------------------------------------------------------------------
 def main(*argv):
     """ main driver of program """
     try:
+        # argv[3] Is the Output Database in Every Mode
+        start_profile("uid_spatial_comparison",
+                      profile_path(argv[3], "uid_spatial_comparison"))
         if os.path.split(sys.executable)[1] == 'ArcGISPro.exe':
 
             # Expected Parameters
@@ -54,22 +188,38 @@ def main(*argv):
             in_old = argv[1]
             unique = argv[2]
             out_db = argv[3]
+            xy_tolerance = get_tolerance(argv, 6)
+            # Optional Snapshot Cache Folder for the Old Feature Class
+            cache_dir = argv[7] if len(argv) > 7 and argv[7] else None
+
+            if get_mode(argv) == 'fingerprint':
+                fingerprint_comparison(in_old, in_new, unique, out_db,
+                                       xy_tolerance=xy_tolerance,
+                                       cache_dir=cache_dir)
+                return
 
             scratch_gdb = arcpy.env.scratchGDB
             dis_new_path = os.path.join(scratch_gdb, "dis_new")
             dis_old_path = os.path.join(scratch_gdb, "dis_old")
 
-            dis_new = arcpy.Dissolve_management(
-                in_features=in_new,
-                out_feature_class=dis_new_path,
-                dissolve_field=unique
-            )[0]
-
-            dis_old = arcpy.Dissolve_management(
-                in_features=in_old,
-                out_feature_class=dis_old_path,
-                dissolve_field=unique
-            )[0]
+            with stage("dissolve"):
+                dis_new = arcpy.Dissolve_management(
+                    in_features=in_new,
+                    out_feature_class=dis_new_path,
+                    dissolve_field=unique
+                )[0]
+
+                dis_old = arcpy.Dissolve_management(
+                    in_features=in_old,
+                    out_feature_class=dis_old_path,
+                    dissolve_field=unique
+                )[0]
+
+            # Optional Streaming Mode
+            if get_mode(argv) == 'stream':
+                stream_comparison(dis_old, dis_new, unique, out_db,
+                                  xy_tolerance=xy_tolerance)
+                return
 
             new_sdf = arcgis.features.SpatialDataFrame.from_featureclass(dis_new)
             old_sdf = arcgis.features.SpatialDataFrame.from_featureclass(dis_old)
@@ -88,21 +238,38 @@ def main(*argv):
             else:
                 if t_flag.lower() == 'fc':
 
+                    xy_tolerance = get_tolerance(argv, 6)
+                    # Optional Snapshot Cache Folder for the Old Feature Class
+                    cache_dir = argv[7] if len(argv) > 7 and argv[7] else None
+
+                    if get_mode(argv) == 'fingerprint':
+                        fingerprint_comparison(in_old, in_new, unique, out_db,
+                                               xy_tolerance=xy_tolerance,
+                                               cache_dir=cache_dir)
+                        return
+
                     scratch_gdb = arcpy.env.scratchGDB
                     dis_new_path = os.path.join(scratch_gdb, "dis_new")
                     dis_old_path = os.path.join(scratch_gdb, "dis_old")
 
-                    dis_new = arcpy.Dissolve_management(
-                        in_features=in_new,
-                        out_feature_class=dis_new_path,
-                        dissolve_field=unique
-                    )[0]
-
-                    dis_old = arcpy.Dissolve_management(
-                        in_features=in_old,
-                        out_feature_class=dis_old_path,
-                        dissolve_field=unique
-                    )[0]
+                    with stage("dissolve"):
+                        dis_new = arcpy.Dissolve_management(
+                            in_features=in_new,
+                            out_feature_class=dis_new_path,
+                            dissolve_field=unique
+                        )[0]
+
+                        dis_old = arcpy.Dissolve_management(
+                            in_features=in_old,
+                            out_feature_class=dis_old_path,
+                            dissolve_field=unique
+                        )[0]
+
+                    # Optional Streaming Mode
+                    if get_mode(argv) == 'stream':
+                        stream_comparison(dis_old, dis_new, unique, out_db,
+                                  xy_tolerance=xy_tolerance)
+                        return
 
                     new_sdf = arcgis.features.SpatialDataFrame.from_featureclass(dis_new)
                     old_sdf = arcgis.features.SpatialDataFrame.from_featureclass(dis_old)
@@ -112,6 +279,7 @@ def main(*argv):
                     gis_url  = argv[5]
                     username = argv[6]
                     password = argv[7]
+                    xy_tolerance = get_tolerance(argv, 8)
 
                     gis = arcgis.gis.GIS(gis_url, username, password)
 
@@ -128,6 +296,7 @@ def main(*argv):
 
                 else:
 
+                    xy_tolerance = get_tolerance(argv, 5)
                     newcols = in_new.columns.get_values().tolist()
                     in_new.drop([col for col in newcols if col not in [unique, 'SHAPE']], axis=1, inplace=True)
                     new_sdf = in_new
@@ -136,46 +305,48 @@ def main(*argv):
                     in_old.drop([col for col in oldcols if col not in [unique, 'SHAPE']], axis=1, inplace=True)
                     old_sdf = in_old
 
-        # Find Added and Removed Features
-        unew = set(new_sdf[unique].unique().tolist())
-        uold = set(old_sdf[unique].unique().tolist())
-
-        adds = list(unew - uold)
-        dels = list(uold - unew)
-
-        old_df = old_sdf[old_sdf[unique].isin(dels)].copy()
-        old_df['STATUS'] = "REMOVED FEATURE"
-
-        new_df = new_sdf[new_sdf[unique].isin(adds)].copy()
-        new_df['STATUS'] = "NEW FEATURE"
-
-        # Find Geometry Differences
-        df2 = new_sdf[~new_sdf[unique].isin(adds)].copy()
-        df2.index = df2[unique]
-
-        df1 = old_sdf[~old_sdf[unique].isin(dels)].copy()
-        df1.index = df1[unique]
-
-        # Merge DataFrames & Assert Geometry Equality
-        merged = pd.merge(df2, df1, on=[unique])
-        merged.index = merged[unique]
-        merged['STATUS'] = np.where(
-            merged['SHAPE_x'].equals(merged['SHAPE_y']),
-            'GEOMETRY CONSISTENT', 'GEOMETRY MODIFIED'
-        )
-
-        # Drop MISC Fields Created During Join - Keep SHAPE For DF2/SHAPE_X
-        merged['SHAPE'] = merged['SHAPE_x']
-        merged.drop('SHAPE_x', axis=1, inplace=True)
-        merged.drop('SHAPE_y', axis=1, inplace=True)
-        merged.drop('OBJECTID_x', axis=1, inplace=True)
-        merged.drop('OBJECTID_y', axis=1, inplace=True)
-        merged.reset_index(inplace=True, drop=True)
-
-        # Join 3 Analysis DataFrames & Export to Feature Class
-        joined = pd.concat([merged, old_df, new_df])
-        joined.reset_index(inplace=True, drop=True)
-        joined.to_featureclass(out_db, "modifed_dataset_check")
+        with stage("compare", len(new_sdf) + len(old_sdf)):
+            # Find Added and Removed Features
+            unew = set(new_sdf[unique].unique().tolist())
+            uold = set(old_sdf[unique].unique().tolist())
+
+            adds = list(unew - uold)
+            dels = list(uold - unew)
+
+            old_df = old_sdf[old_sdf[unique].isin(dels)].copy()
+            old_df['STATUS'] = "REMOVED FEATURE"
+
+            new_df = new_sdf[new_sdf[unique].isin(adds)].copy()
+            new_df['STATUS'] = "NEW FEATURE"
+
+            # Find Geometry Differences
+            df2 = new_sdf[~new_sdf[unique].isin(adds)].copy()
+            df2.index = df2[unique]
+
+            df1 = old_sdf[~old_sdf[unique].isin(dels)].copy()
+            df1.index = df1[unique]
+
+            # Merge DataFrames & Assert Geometry Equality
+            merged = pd.merge(df2, df1, on=[unique])
+            merged.index = merged[unique]
+            merged['STATUS'] = np.where(
+                geometry_equal(merged['SHAPE_y'].values, merged['SHAPE_x'].values, xy_tolerance),
+                'GEOMETRY CONSISTENT', 'GEOMETRY MODIFIED'
+            )
+
+            # Drop MISC Fields Created During Join - Keep SHAPE For DF2/SHAPE_X
+            merged['SHAPE'] = merged['SHAPE_x']
+            merged.drop('SHAPE_x', axis=1, inplace=True)
+            merged.drop('SHAPE_y', axis=1, inplace=True)
+            merged.drop('OBJECTID_x', axis=1, inplace=True)
+            merged.drop('OBJECTID_y', axis=1, inplace=True)
+            merged.reset_index(inplace=True, drop=True)
+
+        with stage("export"):
+            # Join 3 Analysis DataFrames & Export to Feature Class
+            joined = pd.concat([merged, old_df, new_df])
+            joined.reset_index(inplace=True, drop=True)
+            joined.to_featureclass(out_db, "modifed_dataset_check")
 
         # Cleanup
         del new_sdf
@@ -205,6 +376,8 @@ def main(*argv):
         arcpy.AddError("error on line: %s" % line)
         arcpy.AddError("error in file name: %s" % filename)
         arcpy.AddError("with error message: %s" % synerror)
+    finally:
+        finish_profile()
 #--------------------------------------------------------------------------
 if __name__ == "__main__":
     arcpy.env.overwriteOutput = True
@@ -0,0 +1,344 @@
+"""-----------------------------------------------------------------------------
+Name: where_clause.py
+Purpose: Evaluates SQL where clauses as vectorized masks.
+Description: Parses the subset of SQL used by the metric spreadsheets and
+        the sanitize tools (comparisons, IN, LIKE, BETWEEN, IS NULL, AND,
+        OR, NOT and parentheses) so many where clauses can be evaluated
+        against columns that were read from a table once. Evaluation
+        follows SQL three valued logic, comparisons with NULL are neither
+        true nor false. Literals are converted to the types of the fields
+        they are compared with by bind, as the database would. Anything
+        outside the subset, and literals that do not convert, raise a
+        ValueError so callers can fall back to a where clause cursor.
+Requirements: Python 2.7.x/Python3.x
+Copyright: Esri
+License:
+-----------------------------------------------------------------------------"""
+import re
+import datetime
+import operator
+
+import numpy as np
+import pandas as pd
+
+_TOKENS = re.compile(r"""\s*(?:
+    (?P<number>-?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)
+   |(?P<string>'(?:[^']|'')*')
+   |(?P<quoted>"[^"]+"|\[[^\]]+\])
+   |(?P<op><>|!=|<=|>=|=|<|>)
+   |(?P<punct>[(),])
+   |(?P<word>[A-Za-z_][A-Za-z0-9_.]*)
+)""", re.VERBOSE)
+_KEYWORDS = ('AND', 'OR', 'NOT', 'IS', 'NULL', 'IN', 'LIKE', 'BETWEEN')
+# Comparable Kind of Each Geodatabase Field Type
+_KINDS = {
+    'OID' : 'number',
+    'SmallInteger' : 'number',
+    'Integer' : 'number',
+    'BigInteger' : 'number',
+    'Single' : 'number',
+    'Double' : 'number',
+    'String' : 'text',
+    'GUID' : 'text',
+    'GlobalID' : 'text',
+    'Date' : 'date'
+}
+_OPERATORS = {
+    '=' : operator.eq,
+    '<>' : operator.ne,
+    '!=' : operator.ne,
+    '<' : operator.lt,
+    '<=' : operator.le,
+    '>' : operator.gt,
+    '>=' : operator.ge
+}
+#--------------------------------------------------------------------------
+def tokenize(sql):
+    """splits a where clause into (kind, value) tokens"""
+    tokens = []
+    pos = 0
+    sql = sql.rstrip()
+    while pos < len(sql):
+        match = _TOKENS.match(sql, pos)
+        if match is None or match.end() == pos:
+            raise ValueError("Unsupported Where Clause Syntax: %s" % sql[pos:])
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'number':
+            value = float(value) if re.search(r'[.eE]', value) else int(value)
+        elif kind == 'string':
+            value = value[1:-1].replace("''", "'")
+        elif kind == 'quoted':
+            kind, value = 'word', value[1:-1]
+        elif kind == 'word' and value.upper() in _KEYWORDS:
+            kind, value = 'keyword', value.upper()
+        tokens.append((kind, value))
+        pos = match.end()
+    return tokens
+#--------------------------------------------------------------------------
+def _like_pattern(pattern):
+    """converts a SQL LIKE pattern into a compiled regular expression"""
+    parts = []
+    for char in pattern:
+        if char == '%':
+            parts.append('.*')
+        elif char == '_':
+            parts.append('.')
+        else:
+            parts.append(re.escape(char))
+    return re.compile(''.join(parts) + r'\Z', re.DOTALL)
+#--------------------------------------------------------------------------
+class WhereClause(object):
+    """
+    a parsed where clause
+    Usage:
+     clause = WhereClause("FCSubtype = 5 and F_CODE = 'AL013'")
+     clause.bind({'FCSUBTYPE' : 'Integer', 'F_CODE' : 'String'})
+     mask = clause.mask({'FCSUBTYPE' : subtypes, 'F_CODE' : fcodes}, n)
+    Column keys are upper case field names.
+    """
+    def __init__(self, sql):
+        self.sql = sql
+        self._tokens = tokenize(sql or "")
+        self._pos = 0
+        self.fields = []
+        if len(self._tokens) == 0:
+            self._tree = ('all',)
+        else:
+            self._tree = self._or()
+            if self._pos != len(self._tokens):
+                raise ValueError("Unsupported Where Clause Syntax: %s" % sql)
+    #----------------------------------------------------------------------
+    def _peek(self, kind=None, value=None):
+        if self._pos >= len(self._tokens):
+            return False
+        tkind, tvalue = self._tokens[self._pos]
+        return (kind is None or tkind == kind) and \
+               (value is None or tvalue == value)
+    #----------------------------------------------------------------------
+    def _take(self, kind=None, value=None):
+        if not self._peek(kind, value):
+            raise ValueError("Unsupported Where Clause Syntax: %s" % self.sql)
+        token = self._tokens[self._pos]
+        self._pos += 1
+        return token[1]
+    #----------------------------------------------------------------------
+    def _or(self):
+        node = self._and()
+        while self._peek('keyword', 'OR'):
+            self._take()
+            node = ('or', node, self._and())
+        return node
+    #----------------------------------------------------------------------
+    def _and(self):
+        node = self._not()
+        while self._peek('keyword', 'AND'):
+            self._take()
+            node = ('and', node, self._not())
+        return node
+    #----------------------------------------------------------------------
+    def _not(self):
+        if self._peek('keyword', 'NOT'):
+            self._take()
+            return ('not', self._not())
+        if self._peek('punct', '('):
+            self._take()
+            node = self._or()
+            self._take('punct', ')')
+            return node
+        return self._predicate()
+    #----------------------------------------------------------------------
+    def _operand(self):
+        if self._peek('word'):
+            name = self._take().upper()
+            if name not in self.fields:
+                self.fields.append(name)
+            return ('field', name)
+        if self._peek('number') or self._peek('string'):
+            return ('value', self._take())
+        if self._peek('keyword', 'NULL'):
+            self._take()
+            return ('value', None)
+        raise ValueError("Unsupported Where Clause Syntax: %s" % self.sql)
+    #----------------------------------------------------------------------
+    def _predicate(self):
+        left = self._operand()
+        if self._peek('op'):
+            op = self._take()
+            return ('compare', _OPERATORS[op], left, self._operand())
+        if self._peek('keyword', 'IS'):
+            self._take()
+            negate = self._peek('keyword', 'NOT')
+            if negate:
+                self._take()
+            self._take('keyword', 'NULL')
+            node = ('null', left)
+            return ('not', node) if negate else node
+        negate = self._peek('keyword', 'NOT')
+        if negate:
+            self._take()
+        if self._peek('keyword', 'IN'):
+            self._take()
+            self._take('punct', '(')
+            values = [self._operand()]
+            while self._peek('punct', ','):
+                self._take()
+                values.append(self._operand())
+            self._take('punct', ')')
+            if any(kind != 'value' for kind, _ in values):
+                raise ValueError("Unsupported Where Clause Syntax: %s" % self.sql)
+            node = ('in', left, [value for _, value in values])
+        elif self._peek('keyword', 'LIKE'):
+            self._take()
+            node = ('like', left, _like_pattern(self._take('string')))
+        elif self._peek('keyword', 'BETWEEN'):
+            self._take()
+            low = self._operand()
+            self._take('keyword', 'AND')
+            high = self._operand()
+            node = ('and',
+                    ('compare', operator.ge, left, low),
+                    ('compare', operator.le, left, high))
+        else:
+            raise ValueError("Unsupported Where Clause Syntax: %s" % self.sql)
+        return ('not', node) if negate else node
+    #----------------------------------------------------------------------
+    def bind(self, field_types):
+        """
+        converts the literals to the types of the fields they are compared
+        with, so FCSubtype = '5' matches an integer field
+        Inputs:
+         field_types - dict of upper case field name to field type
+        Output:
+         self, a ValueError is raised for unknown fields, literals that
+         do not convert and comparisons of fields of different kinds
+        """
+        for name in self.fields:
+            if name not in field_types:
+                raise ValueError("Unknown Field %s In: %s" % (name, self.sql))
+        kinds = dict((name, _KINDS.get(field_types[name])) for name in self.fields)
+        self._tree = self._bind(self._tree, kinds)
+        return self
+    #----------------------------------------------------------------------
+    def _bind(self, node, kinds):
+        kind = node[0]
+        if kind in ('and', 'or'):
+            return (kind, self._bind(node[1], kinds), self._bind(node[2], kinds))
+        if kind == 'not':
+            return (kind, self._bind(node[1], kinds))
+        if kind == 'compare':
+            func, left, right = node[1:]
+            if left[0] == 'field' and right[0] == 'field':
+                if kinds[left[1]] is None or kinds[left[1]] != kinds[right[1]]:
+                    raise ValueError("Cannot Compare Fields In: %s" % self.sql)
+                return node
+            if left[0] == 'field':
+                right = ('value', self._literal(right[1], kinds[left[1]]))
+            elif right[0] == 'field':
+                left = ('value', self._literal(left[1], kinds[right[1]]))
+            return (kind, func, left, right)
+        if kind == 'in':
+            return (kind, node[1], [self._literal(value, kinds[node[1][1]])
+                                    for value in node[2]])
+        return node
+    #----------------------------------------------------------------------
+    def _literal(self, value, kind):
+        """value converted to a field kind"""
+        if value is None:
+            return None
+        if kind == 'number':
+            if isinstance(value, str):
+                try:
+                    number = float(value)
+                except ValueError:
+                    raise ValueError("Cannot Compare %r With a Number In: %s" %
+                                     (value, self.sql))
+                return int(number) if number.is_integer() else number
+            return value
+        if kind == 'text' and isinstance(value, str):
+            return value
+        if kind == 'date' and isinstance(value, datetime.datetime):
+            return value
+        if kind == 'date' and isinstance(value, str):
+            try:
+                return pd.Timestamp(value).to_pydatetime()
+            except ValueError:
+                raise ValueError("Cannot Compare %r With a Date In: %s" %
+                                 (value, self.sql))
+        raise ValueError("Cannot Compare %r In: %s" % (value, self.sql))
+    #----------------------------------------------------------------------
+    def _evaluate(self, node, columns, n):
+        """returns the (true, false) masks of a node"""
+        kind = node[0]
+        if kind == 'all':
+            return np.ones(n, dtype=bool), np.zeros(n, dtype=bool)
+        if kind == 'and':
+            t1, f1 = self._evaluate(node[1], columns, n)
+            t2, f2 = self._evaluate(node[2], columns, n)
+            return t1 & t2, f1 | f2
+        if kind == 'or':
+            t1, f1 = self._evaluate(node[1], columns, n)
+            t2, f2 = self._evaluate(node[2], columns, n)
+            return t1 | t2, f1 & f2
+        if kind == 'not':
+            t, f = self._evaluate(node[1], columns, n)
+            return f, t
+        if kind == 'null':
+            null = ~self._valid(node[1], columns, n)
+            return null, ~null
+        if kind == 'compare':
+            func, left, right = node[1:]
+            valid = self._valid(left, columns, n) & self._valid(right, columns, n)
+            idx = np.flatnonzero(valid)
+            result = np.zeros(n, dtype=bool)
+            if len(idx) > 0:
+                try:
+                    result[idx] = func(self._values(left, columns, idx),
+                                       self._values(right, columns, idx))
+                except TypeError:
+                    raise ValueError("Cannot Compare Values In: %s" % self.sql)
+            return result, valid & ~result
+        valid = self._valid(node[1], columns, n)
+        idx = np.flatnonzero(valid)
+        result = np.zeros(n, dtype=bool)
+        values = self._values(node[1], columns, idx)
+        if kind == 'in':
+            result[idx] = pd.Series(values).isin(
+                [v for v in node[2] if v is not None]).values
+            if any(v is None for v in node[2]):
+                # x IN (..., NULL) Is Unknown, Never False, When x Matches Nothing
+                return result, np.zeros(n, dtype=bool)
+        else:
+            pattern = node[2]
+            result[idx] = np.fromiter((pattern.match(str(v)) is not None
+                                       for v in values),
+                                      dtype=bool, count=len(idx))
+        return result, valid & ~result
+    #----------------------------------------------------------------------
+    def _column(self, name, columns):
+        if name not in columns:
+            raise ValueError("Field %s Was Not Read" % name)
+        return columns[name]
+    #----------------------------------------------------------------------
+    def _valid(self, operand, columns, n):
+        kind, value = operand
+        if kind == 'value':
+            return np.full(n, value is not None)
+        return np.asarray(pd.notnull(self._column(value, columns)))
+    #----------------------------------------------------------------------
+    def _values(self, operand, columns, idx):
+        kind, value = operand
+        if kind == 'value':
+            return value
+        return np.asarray(self._column(value, columns))[idx]
+    #----------------------------------------------------------------------
+    def mask(self, columns, n):
+        """
+        evaluates the where clause
+        Inputs:
+         columns - dict of upper case field name to array
+         n - number of rows
+        Output:
+         boolean array, True where the clause is true
+        """
+        return self._evaluate(self._tree, columns, n)[0]
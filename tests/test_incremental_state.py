@@ -0,0 +1,61 @@
+"""
+incremental_comparison must not reuse a state saved against another
+baseline. Runs on GeoPackage snapshots, ArcGIS is not needed.
+"""
+import os
+import sys
+import time
+import shutil
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import benchmark
+import metadata_cache
+from io_backend import get_backend
+from incremental_state import state_path, load_state
+from uid_attribute_checking import incremental_comparison
+
+OUTPUTS = ('added_features', 'deleted_features', 'changed_features', 'change_table')
+#--------------------------------------------------------------------------
+def _run(in_old, in_new, out_db):
+    metadata_cache.clear_cache()
+    incremental_comparison(in_old, in_new, 'UID', out_db,
+                           os.path.join(out_db, 'change_table'),
+                           watermark_field='EDITED')
+    counts = {}
+    for name in OUTPUTS:
+        path = os.path.join(out_db, name)
+        backend = get_backend(path)
+        counts[name] = backend.count_rows(path) if backend.exists(path) else 0
+    return counts
+#--------------------------------------------------------------------------
+def test_swapped_baseline_is_compared_in_full(tmp_path):
+    folder = str(tmp_path)
+    in_old, in_new = benchmark.synthetic_pair(folder, 500, 'POINT', 3)
+    out_db = os.path.join(folder, 'out.gpkg')
+    first = _run(in_old, in_new, out_db)
+    assert first['changed_features'] > 0 and first['change_table'] > 0
+
+    # Yesterday's Snapshot Becomes the Baseline, Nothing Differs From It
+    rolled = os.path.join(folder, 'rolled.gpkg')
+    shutil.copyfile(os.path.dirname(in_new), rolled)
+    assert _run(rolled + '/features', in_new, out_db) == dict((name, 0) for name in OUTPUTS)
+
+    # Swapping Back Compares Every Row Against the Original Baseline Again
+    assert _run(in_old, in_new, out_db) == first
+#--------------------------------------------------------------------------
+def test_baseline_overwritten_in_place_invalidates_state(tmp_path):
+    folder = str(tmp_path)
+    in_old, in_new = benchmark.synthetic_pair(folder, 500, 'POINT', 3)
+    out_db = os.path.join(folder, 'out.gpkg')
+    _run(in_old, in_new, out_db)
+    path = state_path(out_db, in_new)
+    fields = metadata_cache.field_names(in_new, editable_only=True)
+    assert load_state(path, in_new, fields, 'EDITED', in_old,
+                      metadata_cache.modified_time(in_old)) is not None
+    time.sleep(0.05)
+    shutil.copyfile(os.path.dirname(in_new), os.path.dirname(in_old))
+    metadata_cache.clear_cache()
+    assert load_state(path, in_new, fields, 'EDITED', in_old,
+                      metadata_cache.modified_time(in_old)) is None
+    assert _run(in_old, in_new, out_db) == dict((name, 0) for name in OUTPUTS)